@@ -0,0 +1,175 @@
+"""
+Read replica routing.
+
+Writes and, by default, reads go to `default`. Views opt in with ReplicaReadMixin, which
+routes the ORM reads of a safe request to a healthy replica from settings.DATABASE_REPLICAS.
+Users who wrote in the last REPLICA_STICKY_SECONDS keep reading from the primary, so they
+see their own writes despite replication lag. A replica that fails to connect is skipped for
+REPLICA_RETRY_SECONDS and the request falls back to the primary. The replica is picked on
+the request's first ORM read, so requests answered without one connect to none.
+"""
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, InterfaceError, OperationalError, connections
+from rest_framework.permissions import SAFE_METHODS
+
+logger = logging.getLogger(__name__)
+
+_read_alias = ContextVar("db_read_alias", default=None)
+# alias -> monotonic time until which it is considered down, per process
+_unavailable = {}
+
+
+def replica_aliases():
+    return list(getattr(settings, "DATABASE_REPLICAS", []))
+
+def mark_unavailable(alias):
+    _unavailable[alias] = time.monotonic() + settings.REPLICA_RETRY_SECONDS
+    logger.warning("Database replica %s unavailable, reading from primary for %ss", alias, settings.REPLICA_RETRY_SECONDS)
+
+def _is_available(alias):
+    if _unavailable.get(alias, 0) > time.monotonic():
+        return False
+    try:
+        connections[alias].ensure_connection()
+    except (OperationalError, InterfaceError):
+        mark_unavailable(alias)
+        return False
+    _unavailable.pop(alias, None)
+    return True
+
+def choose_replica():
+    """A random healthy replica alias, or None when there are none."""
+    candidates = replica_aliases()
+    random.shuffle(candidates)
+    return next((alias for alias in candidates if _is_available(alias)), None)
+
+class LazyReplica:
+    """A replica alias chosen on first use."""
+    def __init__(self):
+        self.alias = None
+        self.chosen = False
+
+    def choose(self):
+        if not self.chosen:
+            self.alias = choose_replica()
+            self.chosen = True
+        return self.alias
+
+def routed_replica():
+    """The replica this context's reads go to, choosing it if still pending; None for the primary."""
+    alias = _read_alias.get()
+    return alias.choose() if isinstance(alias, LazyReplica) else alias
+
+@contextmanager
+def read_from(alias):
+    """Routes ORM reads inside the block to `alias` (None means the primary)."""
+    token = _read_alias.set(alias)
+    try:
+        yield alias
+    finally:
+        _read_alias.reset(token)
+
+
+def wal_position():
+    """The primary's current WAL position; "" on backends without replication to track."""
+    connection = connections[DEFAULT_DB_ALIAS]
+    if connection.vendor != "postgresql":
+        return ""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_current_wal_lsn()::text")
+        return cursor.fetchone()[0]
+
+def has_replayed(alias, position):
+    """Whether replica `alias` has replayed the primary's WAL up to `position`."""
+    connection = connections[alias]
+    if not position or connection.vendor != "postgresql":
+        return True
+    with connection.cursor() as cursor:
+        # NULL when the server is not in recovery, i.e. not behind anything
+        cursor.execute("SELECT COALESCE(pg_last_wal_replay_lsn() >= %s::pg_lsn, true)", [position])
+        return cursor.fetchone()[0]
+
+
+def _sticky_key(user):
+    return f"db:sticky:{user.pk}"
+
+def mark_sticky(user):
+    cache.set(_sticky_key(user), 1, settings.REPLICA_STICKY_SECONDS)
+
+def is_sticky(user):
+    return bool(user and user.is_authenticated and cache.get(_sticky_key(user)))
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return routed_replica()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        return db not in replica_aliases()
+
+
+class ReplicaStickinessMiddleware:
+    """
+    Pins a user to the primary for a short window after any unsafe request.
+    Runs after the view, so it also sees users authenticated by DRF (e.g. JWT).
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        user = getattr(request, "user", None)
+        if request.method not in SAFE_METHODS and user is not None and user.is_authenticated:
+            mark_sticky(user)
+        return response
+
+
+class ReplicaReadMixin:
+    """
+    Opt-in for APIViews whose safe requests may read from a replica.
+    If the replica fails mid-request the request is retried once against the primary.
+    """
+    replica = None
+    # Set for the retry, so initial() cannot hand it another (possibly also failing) replica
+    primary_only = False
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and not self.primary_only and not is_sticky(request.user):
+            self.replica = LazyReplica()
+            self._replica_token = _read_alias.set(self.replica)
+
+    def _reset_replica(self):
+        token = self.__dict__.pop("_replica_token", None)
+        if token is not None:
+            _read_alias.reset(token)
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except (OperationalError, InterfaceError):
+            alias = self.replica.alias if self.replica else None
+            if alias is None:
+                raise
+            self._reset_replica()
+            mark_unavailable(alias)
+            self.replica = None
+            self.primary_only = True
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            self._reset_replica()
@@ -55,6 +55,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'E_Commerce.db_router.ReplicaStickinessMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -101,6 +102,33 @@ DATABASES = {
     }
 }
 
+# Read replicas: one alias per host in DB_REPLICA_HOSTS, same credentials as the primary.
+# Only views using E_Commerce.db_router.ReplicaReadMixin read from them.
+DATABASE_REPLICAS = []
+for index, host in enumerate(filter(None, os.getenv("DB_REPLICA_HOSTS", "").split(",")), start=1):
+    alias = f"replica{index}"
+    DATABASES[alias] = {**DATABASES["default"], "HOST": host.strip(), "TEST": {"MIRROR": "default"}}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ["E_Commerce.db_router.ReplicaRouter"]
+# Read-your-writes window after a user's unsafe request, and how long a failed replica is skipped
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", 10))
+REPLICA_RETRY_SECONDS = int(os.getenv("REPLICA_RETRY_SECONDS", 30))
+
+
+# Cache
+# Local memory by default; point CACHE_BACKEND/CACHE_LOCATION at a shared backend
+# (e.g. django.core.cache.backends.redis.RedisCache) in production.
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.getenv("CACHE_LOCATION", "ecommerce"),
+    }
+}
+
+CATALOG_CACHE_ALIAS = "default"
+CATALOG_CACHE_TIMEOUT = int(os.getenv("CATALOG_CACHE_TIMEOUT", 300))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -170,6 +198,44 @@ REST_FRAMEWORK = {
     ),
 }
 
+# Product image derivatives (catalogs/images.py)
+PRODUCT_IMAGE_DERIVATIVES_ASYNC = os.getenv("PRODUCT_IMAGE_DERIVATIVES_ASYNC", "true").lower() == "true"
+PRODUCT_IMAGE_WORKERS = int(os.getenv("PRODUCT_IMAGE_WORKERS", 2))
+PRODUCT_IMAGE_THUMBNAIL_SIZE = 200
+PRODUCT_IMAGE_WIDTHS = [400, 800, 1200]
+PRODUCT_IMAGE_WEBP_QUALITY = 80
+
+# Catalog listing (keyset pagination)
+CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", 20))
+CATALOG_MAX_PAGE_SIZE = int(os.getenv("CATALOG_MAX_PAGE_SIZE", 100))
+# Upper bounds of the price facet buckets; the last bucket is open ended
+CATALOG_PRICE_BUCKETS = [500, 1000, 2500, 5000]
+# Rows per bulk insert transaction for product imports
+CATALOG_IMPORT_CHUNK_SIZE = int(os.getenv("CATALOG_IMPORT_CHUNK_SIZE", 1000))
+# Delta sync change log: rows per response and checkpoint lifetime
+CATALOG_CHANGES_LIMIT = int(os.getenv("CATALOG_CHANGES_LIMIT", 1000))
+CATALOG_CHANGES_RETENTION_DAYS = int(os.getenv("CATALOG_CHANGES_RETENTION_DAYS", 30))
+# Rows fetched (and images/variations prefetched) per round trip for catalog exports
+CATALOG_EXPORT_CHUNK_SIZE = int(os.getenv("CATALOG_EXPORT_CHUNK_SIZE", 2000))
+
+# Cart
+CART_BATCH_MAX_OPERATIONS = int(os.getenv("CART_BATCH_MAX_OPERATIONS", 100))
+# "database" writes cart changes through; "cache" keeps working carts in CART_STORE_CACHE_ALIAS
+# and flushes them every CART_STORE_FLUSH_SECONDS, before cart reads, at checkout and at exit.
+# The cache must be shared by all processes (e.g. Redis) unless there is only one.
+# Unflushed changes live only in that cache, so writing behind needs a backend that never
+# evicts them, such as Redis with maxmemory-policy noeviction. Backends that cull entries
+# when full (local memory, file, database, memcached) get every change written through.
+CART_STORE_BACKEND = os.getenv("CART_STORE_BACKEND", "database")
+CART_STORE_CACHE_ALIAS = "default"
+CART_STORE_TIMEOUT = int(os.getenv("CART_STORE_TIMEOUT", 86400))
+CART_STORE_FLUSH_SECONDS = int(os.getenv("CART_STORE_FLUSH_SECONDS", 5))
+CART_STORE_LOCK_TIMEOUT = 5
+CART_STORE_LOCK_ATTEMPTS = 200
+# Carts untouched for this long are deleted by the expire_carts command
+CART_EXPIRE_DAYS = int(os.getenv("CART_EXPIRE_DAYS", 30))
+CART_EXPIRE_BATCH_SIZE = int(os.getenv("CART_EXPIRE_BATCH_SIZE", 1000))
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=60),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=7),
@@ -182,4 +248,31 @@ MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
 RAZORPAY_KEY_ID="rzp_test_RXIhi53mKdxDFV"
-RAZORPAY_KEY_SECRET="0455SalMKzkbm27MWf4y2RRI"
\ No newline at end of file
+RAZORPAY_KEY_SECRET="0455SalMKzkbm27MWf4y2RRI"
+# Set in the Razorpay dashboard for the webhook; events are rejected while empty
+RAZORPAY_WEBHOOK_SECRET = os.getenv("RAZORPAY_WEBHOOK_SECRET", "")
+
+# Payment gateway: "razorpay", or "fake" for tests and offline development
+PAYMENT_GATEWAY_BACKEND = os.getenv("PAYMENT_GATEWAY_BACKEND", "razorpay")
+PAYMENT_GATEWAY_CONNECT_TIMEOUT = float(os.getenv("PAYMENT_GATEWAY_CONNECT_TIMEOUT", 3))
+PAYMENT_GATEWAY_READ_TIMEOUT = float(os.getenv("PAYMENT_GATEWAY_READ_TIMEOUT", 10))
+PAYMENT_GATEWAY_POOL_SIZE = int(os.getenv("PAYMENT_GATEWAY_POOL_SIZE", 10))
+# Retries apply to idempotent calls only (fetches), never to order creation
+PAYMENT_GATEWAY_RETRIES = int(os.getenv("PAYMENT_GATEWAY_RETRIES", 2))
+PAYMENT_GATEWAY_BACKOFF_SECONDS = 0.2
+PAYMENT_GATEWAY_BREAKER_FAILURES = int(os.getenv("PAYMENT_GATEWAY_BREAKER_FAILURES", 5))
+PAYMENT_GATEWAY_BREAKER_RESET_SECONDS = int(os.getenv("PAYMENT_GATEWAY_BREAKER_RESET_SECONDS", 30))
+
+# Idempotency-Key responses are replayed for this long
+IDEMPOTENCY_KEY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_KEY_TTL_SECONDS", 86400))
+# Held while a keyed request runs; must outlast a checkout including the gateway timeouts
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+IDEMPOTENCY_LOCK_WAIT_SECONDS = 20
+
+# Webhook events applied per transaction by process_payment_events
+PAYMENT_EVENTS_BATCH_SIZE = int(os.getenv("PAYMENT_EVENTS_BATCH_SIZE", 500))
+
+# reconcile_pending_orders settles PENDING orders older than this against the gateway
+PENDING_ORDER_RECONCILE_MINUTES = int(os.getenv("PENDING_ORDER_RECONCILE_MINUTES", 60))
+PENDING_ORDER_RECONCILE_BATCH_SIZE = int(os.getenv("PENDING_ORDER_RECONCILE_BATCH_SIZE", 200))
+PENDING_ORDER_RECONCILE_WORKERS = int(os.getenv("PENDING_ORDER_RECONCILE_WORKERS", 8))
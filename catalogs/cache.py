@@ -0,0 +1,126 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+
+from E_Commerce.db_router import has_replayed, read_from, routed_replica, wal_position
+
+VERSION_KEY = "catalog:version"
+POSITION_KEY = "catalog:position"
+CHANGED_AT_KEY = "catalog:changed_at"
+HITS_KEY = "catalog:cache:hits"
+MISSES_KEY = "catalog:cache:misses"
+
+
+def get_catalog_cache():
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def _seed_version():
+    # Time based seed so a counter lost to eviction never restarts below an old value
+    return int(time.time() * 1000)
+
+
+def get_catalog_version():
+    cache = get_catalog_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, _seed_version(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+def get_catalog_changed_at():
+    value = get_catalog_cache().get(CHANGED_AT_KEY)
+    return datetime.fromtimestamp(value, tz=timezone.utc) if value is not None else None
+
+def bump_catalog_version():
+    cache = get_catalog_cache()
+    cache.set(CHANGED_AT_KEY, time.time(), timeout=None)
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, _seed_version(), timeout=None)
+        return cache.get(VERSION_KEY)
+
+def bump_catalog_version_on_commit():
+    transaction.on_commit(bump_catalog_version)
+
+def catalog_read_alias(version):
+    """
+    Where catalog rows for `version` may be read: the request's replica once it has replayed
+    the primary up to where that version was current, else the primary (None).
+    """
+    replica = routed_replica()
+    if replica is None:
+        return None
+    cache = get_catalog_cache()
+    key = f"{POSITION_KEY}:{version}"
+    position = cache.get(key)
+    if position is None:
+        # Read after the version: bumps happen on commit, so every commit behind it is at or before here
+        position = wal_position()
+        cache.add(key, position, settings.CATALOG_CACHE_TIMEOUT)
+    return replica if has_replayed(replica, position) else None
+
+
+def _incr_counter(key):
+    cache = get_catalog_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+def get_cache_stats():
+    cache = get_catalog_cache()
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        "version": get_catalog_version(),
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / total, 4) if total else None,
+    }
+
+
+def response_cache_key(request, version=None):
+    query = urlencode(sorted((k, v) for k, values in request.query_params.lists() for v in values))
+    raw = f"{request.scheme}://{request.get_host()}{request.path}?{query}"
+    digest = hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    if version is None:
+        version = get_catalog_version()
+    return f"catalog:response:{version}:{digest}"
+
+
+def cached_catalog_response(view_method):
+    """
+    Caches successful read responses under the current catalog version.
+    Any catalog write bumps the version, so stale entries are never served and simply expire.
+    Misses render from the request's replica if it has caught up with the version (see
+    catalog_read_alias), so a lagging one never gets old rows stored under a new version.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        cache = get_catalog_cache()
+        version = get_catalog_version()
+        key = response_cache_key(request, version)
+        data = cache.get(key)
+        if data is not None:
+            _incr_counter(HITS_KEY)
+            return Response(data, headers={"X-Cache": "HIT"})
+
+        _incr_counter(MISSES_KEY)
+        with read_from(catalog_read_alias(version)):
+            response = view_method(self, request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.CATALOG_CACHE_TIMEOUT)
+        response["X-Cache"] = "MISS"
+        return response
+    return wrapper
@@ -0,0 +1,101 @@
+from collections import defaultdict
+
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Category, CategoryProductCount, Product
+
+
+def apply_count_deltas(deltas):
+    """
+    Applies {category_id: (product_delta, available_delta)} with atomic F() increments,
+    one UPDATE per touched category. Run it in the transaction that made the change.
+    """
+    for category_id, (total, available) in deltas.items():
+        if not total and not available:
+            continue
+        counts = CategoryProductCount.objects.filter(category_id=category_id)
+        changes = {"product_count": F("product_count") + total, "available_count": F("available_count") + available}
+        if not counts.update(**changes):
+            CategoryProductCount.objects.bulk_create([CategoryProductCount(category_id=category_id)], ignore_conflicts=True)
+            counts.update(**changes)
+
+def count_products(products):
+    """Deltas for newly inserted products, e.g. a bulk import chunk."""
+    deltas = defaultdict(lambda: [0, 0])
+    for product in products:
+        deltas[product.category_id][0] += 1
+        deltas[product.category_id][1] += int(product.is_available)
+    return deltas
+
+def _load_counted_as(product, using):
+    # One pk lookup, and only for products loaded without these fields (only()/defer())
+    before = getattr(product, "_counted_as", None)
+    if product._state.adding or before is None or None not in before:
+        return
+    stored = Product.objects.using(using).filter(pk=product.pk).values_list("category_id", "is_available").first()
+    if stored is not None:
+        product._counted_as = stored
+
+def product_saving(product, update_fields=None, using=None):
+    """Before a save: fetches the stored state a partially loaded product needs to move its counts."""
+    if update_fields is None or {"category", "category_id", "is_available"} & set(update_fields):
+        _load_counted_as(product, using)
+
+def product_deleting(product, using=None):
+    _load_counted_as(product, using)
+
+def product_saved(product, created):
+    before = None if created else getattr(product, "_counted_as", None)
+    after = (product.category_id, product.is_available)
+    product._counted_as = after
+    if before is None:
+        if created:
+            apply_count_deltas({after[0]: (1, int(after[1]))})
+        return
+    if None in before or before == after:
+        # Unchanged, or saved without either field after a partial load (see product_saving)
+        return
+    deltas = defaultdict(lambda: [0, 0])
+    deltas[before[0]][0] -= 1
+    deltas[before[0]][1] -= int(before[1])
+    deltas[after[0]][0] += 1
+    deltas[after[0]][1] += int(after[1])
+    apply_count_deltas(deltas)
+
+def product_deleted(product):
+    # Use the stored state: category_id/is_available may have been edited in memory before delete()
+    category_id, available = getattr(product, "_counted_as", None) or (product.category_id, product.is_available)
+    if category_id is not None:
+        apply_count_deltas({category_id: (-1, -int(bool(available)))})
+
+
+def _live_count(available=False):
+    products = Product.objects.filter(category=OuterRef("category_id"))
+    if available:
+        products = products.filter(is_available=True)
+    return Coalesce(
+        Subquery(products.order_by().values("category").annotate(n=Count("pk")).values("n")),
+        Value(0),
+        output_field=IntegerField(),
+    )
+
+def reconcile_category_counts():
+    """
+    Recomputes every counter from Product and rewrites only the rows that drifted.
+    Each rewrite is a single UPDATE ... SET = (subquery), so concurrent increments are not lost.
+    Returns (missing rows created, drifted rows fixed).
+    """
+    missing = Category.objects.filter(counts__isnull=True).values_list("pk", flat=True)
+    created = CategoryProductCount.objects.bulk_create(
+        [CategoryProductCount(category_id=pk) for pk in missing], ignore_conflicts=True,
+    )
+    drifted = (
+        CategoryProductCount.objects.annotate(live_total=_live_count(), live_available=_live_count(available=True))
+        .filter(~Q(product_count=F("live_total")) | ~Q(available_count=F("live_available")))
+        .values_list("pk", flat=True)
+    )
+    fixed = CategoryProductCount.objects.filter(pk__in=list(drifted)).update(
+        product_count=_live_count(), available_count=_live_count(available=True),
+    )
+    return len(created), fixed
@@ -0,0 +1,97 @@
+import base64
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import BigIntegerField, Func, Q
+from django.utils import timezone
+
+from .models import CatalogChange
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+class ExpiredToken(InvalidToken):
+    pass
+
+
+class SnapshotXmin(Func):
+    """PostgreSQL: the oldest transaction id still running, as seen by the current snapshot."""
+    template = "(pg_snapshot_xmin(pg_current_snapshot())::text::bigint)"
+    output_field = BigIntegerField()
+
+
+def encode_token(checkpoint):
+    txid, last_id = checkpoint
+    raw = f"{txid}.{last_id}:{int(timezone.now().timestamp())}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_token(token):
+    """Returns the (txid, id) checkpoint a token points past; expired tokens raise ExpiredToken."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+        position, issued = raw.split(":")
+        issued = int(issued)
+        checkpoint = tuple(int(part) for part in position.split("."))
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidToken("Malformed sync token.")
+    if len(checkpoint) > 2 or min(checkpoint) < 0:
+        raise InvalidToken("Malformed sync token.")
+    # Older changes may already be pruned, so the client cannot be caught up incrementally.
+    # Tokens from before checkpoints carried a transaction id cannot be placed either.
+    if len(checkpoint) == 1 or issued < (timezone.now() - timedelta(days=settings.CATALOG_CHANGES_RETENTION_DAYS)).timestamp():
+        raise ExpiredToken("Sync token expired, resync the full catalog.")
+    return checkpoint
+
+
+def _visible(qs):
+    """
+    Limits `qs` to log rows that no running transaction can still precede.
+    Ids are taken at insert, not at commit, so a long transaction such as an import chunk
+    can commit rows below an id a client has already read past. Every transaction older
+    than the snapshot's xmin has finished and any later writer gets a higher txid, so
+    reading in (txid, id) order up to xmin never skips a row. Other backends serialize
+    writers, which keeps id order equal to commit order.
+    """
+    if connections[qs.db].vendor != "postgresql":
+        return qs
+    return qs.filter(txid__lt=SnapshotXmin())
+
+def head_token():
+    """A token for the current end of the log, for clients starting from a full export."""
+    checkpoint = _visible(CatalogChange.objects.all()).order_by("-txid", "-id").values_list("txid", "id").first()
+    return encode_token(checkpoint or (0, 0))
+
+def read_changes(since, limit=None):
+    """
+    Reads up to `limit` log rows after the (txid, id) checkpoint `since` with a single
+    index range scan. Returns ({(kind, object_id): action}, next checkpoint, has_more),
+    keeping only the latest action per object.
+    """
+    limit = limit or settings.CATALOG_CHANGES_LIMIT
+    txid, last_id = since
+    rows = list(
+        _visible(CatalogChange.objects.filter(Q(txid__gt=txid) | Q(txid=txid, id__gt=last_id)))
+        .order_by("txid", "id").values_list("txid", "id", "kind", "object_id", "action")[:limit + 1]
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    latest = {}
+    for _, _, kind, object_id, action in rows:
+        latest[(kind, object_id)] = action
+    return latest, rows[-1][:2] if rows else since, has_more
+
+def prune_changes(older_than, batch_size=10000):
+    """Deletes log rows changed before `older_than` in id-range batches. Returns the number deleted."""
+    last_id = CatalogChange.objects.filter(changed_at__lt=older_than).order_by("-id").values_list("id", flat=True).first()
+    if last_id is None:
+        return 0
+    deleted = 0
+    start = CatalogChange.objects.order_by("id").values_list("id", flat=True).first()
+    while start <= last_id:
+        end = min(start + batch_size - 1, last_id)
+        deleted += CatalogChange.objects.filter(id__gte=start, id__lte=end).delete()[0]
+        start = end + 1
+    return deleted
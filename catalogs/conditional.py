@@ -0,0 +1,44 @@
+import hashlib
+from functools import wraps
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+def make_etag(*parts):
+    digest = hashlib.sha256("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+    return f'"{digest[:40]}"'
+
+def _timestamp(value):
+    return int(value.timestamp()) if value is not None else None
+
+
+def conditional_get(validator):
+    """
+    Adds strong ETag/Last-Modified validators to a read view and answers 304 Not Modified
+    before the view body (and any serialization) runs.
+    `validator(view, request, *args, **kwargs)` returns (etag_parts, last_modified) from a cheap
+    lookup, or None to skip, e.g. when the object does not exist and the view should 404.
+    The full path is always part of the ETag since ?fields= and filters change the body.
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            validators = validator(self, request, *args, **kwargs)
+            if validators is None:
+                return view_method(self, request, *args, **kwargs)
+            parts, last_modified = validators
+            etag = make_etag(request.get_full_path(), *parts)
+            timestamp = _timestamp(last_modified)
+
+            response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+            if response is None:
+                response = view_method(self, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response["ETag"] = etag
+            if timestamp is not None:
+                response["Last-Modified"] = http_date(timestamp)
+            return response
+        return wrapper
+    return decorator
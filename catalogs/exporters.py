@@ -0,0 +1,102 @@
+import csv
+import io
+import json
+import zlib
+
+from django.conf import settings
+from django.db.models import Prefetch
+
+from .importers import FORMATS
+from .models import Product, ProductImage, ProductVariation
+
+# Columns mirror the importer's so an export can be fed straight back into import_products
+COLUMNS = ["id", "name", "slug", "description", "price", "is_available", "category", "category_id", "variations", "images", "created_at", "updated_at"]
+# Encoded output is batched into writes of about this size; the first piece always goes out on its own
+FLUSH_BYTES = 64 * 1024
+CONTENT_TYPES = {"csv": "text/csv; charset=utf-8", "jsonl": "application/x-ndjson"}
+
+
+def export_queryset(using=None):
+    """
+    Products in id order with their category joined and images/variations prefetched.
+    Meant for .iterator(chunk_size=...), which prefetches per chunk and streams from a
+    server-side cursor on PostgreSQL, so memory stays bounded by one chunk.
+    """
+    return (
+        Product.objects.select_related("category")
+        .only(*[f for f in COLUMNS if f not in ("category_id", "variations", "images")], "category__slug")
+        .prefetch_related(
+            Prefetch("images", queryset=ProductImage.objects.only("id", "product_id", "image")),
+            Prefetch("variations", queryset=ProductVariation.objects.only("id", "product_id", "color", "size", "price", "is_available").order_by("id")),
+        )
+        .order_by("id")
+        .using(using)
+    )
+
+def export_row(product, request=None):
+    def url(image):
+        return request.build_absolute_uri(image.image.url) if request else image.image.url
+
+    return {
+        "id": product.id,
+        "name": product.name,
+        "slug": product.slug,
+        "description": product.description,
+        "price": str(product.price),
+        "is_available": product.is_available,
+        "category": product.category.slug,
+        "category_id": product.category_id,
+        "variations": [
+            {"color": v.color, "size": v.size, "price": str(v.price) if v.price is not None else None, "is_available": v.is_available}
+            for v in product.variations.all()
+        ],
+        "images": [url(image) for image in product.images.all() if image.image],
+        "created_at": product.created_at.isoformat(),
+        "updated_at": product.updated_at.isoformat(),
+    }
+
+
+def _csv_line(values):
+    buf = io.StringIO()
+    csv.writer(buf).writerow(values)
+    return buf.getvalue()
+
+def iter_lines(fmt, chunk_size=None, request=None, using=None):
+    """Lazily yields the export one text line at a time."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format '{fmt}', expected one of {FORMATS}.")
+    chunk_size = chunk_size or settings.CATALOG_EXPORT_CHUNK_SIZE
+    if fmt == "csv":
+        yield _csv_line(COLUMNS)
+    for product in export_queryset(using).iterator(chunk_size=chunk_size):
+        row = export_row(product, request)
+        if fmt == "csv":
+            row["variations"] = json.dumps(row["variations"])
+            row["images"] = json.dumps(row["images"])
+            yield _csv_line([row[c] for c in COLUMNS])
+        else:
+            yield json.dumps(row, separators=(",", ":")) + "\n"
+
+def iter_export(fmt, chunk_size=None, request=None, compress=False, using=None):
+    """
+    Yields the encoded export as bytes, gzipped on the fly when `compress` is set.
+    Output is coalesced into FLUSH_BYTES pieces, except the first, so a client
+    starts receiving before the rest of the catalog has been read.
+    """
+    gzip = zlib.compressobj(wbits=31) if compress else None
+    pending, size, first = [], 0, True
+    for line in iter_lines(fmt, chunk_size, request, using):
+        data = line.encode("utf-8")
+        pending.append(data)
+        size += len(data)
+        if first or size >= FLUSH_BYTES:
+            data = b"".join(pending)
+            if gzip:
+                data = gzip.compress(data) + gzip.flush(zlib.Z_SYNC_FLUSH)
+            yield data
+            pending, size, first = [], 0, False
+    data = b"".join(pending)
+    if gzip:
+        data = gzip.compress(data) + gzip.flush()
+    if data:
+        yield data
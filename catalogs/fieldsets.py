@@ -0,0 +1,159 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+# Marks a requested field that is wanted in full, nested fields included
+ALL = None
+
+
+def _split(value):
+    return [v.strip() for v in value.split(",") if v.strip()] if value else []
+
+def parse_fieldset(request):
+    """
+    Turns ?fields=id,name,product.name&expand=images into a nested dict of wanted fields.
+    Returns None when no fields were requested, meaning the full representation.
+    """
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    fields = _split(request.query_params.get("fields"))
+    if not fields:
+        return None
+    tree = {}
+    for path in fields + _split(request.query_params.get("expand")):
+        node = tree
+        parts = path.split(".")
+        for part in parts[:-1]:
+            if part in node and node[part] is ALL:
+                break
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = ALL
+    return tree
+
+
+def _unwrap(field):
+    return getattr(field, "child", field)
+
+def prune_fields(serializer, tree):
+    fields = serializer.fields
+    for name in list(fields):
+        if name not in tree:
+            fields.pop(name)
+            continue
+        nested = _unwrap(fields[name])
+        if tree[name] is not ALL and isinstance(nested, serializers.Serializer):
+            prune_fields(nested, tree[name])
+
+
+class SparseFieldsetMixin:
+    """
+    Lets read requests trim a serializer with ?fields= and ?expand=.
+    Only the root serializer (the one given the request context) prunes; nested ones are pruned through it.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        tree = parse_fieldset(self._context.get("request"))
+        if tree is not None:
+            prune_fields(self, tree)
+
+
+class QueryPlan:
+    def __init__(self, model):
+        self.model = model
+        self.only = set()
+        self.select_related = set()
+        self.prefetch = {}
+
+    def add_path(self, parts, nested=None):
+        """
+        Resolves one serializer source path against the model and records what loading it needs.
+        Forward relations are joined, reverse relations get their own planned Prefetch.
+        """
+        name = parts[0]
+        try:
+            field = self.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return
+        if not field.is_relation:
+            self.only.add(name)
+            return
+
+        rest = parts[1:]
+        if field.many_to_one or field.one_to_one:
+            if field.concrete and (name == field.attname or (not rest and nested is None)):
+                self.only.add(field.name)
+                return
+            self.select_related.add(field.name)
+            self.only.add(field.name)
+            related = QueryPlan(field.related_model)
+            related._descend(rest, nested)
+            self.only.update(f"{field.name}__{lookup}" for lookup in related.only)
+            self.select_related.update(f"{field.name}__{lookup}" for lookup in related.select_related)
+            for lookup, plan in related.prefetch.items():
+                self._merge_prefetch(f"{field.name}__{lookup}", plan)
+            return
+
+        plan = QueryPlan(field.related_model)
+        if field.one_to_many:
+            plan.only.add(field.field.name)
+        plan._descend(rest, nested)
+        self._merge_prefetch(name, plan)
+
+    def _descend(self, rest, nested):
+        if rest:
+            self.add_path(rest)
+        elif nested is not None:
+            self.add_serializer(nested)
+        else:
+            self.only.update(f.name for f in self.model._meta.concrete_fields if not f.is_relation)
+
+    def _merge_prefetch(self, lookup, plan):
+        existing = self.prefetch.get(lookup)
+        if existing is None:
+            self.prefetch[lookup] = plan
+            return
+        existing.only |= plan.only
+        existing.select_related |= plan.select_related
+        for key, sub in plan.prefetch.items():
+            existing._merge_prefetch(key, sub)
+
+    def add_serializer(self, serializer):
+        serializer = _unwrap(serializer)
+        hints = getattr(serializer, "query_hints", {})
+        for field in serializer.fields.values():
+            if field.write_only:
+                continue
+            if field.field_name in hints:
+                for path in hints[field.field_name]:
+                    self.add_path(path.split("."))
+                continue
+            if field.source == "*":
+                continue
+            nested = _unwrap(field)
+            nested = nested if isinstance(nested, serializers.Serializer) else None
+            self.add_path(field.source.split("."), nested)
+
+    def apply(self, queryset):
+        if self.select_related:
+            queryset = queryset.select_related(*sorted(self.select_related))
+        if self.prefetch:
+            queryset = queryset.prefetch_related(*[
+                Prefetch(lookup, queryset=plan.apply(plan.model._default_manager.all()))
+                for lookup, plan in self.prefetch.items()
+            ])
+        return queryset.only(*sorted(self.only))
+
+
+def plan_queryset(queryset, serializer, always=()):
+    """
+    Narrows a queryset to what `serializer` (after ?fields= pruning) will read:
+    only() the used columns, select_related forward relations and Prefetch reverse ones.
+    `always` lists extra columns needed outside the serializer, e.g. pagination keys.
+    Method fields declare what they read through a `query_hints` dict on the serializer.
+    """
+    plan = QueryPlan(queryset.model)
+    plan.add_serializer(serializer)
+    plan.only.update(always)
+    return plan.apply(queryset)
@@ -0,0 +1,125 @@
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db.models import Case, CharField, Count, Exists, F, OuterRef, Q, Value, When
+from django.db.models.functions import Cast
+from rest_framework.exceptions import ValidationError
+
+from .models import Product, ProductVariation
+
+FACETS = ("category", "color", "size", "price")
+
+
+def _split(value):
+    return [v.strip() for v in value.split(",") if v.strip()] if value else []
+
+def _decimal(params, name):
+    value = params.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ValidationError({name: "Must be a number."})
+
+def parse_product_filters(params):
+    filters = {
+        "category": _split(params.get("category")),
+        "color": _split(params.get("color")),
+        "size": _split(params.get("size")),
+        "min_price": _decimal(params, "min_price"),
+        "max_price": _decimal(params, "max_price"),
+        "is_available": None,
+    }
+    available = params.get("is_available")
+    if available not in (None, ""):
+        if available.lower() not in ("true", "false", "1", "0"):
+            raise ValidationError({"is_available": "Must be true or false."})
+        filters["is_available"] = available.lower() in ("true", "1")
+    return filters
+
+
+def apply_product_filters(queryset, filters, exclude=None):
+    """
+    Applies the parsed filters; `exclude` skips one facet so its own counts stay disjunctive.
+    """
+    if filters["category"] and exclude != "category":
+        ids = [int(c) for c in filters["category"] if c.isdigit()]
+        slugs = [c for c in filters["category"] if not c.isdigit()]
+        queryset = queryset.filter(Q(category__id__in=ids) | Q(category__slug__in=slugs))
+    if exclude != "price":
+        # Matches products whose effective price range overlaps the requested one
+        if filters["min_price"] is not None:
+            queryset = queryset.filter(max_price__gte=filters["min_price"])
+        if filters["max_price"] is not None:
+            queryset = queryset.filter(min_price__lte=filters["max_price"])
+    if filters["is_available"] is not None:
+        queryset = queryset.filter(is_available=filters["is_available"])
+
+    variation_q = _variation_q(filters, exclude)
+    if variation_q is not None:
+        queryset = queryset.filter(Exists(ProductVariation.objects.filter(variation_q, product=OuterRef("pk"))))
+    return queryset
+
+def _variation_q(filters, exclude=None):
+    q = None
+    if filters["color"] and exclude != "color":
+        q = Q(color__in=filters["color"])
+    if filters["size"] and exclude != "size":
+        q = Q(size__in=filters["size"]) if q is None else q & Q(size__in=filters["size"])
+    return q
+
+
+def _price_buckets():
+    bounds = list(getattr(settings, "CATALOG_PRICE_BUCKETS", [500, 1000, 2500, 5000]))
+    lower = [0] + bounds
+    labels = [f"{lo}-{hi}" for lo, hi in zip(lower, bounds)] + [f"{bounds[-1]}+"]
+    return bounds, labels
+
+def _variation_facet(filters, facet):
+    products = apply_product_filters(Product.objects.order_by(), filters, exclude=facet)
+    rows = ProductVariation.objects.order_by().exclude(**{facet: None})
+    if products.query.has_filters():
+        rows = rows.filter(product__in=products.values("pk"))
+    other_q = _variation_q(filters, exclude=facet)
+    if other_q is not None:
+        rows = rows.filter(other_q)
+    return (
+        rows.annotate(facet=Value(facet, output_field=CharField()), value=F(facet))
+        .values("facet", "value")
+        .annotate(count=Count("product_id", distinct=True))
+    )
+
+def facet_counts(filters):
+    """
+    Counts matches per category, color, size and price bucket in a single UNION ALL query.
+    Each facet is counted with every filter applied except its own; price buckets go by min_price.
+    """
+    bounds, labels = _price_buckets()
+    bucket = Case(
+        *[When(min_price__lt=bound, then=Value(label)) for bound, label in zip(bounds, labels)],
+        default=Value(labels[-1]),
+        output_field=CharField(),
+    )
+    categories = (
+        apply_product_filters(Product.objects.order_by(), filters, exclude="category")
+        .annotate(facet=Value("category", output_field=CharField()), value=Cast("category_id", CharField()))
+        .values("facet", "value")
+        .annotate(count=Count("id"))
+    )
+    prices = (
+        apply_product_filters(Product.objects.order_by(), filters, exclude="price")
+        .annotate(facet=Value("price", output_field=CharField()), value=bucket)
+        .values("facet", "value")
+        .annotate(count=Count("id"))
+    )
+    query = categories.union(_variation_facet(filters, "color"), _variation_facet(filters, "size"), prices, all=True)
+
+    facets = {name: [] for name in FACETS}
+    for row in query:
+        value = int(row["value"]) if row["facet"] == "category" else row["value"]
+        facets[row["facet"]].append({"value": value, "count": row["count"]})
+    facets["price"].sort(key=lambda item: labels.index(item["value"]))
+    for name in ("category", "color", "size"):
+        facets[name].sort(key=lambda item: (-item["count"], str(item["value"])))
+    return facets
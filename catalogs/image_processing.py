@@ -0,0 +1,48 @@
+"""
+Pure Pillow rendering of product image derivatives.
+Kept free of module level Django imports so spawned worker processes can unpickle
+these functions before init_worker has set Django up.
+"""
+import io
+
+from PIL import Image, ImageOps
+
+
+def _encode(img, quality):
+    buffer = io.BytesIO()
+    img.save(buffer, format="WEBP", quality=quality, method=4)
+    return buffer.getvalue()
+
+def render_derivatives(source, thumbnail_size, widths, quality):
+    """
+    Returns the original dimensions and a {name: (webp_bytes, width, height)} map:
+    a square `thumb` crop plus one `<w>w` rendition per width narrower than the original.
+    """
+    with Image.open(io.BytesIO(source)) as img:
+        img = ImageOps.exif_transpose(img)
+        img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+        width, height = img.size
+
+        renditions = {}
+        thumb = ImageOps.fit(img, (thumbnail_size, thumbnail_size), Image.Resampling.LANCZOS)
+        renditions["thumb"] = (_encode(thumb, quality), *thumb.size)
+        for target in sorted(widths):
+            if target >= width:
+                break
+            resized = img.resize((target, max(1, round(height * target / width))), Image.Resampling.LANCZOS)
+            renditions[f"{target}w"] = (_encode(resized, quality), *resized.size)
+        renditions[f"{width}w"] = (_encode(img, quality), width, height)
+    return {"width": width, "height": height, "renditions": renditions}
+
+
+def init_worker():
+    """Pool initializer: configures Django in a spawned worker so it can open default_storage."""
+    import django
+    django.setup()
+
+def render_stored_derivatives(name, thumbnail_size, widths, quality):
+    """Reads the original `name` from default_storage in the worker and renders it."""
+    from django.core.files.storage import default_storage
+    with default_storage.open(name, "rb") as fh:
+        source = fh.read()
+    return render_derivatives(source, thumbnail_size, widths, quality)
@@ -0,0 +1,123 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.db.models.fields.json import KT
+
+from .cache import bump_catalog_version
+from .image_processing import init_worker, render_stored_derivatives
+from .models import CatalogChange, Product, ProductImage
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor(replace_broken=None):
+    """Process-wide worker pool; spawned so workers never inherit the server's threads or DB sockets."""
+    global _executor
+    with _executor_lock:
+        if _executor is None or _executor is replace_broken:
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.PRODUCT_IMAGE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+            )
+        return _executor
+
+def shutdown_executor(wait=True):
+    """Stops the pool if one was started; with `wait` this also waits for pending store callbacks."""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+def _render_args(source_name):
+    return (source_name, settings.PRODUCT_IMAGE_THUMBNAIL_SIZE, settings.PRODUCT_IMAGE_WIDTHS, settings.PRODUCT_IMAGE_WEBP_QUALITY)
+
+def pending_images():
+    """Images whose renditions were never stored for their current file, e.g. jobs lost to a restart."""
+    return ProductImage.objects.exclude(image="").annotate(rendered=KT("derivatives__source")).filter(
+        Q(rendered__isnull=True) | ~Q(rendered=F("image"))
+    )
+
+def _store(image_id, source_name, result):
+    renditions = {}
+    for name, (data, width, height) in result["renditions"].items():
+        path = default_storage.save(f"product_images/derivatives/{image_id}/{name}.webp", ContentFile(data))
+        renditions[name] = {"name": path, "width": width, "height": height}
+
+    previous = ProductImage.objects.filter(pk=image_id).values_list("derivatives", flat=True).first() or {}
+    updated = ProductImage.objects.filter(pk=image_id, image=source_name).update(
+        width=result["width"],
+        height=result["height"],
+        derivatives={"source": source_name, "renditions": renditions},
+    )
+    # Drop files of a previous run, or of this one if the image was replaced or deleted meanwhile
+    stale = previous.get("renditions", {}).values() if updated else renditions.values()
+    for rendition in stale:
+        default_storage.delete(rendition["name"])
+    if updated:
+        CatalogChange.record(ProductImage, [image_id])
+        Product.touch(*ProductImage.objects.filter(pk=image_id).values_list("product_id", flat=True))
+        bump_catalog_version()
+
+def _on_rendered(image_id, source_name, future):
+    try:
+        _store(image_id, source_name, future.result())
+    except Exception:
+        logger.exception("Generating derivatives for ProductImage %s failed", image_id)
+    finally:
+        close_old_connections()
+
+
+def generate_derivatives(image_id, wait=False):
+    """
+    Renders thumbnails and WebP renditions for one ProductImage.
+    Only the storage name is handed over: the worker pool reads the original and resizes it,
+    and the result is stored from its callback thread, unless PRODUCT_IMAGE_DERIVATIVES_ASYNC
+    is off (tests) or `wait` is set. Queued jobs live only in memory; the image stays in
+    pending_images() until its renditions are stored, so generate_image_derivatives recovers them.
+    """
+    source_name = ProductImage.objects.filter(pk=image_id).values_list("image", flat=True).first()
+    if not source_name:
+        return None
+    if not settings.PRODUCT_IMAGE_DERIVATIVES_ASYNC:
+        _store(image_id, source_name, render_stored_derivatives(*_render_args(source_name)))
+        return None
+    executor = get_executor()
+    try:
+        future = executor.submit(render_stored_derivatives, *_render_args(source_name))
+    except BrokenProcessPool:
+        # A crashed worker (e.g. killed for memory) poisons the pool; start a fresh one
+        future = get_executor(replace_broken=executor).submit(render_stored_derivatives, *_render_args(source_name))
+    if wait:
+        _store(image_id, source_name, future.result())
+        return None
+    future.add_done_callback(lambda f: _on_rendered(image_id, source_name, f))
+    return future
+
+def schedule_derivatives(image_id):
+    """Queues generation once the surrounding transaction commits, so the upload request returns first."""
+    transaction.on_commit(lambda: generate_derivatives(image_id))
+
+
+def rendition_url(image, name, request=None):
+    rendition = (image.derivatives or {}).get("renditions", {}).get(name)
+    url = default_storage.url(rendition["name"]) if rendition else image.image.url
+    return request.build_absolute_uri(url) if request else url
+
+def srcset(image, request=None):
+    renditions = (image.derivatives or {}).get("renditions", {})
+    widths = sorted(int(name[:-1]) for name in renditions if name.endswith("w"))
+    return {f"{w}w": rendition_url(image, f"{w}w", request) for w in widths}
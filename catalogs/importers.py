@@ -0,0 +1,244 @@
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import DecimalValidator
+from django.db import DatabaseError, transaction
+from django.db.models import Q
+
+from .cache import bump_catalog_version_on_commit
+from .category_counts import apply_count_deltas, count_products
+from .models import CatalogChange, Category, Product, ProductVariation
+from .slugs import allocate_slugs
+
+FORMATS = ("csv", "jsonl")
+MAX_REPORTED_ERRORS = 1000
+
+
+class RowError(Exception):
+    pass
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": line, "error": message})
+
+    def as_dict(self):
+        return {"rows": self.rows, "created": self.created, "failed": self.failed, "errors": self.errors}
+
+
+def detect_format(filename, default="jsonl"):
+    name = (filename or "").lower()
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    return default
+
+def iter_rows(fileobj, fmt):
+    """
+    Lazily yields (line_number, row_dict) from a binary or text file object.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format '{fmt}', expected one of {FORMATS}.")
+    stream = fileobj if isinstance(fileobj, io.TextIOBase) else io.TextIOWrapper(fileobj, encoding="utf-8-sig")
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_no, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_no, RowError("Invalid JSON.")
+            continue
+        yield line_no, row if isinstance(row, dict) else RowError("Row must be a JSON object.")
+
+
+def _parse_bool(value, default=True):
+    if value in (None, ""):
+        return default
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ("true", "1", "yes"):
+        return True
+    if text in ("false", "0", "no"):
+        return False
+    raise RowError(f"Invalid boolean '{value}'.")
+
+def _parse_price(value, field="price", required=True):
+    if value in (None, ""):
+        if required:
+            raise RowError(f"{field} is required.")
+        return None
+    try:
+        price = Decimal(str(value))
+    except InvalidOperation:
+        raise RowError(f"Invalid {field} '{value}'.")
+    if not price.is_finite():
+        raise RowError(f"Invalid {field} '{value}'.")
+    if price < 0:
+        raise RowError(f"{field} must not be negative.")
+    # Checked here so one bad row is rejected instead of failing its whole chunk in the database
+    model_field = Product._meta.get_field("price")
+    try:
+        DecimalValidator(model_field.max_digits, model_field.decimal_places)(price)
+    except ValidationError as e:
+        raise RowError(f"Invalid {field} '{value}': {' '.join(e.messages)}")
+    return price
+
+def _parse_text(value, model, field):
+    if value is None:
+        return None
+    value = str(value)
+    max_length = model._meta.get_field(field).max_length
+    if len(value) > max_length:
+        raise RowError(f"{field} is longer than {max_length} characters.")
+    return value
+
+def _parse_variations(value):
+    if value in (None, ""):
+        return []
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            raise RowError("Invalid JSON for variations.")
+    if not isinstance(value, list):
+        raise RowError("Variations must be a list.")
+    variations, keys = [], set()
+    for v in value:
+        if not isinstance(v, dict):
+            raise RowError("Each variation must be an object.")
+        key = (v.get("color"), v.get("size"))
+        if key in keys:
+            raise RowError(f"Duplicate variation {key}.")
+        keys.add(key)
+        variations.append({
+            "color": _parse_text(v.get("color"), ProductVariation, "color"),
+            "size": _parse_text(v.get("size"), ProductVariation, "size"),
+            "price": _parse_price(v.get("price"), "variation price", required=False),
+            "is_available": _parse_bool(v.get("is_available")),
+        })
+    return variations
+
+def _parse_row(row):
+    name = (row.get("name") or "").strip()
+    if not name:
+        raise RowError("name is required.")
+    category = row.get("category")
+    if category in (None, ""):
+        raise RowError("category is required.")
+    return {
+        "name": _parse_text(name, Product, "name"),
+        "description": row.get("description") or None,
+        "price": _parse_price(row.get("price")),
+        "is_available": _parse_bool(row.get("is_available")),
+        "category": str(category).strip(),
+        "variations": _parse_variations(row.get("variations")),
+    }
+
+
+def _resolve_categories(refs, known):
+    """Looks up unknown category references (id, slug or name) in one query and caches them."""
+    missing = {ref for ref in refs if ref not in known}
+    if not missing:
+        return
+    ids = [int(ref) for ref in missing if ref.isdigit()]
+    for pk, slug, name in Category.objects.filter(Q(id__in=ids) | Q(slug__in=missing) | Q(name__in=missing)).values_list("id", "slug", "name"):
+        for ref in (str(pk), slug, name):
+            if ref in missing:
+                known[ref] = pk
+
+def _import_chunk(chunk, categories, report):
+    parsed = []
+    for line, row in chunk:
+        try:
+            if isinstance(row, RowError):
+                raise row
+            data = _parse_row(row)
+        except RowError as e:
+            report.add_error(line, str(e))
+            continue
+        parsed.append((line, data))
+
+    _resolve_categories({data["category"] for _, data in parsed}, categories)
+    valid = []
+    for line, data in parsed:
+        if data["category"] not in categories:
+            report.add_error(line, f"Category '{data['category']}' not found.")
+            continue
+        valid.append((line, data))
+    if not valid:
+        return
+
+    try:
+        with transaction.atomic():
+            slugs = allocate_slugs(Product, [data["name"] for _, data in valid], 240)
+            products = Product.objects.bulk_create([
+                Product(
+                    name=data["name"],
+                    description=data["description"],
+                    price=data["price"],
+                    min_price=data["price"],
+                    max_price=data["price"],
+                    is_available=data["is_available"],
+                    category_id=categories[data["category"]],
+                    slug=slug,
+                )
+                for (_, data), slug in zip(valid, slugs)
+            ])
+            variations = ProductVariation.objects.bulk_create([
+                ProductVariation(product=product, **variation)
+                for product, (_, data) in zip(products, valid)
+                for variation in data["variations"]
+            ])
+            CatalogChange.objects.bulk_create(
+                CatalogChange.entries(Product, [p.pk for p in products])
+                + CatalogChange.entries(ProductVariation, [v.pk for v in variations])
+            )
+            Product.refresh_price_range(*{v.product_id for v in variations})
+            apply_count_deltas(count_products(products))
+            bump_catalog_version_on_commit()
+    except DatabaseError as e:
+        for line, _ in valid:
+            report.add_error(line, f"Chunk rolled back: {e}")
+        return
+    report.created += len(products)
+
+
+def import_products(fileobj, fmt, chunk_size=None):
+    """
+    Streams a CSV or JSONL product feed into the catalog in constant memory.
+    Each chunk is validated, slugged in bulk and bulk inserted in its own transaction;
+    bad rows are reported and skipped, a failing chunk is rolled back on its own.
+    Columns: name, description, price, is_available, category (id, slug or name), variations (JSON list).
+    """
+    chunk_size = chunk_size or settings.CATALOG_IMPORT_CHUNK_SIZE
+    report = ImportReport()
+    categories = {}
+    rows = iter_rows(fileobj, fmt)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        report.rows += len(chunk)
+        _import_chunk(chunk, categories, report)
+    return report
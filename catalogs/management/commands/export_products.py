@@ -0,0 +1,37 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalogs.exporters import iter_export
+from catalogs.importers import FORMATS, detect_format
+
+
+class Command(BaseCommand):
+    help = "Stream the full product catalog to a CSV or JSONL file (or stdout with '-')."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Output file, '-' for stdout. A .gz suffix enables gzip.")
+        parser.add_argument("--format", choices=FORMATS, help="Defaults to the file extension.")
+        parser.add_argument("--gzip", action="store_true", help="Gzip the output.")
+        parser.add_argument("--chunk-size", type=int, help="Rows fetched per round trip.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        compress = options["gzip"] or path.endswith(".gz")
+        fmt = options["format"] or detect_format(path.removesuffix(".gz"))
+        started = time.monotonic()
+        written = 0
+        try:
+            out = sys.stdout.buffer if path == "-" else open(path, "wb")
+            try:
+                for data in iter_export(fmt, options["chunk_size"], compress=compress):
+                    out.write(data)
+                    written += len(data)
+            finally:
+                if out is not sys.stdout.buffer:
+                    out.close()
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        elapsed = time.monotonic() - started
+        self.stderr.write(self.style.SUCCESS(f"{written} bytes written in {elapsed:.1f}s"))
@@ -0,0 +1,28 @@
+from concurrent.futures import wait
+
+from django.core.management.base import BaseCommand
+
+from catalogs.images import generate_derivatives, pending_images, shutdown_executor
+from catalogs.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate thumbnails and WebP renditions for product images that lack them or whose file changed. "
+        "Run after deploys and restarts to pick up jobs the in-memory worker pool dropped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Regenerate every image, not only missing ones.")
+        parser.add_argument("--batch-size", type=int, default=200)
+
+    def handle(self, *args, **options):
+        qs = ProductImage.objects.all() if options["all"] else pending_images()
+        ids = list(qs.order_by("pk").values_list("pk", flat=True))
+
+        for start in range(0, len(ids), options["batch_size"]):
+            futures = [generate_derivatives(pk) for pk in ids[start:start + options["batch_size"]]]
+            wait([f for f in futures if f is not None])
+        # Stored from the pool's callback thread; shutting down waits for those callbacks
+        shutdown_executor(wait=True)
+        self.stdout.write(self.style.SUCCESS(f"Processed {len(ids)} images."))
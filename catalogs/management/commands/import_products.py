@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalogs.importers import FORMATS, detect_format, import_products
+
+
+class Command(BaseCommand):
+    help = "Bulk import products from a CSV or JSONL file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=FORMATS, help="Defaults to the file extension.")
+        parser.add_argument("--chunk-size", type=int, help="Rows per bulk insert transaction.")
+
+    def handle(self, *args, **options):
+        fmt = options["format"] or detect_format(options["path"])
+        started = time.monotonic()
+        try:
+            with open(options["path"], "rb") as fh:
+                report = import_products(fh, fmt, options["chunk_size"])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        elapsed = time.monotonic() - started
+
+        for error in report.errors:
+            self.stderr.write(f"row {error['row']}: {error['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{report.created} created, {report.failed} failed of {report.rows} rows in {elapsed:.1f}s"
+        ))
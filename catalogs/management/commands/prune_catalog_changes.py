@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from catalogs.changes import prune_changes
+
+
+class Command(BaseCommand):
+    help = "Delete delta sync change log rows older than the checkpoint retention."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, help="Defaults to CATALOG_CHANGES_RETENTION_DAYS.")
+
+    def handle(self, *args, **options):
+        days = options["days"] if options["days"] is not None else settings.CATALOG_CHANGES_RETENTION_DAYS
+        deleted = prune_changes(timezone.now() - timedelta(days=days))
+        self.stdout.write(self.style.SUCCESS(f"{deleted} change log rows older than {days} days deleted"))
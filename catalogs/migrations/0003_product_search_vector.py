@@ -0,0 +1,75 @@
+# Generated by Django 5.2.7 on 2026-10-17 04:22
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# The tsvector joins the category name, so it cannot be a generated column;
+# a BEFORE trigger keeps it current instead. Other backends fall back to
+# icontains matching in catalogs/search.py and skip this entirely.
+FORWARD_SQL = """
+CREATE OR REPLACE FUNCTION catalogs_product_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('english', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(
+            (SELECT name FROM catalogs_category WHERE id = NEW.category_id), '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(NEW.description, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER catalogs_product_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF name, description, category_id ON catalogs_product
+    FOR EACH ROW EXECUTE FUNCTION catalogs_product_search_vector_update();
+
+CREATE OR REPLACE FUNCTION catalogs_category_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    IF NEW.name IS DISTINCT FROM OLD.name THEN
+        UPDATE catalogs_product SET name = name WHERE category_id = NEW.id;
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER catalogs_category_search_vector_trigger
+    AFTER UPDATE OF name ON catalogs_category
+    FOR EACH ROW EXECUTE FUNCTION catalogs_category_search_vector_update();
+
+UPDATE catalogs_product SET name = name;
+
+CREATE INDEX catalogs_product_search_vector_gin ON catalogs_product USING gin (search_vector);
+"""
+
+BACKWARD_SQL = """
+DROP INDEX IF EXISTS catalogs_product_search_vector_gin;
+DROP TRIGGER IF EXISTS catalogs_category_search_vector_trigger ON catalogs_category;
+DROP FUNCTION IF EXISTS catalogs_category_search_vector_update();
+DROP TRIGGER IF EXISTS catalogs_product_search_vector_trigger ON catalogs_product;
+DROP FUNCTION IF EXISTS catalogs_product_search_vector_update();
+"""
+
+
+def create_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(FORWARD_SQL, params=None)
+
+
+def drop_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(BACKWARD_SQL, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogs', '0002_product_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_trigger, drop_search_trigger),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-17 04:25
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogs', '0004_facet_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='productimage',
+            options={'ordering': ['id']},
+        ),
+    ]
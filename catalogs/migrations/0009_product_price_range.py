@@ -0,0 +1,58 @@
+# Generated by Django 5.2.7 on 2026-10-17 05:20
+
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, F, Max, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_price_range(apps, schema_editor):
+    # Same UPDATE as Product.refresh_price_range, which historical models do not have
+    Product = apps.get_model("catalogs", "Product")
+    ProductVariation = apps.get_model("catalogs", "ProductVariation")
+    available = ProductVariation.objects.filter(product=OuterRef("pk"), is_available=True).order_by().values("product")
+    effective = Coalesce("price", OuterRef("price"), output_field=DecimalField(max_digits=12, decimal_places=2))
+    Product.objects.update(
+        min_price=Coalesce(Subquery(available.annotate(value=Min(effective)).values("value")), F("price")),
+        max_price=Coalesce(Subquery(available.annotate(value=Max(effective)).values("value")), F("price")),
+        in_stock_variation_count=Coalesce(Subquery(available.annotate(value=Count("pk")).values("value")), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogs', '0008_catalogchange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='in_stock_variation_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='max_price',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='min_price',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=12, null=True),
+        ),
+        migrations.RunPython(backfill_price_range, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='product',
+            name='max_price',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=12),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='min_price',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=12),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['min_price', 'id'], name='product_min_price_id_idx'),
+        ),
+    ]
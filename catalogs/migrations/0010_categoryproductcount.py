@@ -0,0 +1,37 @@
+# Generated by Django 5.2.7 on 2026-10-17 04:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def backfill_counts(apps, schema_editor):
+    Category = apps.get_model("catalogs", "Category")
+    CategoryProductCount = apps.get_model("catalogs", "CategoryProductCount")
+    rows = Category.objects.annotate(
+        total=Count("products"),
+        available=Count("products", filter=Q(products__is_available=True)),
+    ).values_list("pk", "total", "available")
+    CategoryProductCount.objects.bulk_create(
+        [CategoryProductCount(category_id=pk, product_count=total, available_count=available) for pk, total, available in rows],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogs', '0009_product_price_range'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryProductCount',
+            fields=[
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counts', serialize=False, to='catalogs.category')),
+                ('product_count', models.PositiveIntegerField(default=0)),
+                ('available_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_counts, migrations.RunPython.noop),
+    ]
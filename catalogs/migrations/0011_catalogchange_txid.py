@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-17 05:10
+
+import catalogs.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogs', '0010_categoryproductcount'),
+    ]
+
+    operations = [
+        # Existing rows are all committed, so 0 orders them first; a constant default also
+        # avoids the table rewrite a volatile default would cause on PostgreSQL
+        migrations.AddField(
+            model_name='catalogchange',
+            name='txid',
+            field=models.BigIntegerField(db_default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='catalogchange',
+            name='txid',
+            field=models.BigIntegerField(db_default=catalogs.models.CurrentTransactionId(), editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='catalogchange',
+            index=models.Index(fields=['txid', 'id'], name='catalogchange_txid_id_idx'),
+        ),
+    ]
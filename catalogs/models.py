@@ -1,30 +1,55 @@
-from django.db import models
-from django.utils.text import slugify
+from django.db import models, transaction
+from django.db.models import Count, DecimalField, F, Max, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.contrib.postgres.search import SearchVectorField
 from django.utils import timezone
+from .slugs import save_with_slug
+
+class CatalogQuerySet(models.QuerySet):
+    def delete(self):
+        """Deletes like QuerySet.delete and logs the deleted rows with one CatalogChange insert."""
+        # record_deleted (catalogs/signals.py) collects this queryset's rows here instead of logging each
+        self._deleted_pks = []
+        with transaction.atomic(savepoint=False):
+            result = super().delete()
+            CatalogChange.record(self.model, self._deleted_pks, CatalogChange.DELETE)
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
 
 class Category(models.Model):
     name = models.CharField(max_length=120, unique=True)
     description = models.TextField(blank=True, null=True)
     slug = models.SlugField(max_length=140, unique=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = CatalogQuerySet.as_manager()
 
     class Meta:
         ordering = ["name"]
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            base = slugify(self.name)[:120]
-            slug_candidate = base
-            num = 1
-            while Category.objects.filter(slug=slug_candidate).exclude(pk=self.pk).exists():
-                slug_candidate = f"{base}-{num}"
-                num += 1
-            self.slug = slug_candidate
+            return save_with_slug(self, self.name, 120, super().save, *args, **kwargs)
         super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
 
+class CategoryProductCount(models.Model):
+    """
+    Materialized per-category product counts, kept in step by catalogs/category_counts.py.
+    `reconcile_category_counts` repairs drift from writes that bypass it (e.g. QuerySet.update).
+    """
+    category = models.OneToOneField(Category, on_delete=models.CASCADE, primary_key=True, related_name="counts")
+    product_count = models.PositiveIntegerField(default=0)
+    available_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.category_id}: {self.available_count}/{self.product_count}"
+
 class Product(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True, null=True)
@@ -34,29 +59,78 @@ class Product(models.Model):
     slug = models.SlugField(max_length=300, unique=True, blank=True)
     representative_image = models.ImageField(upload_to="product_images/representative/", blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Also touched when the product's images or variations change (catalogs/signals.py)
+    updated_at = models.DateTimeField(auto_now=True)
+    # What customers actually pay: the range of effective prices over available variations
+    # (variation override or product price), or just `price` without any. See refresh_price_range.
+    min_price = models.DecimalField(max_digits=12, decimal_places=2, editable=False)
+    max_price = models.DecimalField(max_digits=12, decimal_places=2, editable=False)
+    in_stock_variation_count = models.PositiveIntegerField(default=0, editable=False)
+    # Maintained by a database trigger on PostgreSQL (see migration 0003), GIN indexed
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = CatalogQuerySet.as_manager()
 
     class Meta:
-        ordering = ["-created_at"]
+        ordering = ["-created_at", "id"]
+        indexes = [
+            models.Index(fields=["-created_at", "id"], name="product_created_id_idx"),
+            models.Index(fields=["category", "-created_at", "id"], name="product_cat_created_id_idx"),
+            models.Index(fields=["price"], name="product_price_idx"),
+            models.Index(fields=["min_price", "id"], name="product_min_price_id_idx"),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so saves can move category counts; deferred ones are looked up before a write
+        instance._counted_as = (instance.__dict__.get("category_id"), instance.__dict__.get("is_available"))
+        return instance
 
     def save(self, *args, **kwargs):
+        if self._state.adding and self.min_price is None:
+            # A new product has no variations yet; later changes go through refresh_price_range
+            self.min_price = self.max_price = self.price
         if not self.slug:
-            base = slugify(self.name)[:240]
-            slug_candidate = base
-            num = 1
-            while Product.objects.filter(slug=slug_candidate).exclude(pk=self.pk).exists():
-                slug_candidate = f"{base}-{num}"
-                num += 1
-            self.slug = slug_candidate
+            return save_with_slug(self, self.name, 240, super().save, *args, **kwargs)
         super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def touch(cls, *pks):
+        cls.objects.filter(pk__in=pks).update(updated_at=timezone.now())
+        CatalogChange.record(cls, pks)
+
+    @classmethod
+    def refresh_price_range(cls, *pks):
+        """
+        Recomputes min_price, max_price and in_stock_variation_count from the variations
+        in a single UPDATE. Call it in the transaction that changed the variations or price.
+        """
+        available = ProductVariation.objects.filter(product=OuterRef("pk"), is_available=True).order_by().values("product")
+        effective = Coalesce("price", OuterRef("price"), output_field=DecimalField(max_digits=12, decimal_places=2))
+        cls.objects.filter(pk__in=pks).update(
+            min_price=Coalesce(Subquery(available.annotate(value=Min(effective)).values("value")), F("price")),
+            max_price=Coalesce(Subquery(available.annotate(value=Max(effective)).values("value")), F("price")),
+            in_stock_variation_count=Coalesce(Subquery(available.annotate(value=Count("pk")).values("value")), 0),
+        )
+
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="images")
     image = models.ImageField(upload_to="product_images/")
     alt_text = models.CharField(max_length=255, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    # {"source": <image name>, "renditions": {"thumb" | "<w>w": {"name", "width", "height"}}}, see catalogs/images.py
+    derivatives = models.JSONField(default=dict, blank=True, editable=False)
+
+    objects = CatalogQuerySet.as_manager()
+
+    class Meta:
+        ordering = ["id"]
 
     def __str__(self):
         return f"Image for {self.product.name}"
@@ -69,9 +143,15 @@ class ProductVariation(models.Model):
             help_text="Optional override price for this variation (if empty uses product.price)")
     is_available = models.BooleanField(default=True)
 
+    objects = CatalogQuerySet.as_manager()
+
     class Meta:
         unique_together = (("product", "color", "size"),)
         ordering = ["id"]
+        indexes = [
+            models.Index(fields=["color", "product"], name="variation_color_product_idx"),
+            models.Index(fields=["size", "product"], name="variation_size_product_idx"),
+        ]
 
     def __str__(self):
         parts = []
@@ -80,3 +160,53 @@ class ProductVariation(models.Model):
         if self.size:
             parts.append(self.size)
         return f"{self.product.name} - {'/'.join(parts) if parts else 'Default'}"
+
+
+class CurrentTransactionId(models.Func):
+    """
+    The id of the transaction inserting the row. PostgreSQL only; other backends serialize
+    writers, so commit order already matches id order there and 0 is stored.
+    """
+    output_field = models.BigIntegerField()
+
+    def as_sql(self, compiler, connection, **extra_context):
+        return "0", []
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return "(pg_current_xact_id()::text::bigint)", []
+
+class CatalogChange(models.Model):
+    """
+    Append-only log of catalog writes, deletions included, read by the delta sync endpoint.
+    (txid, id) is the sync checkpoint; see catalogs/changes.py for why the transaction id is needed.
+    """
+    UPSERT = "upsert"
+    DELETE = "delete"
+    ACTION_CHOICES = ((UPSERT, "Upsert"), (DELETE, "Delete"))
+
+    # model_name of the changed row: category, product, productimage or productvariation
+    kind = models.CharField(max_length=32)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=6, choices=ACTION_CHOICES, default=UPSERT)
+    changed_at = models.DateTimeField(default=timezone.now)
+    txid = models.BigIntegerField(db_default=CurrentTransactionId(), editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["changed_at"], name="catalogchange_changed_at_idx"),
+            models.Index(fields=["txid", "id"], name="catalogchange_txid_id_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.action} {self.kind} {self.object_id}"
+
+    @classmethod
+    def entries(cls, model, pks, action=UPSERT):
+        """Unsaved changes for `pks`, for writes that log several models with one bulk_create."""
+        kind = model._meta.model_name
+        return [cls(kind=kind, object_id=pk, action=action) for pk in pks if pk is not None]
+
+    @classmethod
+    def record(cls, model, pks, action=UPSERT):
+        """Logs one change per pk. Bulk writes that skip model signals must call this themselves."""
+        cls.objects.bulk_create(cls.entries(model, pks, action))
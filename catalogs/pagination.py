@@ -0,0 +1,116 @@
+import json
+import operator
+from functools import reduce
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class ProductCursorPagination(CursorPagination):
+    """
+    Keyset pagination over Product.Meta.ordering.
+    Cursors are opaque, each page is a single indexed range scan and no COUNT(*) is issued.
+    ?ordering=price / -price sorts on the denormalized Product.min_price, backed by its (min_price, id) index.
+    DRF positions a cursor on the first ordering field alone and pages through ties by OFFSET,
+    which loops once a tie outgrows offset_cutoff; here the position holds every ordering
+    field, so it is unique and ties are paged by keyset like everything else.
+    """
+    ordering = ("-created_at", "id")
+    ordering_query_param = "ordering"
+    orderings = {
+        "newest": ("-created_at", "id"),
+        "price": ("min_price", "id"),
+        "-price": ("-min_price", "-id"),
+    }
+    page_size = getattr(settings, "CATALOG_PAGE_SIZE", 20)
+    page_size_query_param = "page_size"
+    max_page_size = getattr(settings, "CATALOG_MAX_PAGE_SIZE", 100)
+
+    def get_ordering(self, request, queryset, view):
+        value = request.query_params.get(self.ordering_query_param)
+        if not value:
+            return self.ordering
+        if value not in self.orderings:
+            raise ValidationError({self.ordering_query_param: f"Must be one of {list(self.orderings)}."})
+        return self.orderings[value]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # CursorPagination.paginate_queryset with the keyset filter of after(); positions are
+        # unique, so the links DRF builds from them never fall back to offsets
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        offset, reverse, current_position = self.cursor or (0, False, None)
+
+        ordering = tuple(f[1:] if f.startswith("-") else f"-{f}" for f in self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if current_position is not None:
+            try:
+                queryset = queryset.filter(self.after(current_position, reverse))
+            except (TypeError, ValueError, DjangoValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        following_position = None
+        if len(results) > len(self.page):
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = current_position is not None or offset > 0
+            self.has_previous = following_position is not None
+            self.next_position, self.previous_position = current_position, following_position
+        else:
+            self.has_next = following_position is not None
+            self.has_previous = current_position is not None or offset > 0
+            self.next_position, self.previous_position = following_position, current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def decode_cursor(self, request):
+        cursor = super().decode_cursor(request)
+        if cursor is not None and cursor.position is not None:
+            try:
+                values = json.loads(cursor.position)
+            except ValueError:
+                raise NotFound(self.invalid_cursor_message)
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def after(self, position, reverse=False):
+        """
+        Rows past `position` in the ordering (before it when paging backwards):
+        (a > x) OR (a = x AND b > y) ..., with < for descending fields.
+        """
+        conditions, equal = [], {}
+        for field, value in zip(self.ordering, json.loads(position)):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") != reverse else "gt"
+            conditions.append(Q(**equal, **{f"{name}__{lookup}": value}))
+            equal[name] = value
+        return reduce(operator.or_, conditions)
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = [instance[f.lstrip("-")] if isinstance(instance, dict) else getattr(instance, f.lstrip("-")) for f in ordering]
+        return json.dumps([str(value) for value in values], separators=(",", ":"))
+
+
+class ProductSearchPagination(PageNumberPagination):
+    """
+    Search results are ordered by rank rather than a stable key, so they use page numbers.
+    """
+    page_size = getattr(settings, "CATALOG_PAGE_SIZE", 20)
+    page_size_query_param = "page_size"
+    max_page_size = getattr(settings, "CATALOG_MAX_PAGE_SIZE", 100)
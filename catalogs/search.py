@@ -0,0 +1,32 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import Case, F, IntegerField, Q, Value, When
+
+
+def search_products(queryset, query):
+    """
+    Filters and ranks products by a free-text query.
+    PostgreSQL uses the trigger-maintained, GIN indexed search_vector; other
+    backends (SQLite in local tests) fall back to weighted icontains matching.
+    """
+    if connections[queryset.db].vendor == "postgresql":
+        search_query = SearchQuery(query, search_type="websearch", config="english")
+        return (
+            queryset.filter(search_vector=search_query)
+            .annotate(rank=SearchRank(F("search_vector"), search_query))
+            .order_by("-rank", "-created_at", "id")
+        )
+
+    terms = query.split()
+    rank = Value(0)
+    for term in terms:
+        queryset = queryset.filter(
+            Q(name__icontains=term) | Q(category__name__icontains=term) | Q(description__icontains=term)
+        )
+        rank = rank + Case(
+            When(name__icontains=term, then=Value(3)),
+            When(category__name__icontains=term, then=Value(2)),
+            default=Value(1),
+            output_field=IntegerField(),
+        )
+    return queryset.annotate(rank=rank).order_by("-rank", "-created_at", "id")
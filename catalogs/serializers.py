@@ -1,19 +1,40 @@
 from rest_framework import serializers
 from .models import Category, Product, ProductImage, ProductVariation
 from django.db import transaction
+from .fieldsets import SparseFieldsetMixin
+from .images import rendition_url, srcset
+from .variations import create_variations, sync_variations
+from decimal import Decimal, InvalidOperation
 import json
 
-class CategorySerializer(serializers.ModelSerializer):
+PRICE_RANGE_FIELDS = ["min_price", "max_price", "in_stock_variation_count"]
+
+class CategorySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    # Read from the materialized CategoryProductCount row, joined in by the query planner
+    product_count = serializers.IntegerField(source="counts.product_count", read_only=True)
+    available_count = serializers.IntegerField(source="counts.available_count", read_only=True)
+
     class Meta:
         model = Category
-        fields = ["id", "name", "description", "slug", "created_at"]
+        fields = ["id", "name", "description", "slug", "product_count", "available_count", "created_at"]
         read_only_fields = ["id", "slug", "created_at"]
 
 class ProductImageSerializer(serializers.ModelSerializer):
+    thumbnail = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
+
+    query_hints = {"thumbnail": ["image", "derivatives"], "srcset": ["image", "derivatives"]}
+
     class Meta:
         model = ProductImage
-        fields = ["id", "image", "alt_text", "uploaded_at"]
-        read_only_fields = ["id", "uploaded_at"]
+        fields = ["id", "image", "alt_text", "width", "height", "thumbnail", "srcset", "uploaded_at"]
+        read_only_fields = ["id", "width", "height", "uploaded_at"]
+
+    def get_thumbnail(self, obj):
+        return rendition_url(obj, "thumb", self.context.get("request"))
+
+    def get_srcset(self, obj):
+        return srcset(obj, self.context.get("request"))
 
 class ProductVariationSerializer(serializers.ModelSerializer):
     class Meta:
@@ -21,35 +42,82 @@ class ProductVariationSerializer(serializers.ModelSerializer):
         fields = ["id", "color", "size", "price", "is_available"]
         read_only_fields = ["id"]
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductImageChangeSerializer(ProductImageSerializer):
+    """Images as standalone rows in the change feed, pointing back at their product."""
+    class Meta(ProductImageSerializer.Meta):
+        fields = ProductImageSerializer.Meta.fields + ["product"]
+
+class ProductVariationChangeSerializer(ProductVariationSerializer):
+    class Meta(ProductVariationSerializer.Meta):
+        fields = ProductVariationSerializer.Meta.fields + ["product"]
+
+def representative_image_url(obj, request):
+    if obj.representative_image:
+        image = obj.representative_image
+    else:
+        # iterate all() rather than first() so a prefetched images cache is reused
+        first = next(iter(obj.images.all()), None)
+        image = first.image if first else None
+    if not image:
+        return None
+    if request:
+        return request.build_absolute_uri(image.url)
+    return image.url
+
+def thumbnail_url(obj, request):
+    first = next(iter(obj.images.all()), None)
+    if first is None:
+        return representative_image_url(obj, request)
+    return rendition_url(first, "thumb", request)
+
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
     variations = ProductVariationSerializer(many=True, read_only=True)
     category = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all())
     representative_image = serializers.SerializerMethodField(read_only=True)
+    thumbnail = serializers.SerializerMethodField(read_only=True)
+
+    query_hints = {
+        "representative_image": ["representative_image", "images.image"],
+        "thumbnail": ["representative_image", "images.image", "images.derivatives"],
+    }
 
     class Meta:
         model = Product
-        fields = ["id", "name", "description", "price", "is_available", "category", "slug", "images", "representative_image", "variations", "created_at"]
-        read_only_fields = ["id", "slug", "images", "representative_image", "variations", "created_at"]
+        fields = ["id", "name", "description", "price", "min_price", "max_price", "in_stock_variation_count", "is_available", "category", "slug", "images", "representative_image", "thumbnail", "variations", "created_at"]
+        read_only_fields = ["id", "slug", "min_price", "max_price", "in_stock_variation_count", "images", "representative_image", "thumbnail", "variations", "created_at"]
 
     def get_representative_image(self, obj):
-        request = self.context.get("request")
-        if obj.representative_image:
-            if request:
-                return request.build_absolute_uri(obj.representative_image.url)
-            return obj.representative_image.url
-        
-        first = obj.images.first()
-        if first:
-            if request:
-                return request.build_absolute_uri(first.image.url)
-            return first.image.url
-        return None
+        return representative_image_url(obj, self.context.get("request"))
+
+    def get_thumbnail(self, obj):
+        return thumbnail_url(obj, self.context.get("request"))
 
     def to_internal_value(self, data):
         data = super().to_internal_value(data)
         return data
 
+class ProductCompactSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """Listing shape without the nested images and variations."""
+    representative_image = serializers.SerializerMethodField(read_only=True)
+    thumbnail = serializers.SerializerMethodField(read_only=True)
+
+    query_hints = {
+        "representative_image": ["representative_image", "images.image"],
+        "thumbnail": ["representative_image", "images.image", "images.derivatives"],
+    }
+
+    class Meta:
+        model = Product
+        fields = ["id", "name", "slug", "price", "min_price", "max_price", "is_available", "category", "representative_image", "thumbnail"]
+        read_only_fields = fields
+
+    def get_representative_image(self, obj):
+        return representative_image_url(obj, self.context.get("request"))
+
+    def get_thumbnail(self, obj):
+        return thumbnail_url(obj, self.context.get("request"))
+
 class ProductCreateUpdateSerializer(serializers.ModelSerializer):
     variations = serializers.JSONField(required=False)
 
@@ -66,6 +134,19 @@ class ProductCreateUpdateSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError("Invalid JSON for variations.")
         if not isinstance(value, list):
             raise serializers.ValidationError("Variations must be a list.")
+        keys = set()
+        for v in value:
+            if not isinstance(v, dict):
+                raise serializers.ValidationError("Each variation must be an object.")
+            if v.get("price") not in (None, ""):
+                try:
+                    Decimal(str(v["price"]))
+                except InvalidOperation:
+                    raise serializers.ValidationError(f"Invalid price '{v['price']}'.")
+            key = (v.get("color"), v.get("size"))
+            if key in keys:
+                raise serializers.ValidationError(f"Duplicate variation for color/size {key}.")
+            keys.add(key)
         return value
 
     @transaction.atomic
@@ -76,15 +157,9 @@ class ProductCreateUpdateSerializer(serializers.ModelSerializer):
             validated_data["is_available"] = True
 
         product = Product.objects.create(**validated_data)
-
-        for v in variations_data:
-            ProductVariation.objects.create(
-                product=product,
-                color=v.get("color"),
-                size=v.get("size"),
-                price=v.get("price") if v.get("price") not in (None, "") else None,
-                is_available=v.get("is_available", True),
-            )
+        create_variations(product, variations_data)
+        if variations_data:
+            product.refresh_from_db(fields=PRICE_RANGE_FIELDS)
         return product
 
     @transaction.atomic
@@ -99,13 +174,7 @@ class ProductCreateUpdateSerializer(serializers.ModelSerializer):
         instance.save()
 
         if variations_data is not None:
-            instance.variations.all().delete()
-            for v in variations_data:
-                ProductVariation.objects.create(
-                    product=instance,
-                    color=v.get("color"),
-                    size=v.get("size"),
-                    price=v.get("price") if v.get("price") not in (None, "") else None,
-                    is_available=v.get("is_available", True),
-                )
+            sync_variations(instance, variations_data)
+        # Maintained in the database by Product.refresh_price_range
+        instance.refresh_from_db(fields=PRICE_RANGE_FIELDS)
         return instance
\ No newline at end of file
@@ -0,0 +1,88 @@
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
+from .models import CatalogChange, Category, CategoryProductCount, Product, ProductImage, ProductVariation
+from .category_counts import product_deleted, product_deleting, product_saved, product_saving
+from .cache import bump_catalog_version_on_commit
+from .images import schedule_derivatives
+
+
+def invalidate_catalog_cache(sender, **kwargs):
+    bump_catalog_version_on_commit()
+
+for model in (Category, Product, ProductImage, ProductVariation):
+    post_save.connect(invalidate_catalog_cache, sender=model, dispatch_uid=f"catalog_cache_save_{model.__name__}")
+    post_delete.connect(invalidate_catalog_cache, sender=model, dispatch_uid=f"catalog_cache_delete_{model.__name__}")
+
+
+def record_saved(sender, instance, **kwargs):
+    CatalogChange.record(sender, [instance.pk])
+
+def record_deleted(sender, instance, origin=None, **kwargs):
+    # Rows of a queryset delete are logged together by CatalogQuerySet.delete;
+    # rows it cascades to (other models) are still logged here
+    deleted = getattr(origin, "_deleted_pks", None)
+    if deleted is not None and origin.model is sender:
+        deleted.append(instance.pk)
+        return
+    CatalogChange.record(sender, [instance.pk], CatalogChange.DELETE)
+
+for model in (Category, Product, ProductImage, ProductVariation):
+    post_save.connect(record_saved, sender=model, dispatch_uid=f"catalog_change_save_{model.__name__}")
+    post_delete.connect(record_deleted, sender=model, dispatch_uid=f"catalog_change_delete_{model.__name__}")
+
+
+def touch_parent_product(sender, instance, origin=None, **kwargs):
+    # Queryset and cascading deletes pass the QuerySet or the parent as origin;
+    # those callers touch the product themselves, or the product itself is going away
+    if origin is not None and origin is not instance:
+        return
+    Product.touch(instance.product_id)
+
+for model in (ProductImage, ProductVariation):
+    post_save.connect(touch_parent_product, sender=model, dispatch_uid=f"catalog_touch_save_{model.__name__}")
+    post_delete.connect(touch_parent_product, sender=model, dispatch_uid=f"catalog_touch_delete_{model.__name__}")
+
+
+def refresh_variation_price_range(sender, instance, origin=None, **kwargs):
+    # Bulk variation writes refresh the product themselves, see catalogs/variations.py
+    if origin is not None and origin is not instance:
+        return
+    Product.refresh_price_range(instance.product_id)
+
+def refresh_product_price_range(sender, instance, created, **kwargs):
+    # New products start at min_price = max_price = price, see Product.save
+    if not created:
+        Product.refresh_price_range(instance.pk)
+
+post_save.connect(refresh_variation_price_range, sender=ProductVariation, dispatch_uid="catalog_price_range_variation_save")
+post_delete.connect(refresh_variation_price_range, sender=ProductVariation, dispatch_uid="catalog_price_range_variation_delete")
+post_save.connect(refresh_product_price_range, sender=Product, dispatch_uid="catalog_price_range_product_save")
+
+
+def count_saving_product(sender, instance, update_fields=None, using=None, **kwargs):
+    product_saving(instance, update_fields, using)
+
+def count_saved_product(sender, instance, created, **kwargs):
+    product_saved(instance, created)
+
+def count_deleting_product(sender, instance, using=None, **kwargs):
+    product_deleting(instance, using)
+
+def count_deleted_product(sender, instance, **kwargs):
+    product_deleted(instance)
+
+def create_category_counts(sender, instance, created, **kwargs):
+    if created:
+        CategoryProductCount.objects.get_or_create(category=instance)
+
+pre_save.connect(count_saving_product, sender=Product, dispatch_uid="catalog_counts_product_presave")
+post_save.connect(count_saved_product, sender=Product, dispatch_uid="catalog_counts_product_save")
+pre_delete.connect(count_deleting_product, sender=Product, dispatch_uid="catalog_counts_product_predelete")
+post_delete.connect(count_deleted_product, sender=Product, dispatch_uid="catalog_counts_product_delete")
+post_save.connect(create_category_counts, sender=Category, dispatch_uid="catalog_counts_category_save")
+
+
+def queue_image_derivatives(sender, instance, **kwargs):
+    if instance.image and instance.derivatives.get("source") != instance.image.name:
+        schedule_derivatives(instance.pk)
+
+post_save.connect(queue_image_derivatives, sender=ProductImage, dispatch_uid="catalog_image_derivatives")
@@ -0,0 +1,102 @@
+import re
+
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import BigIntegerField, Count, Max, Q, Value
+from django.db.models.functions import Cast, Substr
+from django.utils.text import slugify
+
+# SQLite caps compound SELECTs at 500 terms
+UNION_BATCH = 200
+SAVE_ATTEMPTS = 3
+
+
+def _lock_bases(model, bases, using):
+    """
+    Serializes concurrent allocation of the same bases with transaction scoped advisory locks.
+    Locks are taken in hash order so overlapping batches cannot deadlock.
+    Other backends rely on the unique constraint and the retry in save_with_slug.
+    """
+    connection = connections[using]
+    if connection.vendor != "postgresql" or not connection.in_atomic_block:
+        return
+    keys = sorted({f"{model._meta.db_table}:{base}" for base in bases})
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_advisory_xact_lock(hashtext(k)) FROM unnest(%s::text[]) AS k ORDER BY hashtext(k)",
+            [keys],
+        )
+
+def _suffix_query(model, base, exclude_pk=None):
+    """Whether `base` is taken and the highest numeric `base-N` suffix, as one grouped row."""
+    qs = model._default_manager.filter(Q(slug=base) | Q(slug__startswith=f"{base}-"))
+    if exclude_pk is not None:
+        qs = qs.exclude(pk=exclude_pk)
+    numbered = Q(slug__regex=rf"^{re.escape(base)}-[0-9]+$")
+    return (
+        qs.order_by()
+        .annotate(base=Value(base))
+        .values("base")
+        .annotate(
+            taken=Count("pk", filter=Q(slug=base)),
+            max_suffix=Max(Cast(Substr("slug", len(base) + 2), BigIntegerField()), filter=numbered),
+        )
+    )
+
+def allocate_slugs(model, names, max_length, using=None, exclude_pk=None):
+    """
+    Returns one unique slug per name, in order, for `model.slug`.
+    Each distinct base costs a prefix scan aggregated to (taken, max suffix) and the
+    bases are UNION ALL'd, so a whole batch needs a single query (per UNION_BATCH bases).
+    Call inside the transaction that inserts the rows so the PostgreSQL locks cover the insert.
+    """
+    using = using or router.db_for_write(model)
+    bases = [slugify(name)[:max_length] for name in names]
+    distinct = sorted(set(bases))
+    if not distinct:
+        return []
+    _lock_bases(model, distinct, using)
+
+    taken, next_suffix = set(), {}
+    for start in range(0, len(distinct), UNION_BATCH):
+        queries = [_suffix_query(model, base, exclude_pk).using(using) for base in distinct[start:start + UNION_BATCH]]
+        query = queries[0].union(*queries[1:], all=True) if len(queries) > 1 else queries[0]
+        for row in query:
+            if row["taken"]:
+                taken.add(row["base"])
+            next_suffix[row["base"]] = (row["max_suffix"] or 0) + 1
+
+    slugs, used = [], set()
+    for base in bases:
+        candidate = base
+        if base in taken or base in used:
+            # Names inside one batch may also collide, e.g. "T-Shirt" twice or "T-Shirt" and "T-Shirt 4"
+            suffix = next_suffix.get(base, 1)
+            while f"{base}-{suffix}" in used:
+                suffix += 1
+            candidate = f"{base}-{suffix}"
+            next_suffix[base] = suffix + 1
+        used.add(candidate)
+        slugs.append(candidate)
+    return slugs
+
+def allocate_slug(instance, name, max_length, using=None):
+    return allocate_slugs(type(instance), [name], max_length, using=using, exclude_pk=instance.pk)[0]
+
+
+def save_with_slug(instance, name, max_length, save, *args, **kwargs):
+    """
+    Allocates instance.slug and runs `save` in one transaction.
+    Retries when a concurrent writer took the same slug first.
+    """
+    using = kwargs.get("using") or router.db_for_write(type(instance), instance=instance)
+    for attempt in range(SAVE_ATTEMPTS):
+        try:
+            with transaction.atomic(using=using):
+                instance.slug = allocate_slug(instance, name, max_length, using=using)
+                save(*args, **kwargs)
+            return
+        except IntegrityError:
+            slug, instance.slug = instance.slug, ""
+            clash = type(instance)._default_manager.using(using).filter(slug=slug).exclude(pk=instance.pk).exists()
+            if not clash or attempt == SAVE_ATTEMPTS - 1:
+                raise
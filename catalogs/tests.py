@@ -1,3 +1,839 @@
-from django.test import TestCase
+import base64
+import gzip
+import io
+import json
+import tempfile
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+from unittest import mock
+from urllib.parse import urlencode
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, OperationalError, connection, connections, router
+from django.http import QueryDict
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from E_Commerce import db_router
+from E_Commerce.db_router import mark_sticky, read_from
+
+from .cache import get_catalog_cache, get_catalog_version
+from .category_counts import reconcile_category_counts
+from .changes import SnapshotXmin, decode_token, encode_token, read_changes
+from .filters import facet_counts, parse_product_filters
+from .image_processing import render_stored_derivatives
+from .images import generate_derivatives, pending_images, srcset
+from .importers import import_products
+from .models import CatalogChange, Category, CategoryProductCount, Product, ProductImage, ProductVariation
+from .pagination import ProductCursorPagination
+from .slugs import allocate_slugs
+from .variations import create_variations, sync_variations
+
+
+class CatalogAPITestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(email="shopper@example.com", phone_number="5551000", password="pw")
+        cls.staff = User.objects.create_user(email="staff@example.com", phone_number="5551001", password="pw", is_staff=True)
+
+    def setUp(self):
+        # Cached responses are keyed by catalog version, which outlives each test's rollback
+        get_catalog_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def walk(self, url):
+        """Follows `next` links from `url` and returns every result id in order."""
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.data)
+            ids += [row["id"] for row in response.data["results"]]
+            url = response.data["next"]
+        return ids
+
+
+class ProductCursorPaginationTests(CatalogAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        category = Category.objects.create(name="Pagination")
+        for i in range(12):
+            Product.objects.create(name=f"Paged {i}", price=Decimal(50 - i * 3), category=category)
+
+    def test_pages_cover_the_list_once_in_order(self):
+        expected = list(Product.objects.order_by("-created_at", "id").values_list("id", flat=True))
+        self.assertEqual(self.walk("/api/products/?page_size=5"), expected)
+
+    def test_price_orderings(self):
+        ascending = list(Product.objects.order_by("min_price", "id").values_list("id", flat=True))
+        self.assertEqual(self.walk("/api/products/?ordering=price&page_size=5"), ascending)
+        self.assertEqual(self.walk("/api/products/?ordering=-price&page_size=5"), ascending[::-1])
+
+    def test_rows_inserted_behind_the_cursor_do_not_shift_pages(self):
+        response = self.client.get("/api/products/?page_size=5")
+        seen = [row["id"] for row in response.data["results"]]
+        # Newest first, so this lands on the already-read first page
+        Product.objects.create(name="Late", price=Decimal("1.00"), category=Category.objects.get())
+        get_catalog_cache().clear()
+        rest = self.walk(response.data["next"])
+        self.assertEqual(len(seen + rest), 12)
+        self.assertFalse(set(seen) & set(rest))
+
+    def test_unknown_ordering_is_rejected(self):
+        response = self.client.get("/api/products/?ordering=name")
+        self.assertEqual(response.status_code, 400)
+
+    @mock.patch.object(ProductCursorPagination, "offset_cutoff", 4)
+    def test_ties_longer_than_the_offset_cutoff(self):
+        category = Category.objects.get()
+        tied = [Product.objects.create(name=f"Tied {i}", price=Decimal("7.00"), category=category).pk for i in range(9)]
+        Product.objects.filter(pk__in=tied).update(created_at=timezone.now())
+        for ordering in ("price", "-price", "newest"):
+            with self.subTest(ordering=ordering):
+                url = f"/api/products/?ordering={ordering}&page_size=2"
+                ids = self.walk(url)
+                expected = self.walk(f"/api/products/?ordering={ordering}&page_size=100")
+                self.assertEqual(ids, expected)
+                self.assertEqual(len(ids), 21)
+
+                # And back again from the last page
+                while url:
+                    page = self.client.get(url).data
+                    url = page["next"]
+                back, previous = [row["id"] for row in page["results"]], page["previous"]
+                while previous:
+                    page = self.client.get(previous).data
+                    back = [row["id"] for row in page["results"]] + back
+                    previous = page["previous"]
+                self.assertEqual(back, expected)
+
+    def test_malformed_cursor_is_not_found(self):
+        for position in ("abc", '["x","1"]', '["1"]'):
+            cursor = base64.b64encode(urlencode({"p": position}).encode()).decode()
+            with self.subTest(position=position):
+                response = self.client.get("/api/products/", {"ordering": "price", "cursor": cursor})
+                self.assertEqual(response.status_code, 404)
+
+
+class CatalogResponseCacheTests(CatalogAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.category = Category.objects.create(name="Cached")
+        cls.product = Product.objects.create(name="Cached Mug", price=Decimal("9.00"), category=cls.category)
+
+    def test_repeat_reads_hit_the_cache(self):
+        first = self.client.get(f"/api/products/{self.product.pk}/")
+        self.assertEqual(first["X-Cache"], "MISS")
+        with self.assertNumQueries(1):
+            # Only the ETag validator's pk lookup; the body comes from the cache
+            second = self.client.get(f"/api/products/{self.product.pk}/")
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(second.data, first.data)
+
+    def test_committed_write_invalidates(self):
+        self.client.get("/api/products/")
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = "Renamed Mug"
+            self.product.save()
+        self.assertGreater(get_catalog_version(), version)
+        response = self.client.get("/api/products/")
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data["results"][0]["name"], "Renamed Mug")
+
+    def test_version_only_moves_on_commit(self):
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            Product.objects.create(name="Pending", price=Decimal("1.00"), category=self.category)
+        self.assertEqual(get_catalog_version(), version)
+        self.assertTrue(callbacks)
+
+    def test_cache_stats_are_staff_only(self):
+        self.client.get("/api/category/")
+        self.client.get("/api/category/")
+        self.assertEqual(self.client.get("/api/products/cache-stats/").status_code, 403)
+        self.client.force_authenticate(self.staff)
+        stats = self.client.get("/api/products/cache-stats/").data
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+
+class ProductSearchTests(CatalogAPITestCase):
+    """Runs the icontains fallback on SQLite and the tsvector path on PostgreSQL."""
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        lamps = Category.objects.create(name="Lamps")
+        desks = Category.objects.create(name="Desks")
+        cls.by_name = Product.objects.create(name="Brass lamp", price=Decimal("40.00"), category=desks)
+        cls.by_category = Product.objects.create(name="Reading light", price=Decimal("30.00"), category=lamps)
+        cls.by_description = Product.objects.create(name="Shelf", description="Fits a small lamp", price=Decimal("20.00"), category=desks)
+        Product.objects.create(name="Chair", price=Decimal("10.00"), category=desks)
+
+    def search(self, query):
+        response = self.client.get("/api/products/search/", {"q": query})
+        self.assertEqual(response.status_code, 200)
+        return [row["id"] for row in response.data["results"]]
+
+    def test_name_matches_rank_above_category_and_description(self):
+        self.assertEqual(self.search("lamp"), [self.by_name.pk, self.by_category.pk, self.by_description.pk])
+
+    def test_every_term_must_match(self):
+        self.assertEqual(self.search("brass lamp"), [self.by_name.pk])
+        self.assertEqual(self.search("brass chair"), [])
+
+    def test_missing_query_is_rejected(self):
+        self.assertEqual(self.client.get("/api/products/search/", {"q": "  "}).status_code, 400)
+
+
+class ProductFacetTests(CatalogAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.shirts = Category.objects.create(name="Shirts")
+        cls.pants = Category.objects.create(name="Pants")
+        cls.red_shirt = Product.objects.create(name="Red shirt", price=Decimal("400.00"), category=cls.shirts)
+        ProductVariation.objects.create(product=cls.red_shirt, color="red", size="M")
+        ProductVariation.objects.create(product=cls.red_shirt, color="red", size="L")
+        cls.blue_shirt = Product.objects.create(name="Blue shirt", price=Decimal("700.00"), category=cls.shirts)
+        ProductVariation.objects.create(product=cls.blue_shirt, color="blue", size="M")
+        cls.red_pants = Product.objects.create(name="Red pants", price=Decimal("1200.00"), category=cls.pants)
+        ProductVariation.objects.create(product=cls.red_pants, color="red", size="32")
+
+    def facets(self, query=""):
+        filters = parse_product_filters(QueryDict(query))
+        with self.assertNumQueries(1):
+            return facet_counts(filters)
+
+    def as_dict(self, items):
+        return {item["value"]: item["count"] for item in items}
+
+    def test_unfiltered_counts(self):
+        facets = self.facets()
+        self.assertEqual(self.as_dict(facets["category"]), {self.shirts.pk: 2, self.pants.pk: 1})
+        # Products, not variations: the red shirt counts once for red
+        self.assertEqual(self.as_dict(facets["color"]), {"red": 2, "blue": 1})
+        self.assertEqual(self.as_dict(facets["size"]), {"M": 2, "L": 1, "32": 1})
+        self.assertEqual(self.as_dict(facets["price"]), {"0-500": 1, "500-1000": 1, "1000-2500": 1})
+
+    def test_a_facet_ignores_its_own_filter(self):
+        facets = self.facets("color=red")
+        self.assertEqual(self.as_dict(facets["color"]), {"red": 2, "blue": 1})
+        self.assertEqual(self.as_dict(facets["category"]), {self.shirts.pk: 1, self.pants.pk: 1})
+        self.assertEqual(self.as_dict(facets["size"]), {"M": 1, "L": 1, "32": 1})
+
+    def test_list_filters_and_reports_facets(self):
+        response = self.client.get("/api/products/", {"category": self.shirts.slug, "size": "M", "max_price": "500"})
+        self.assertEqual([row["id"] for row in response.data["results"]], [self.red_shirt.pk])
+        self.assertEqual(self.as_dict(response.data["facets"]["size"]), {"M": 1, "L": 1})
+
+    def test_invalid_filter_values_are_rejected(self):
+        self.assertEqual(self.client.get("/api/products/", {"min_price": "cheap"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/products/", {"is_available": "maybe"}).status_code, 400)
+
+
+class SparseFieldsetTests(CatalogAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        category = Category.objects.create(name="Sparse")
+        for i in range(3):
+            product = Product.objects.create(name=f"Sparse {i}", description="long text " * 50, price=Decimal("5.00"), category=category)
+            ProductVariation.objects.create(product=product, color="green", size="S")
+
+    def test_only_requested_fields_are_returned(self):
+        response = self.client.get("/api/products/", {"fields": "id,name"})
+        self.assertEqual([set(row) for row in response.data["results"]], [{"id", "name"}] * 3)
+
+    def test_expand_keeps_nested_fields_whole(self):
+        response = self.client.get("/api/products/", {"fields": "id", "expand": "variations"})
+        row = response.data["results"][0]
+        self.assertEqual(set(row), {"id", "variations"})
+        self.assertEqual(set(row["variations"][0]), {"id", "color", "size", "price", "is_available"})
+
+    def test_trimmed_list_skips_unused_columns_and_prefetches(self):
+        with CaptureQueriesContext(connection) as trimmed:
+            self.client.get("/api/products/", {"fields": "id,name"})
+        get_catalog_cache().clear()
+        with CaptureQueriesContext(connection) as full:
+            self.client.get("/api/products/")
+        # Page + facets; the full list adds the images and variations prefetches
+        self.assertEqual(len(trimmed), 2)
+        self.assertEqual(len(full), 4)
+        self.assertNotIn('"description"', trimmed.captured_queries[0]["sql"])
+
+
+class ProductImportTests(CatalogAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.category = Category.objects.create(name="Imported")
+
+    def run_import(self, text, fmt="jsonl", chunk_size=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return import_products(io.BytesIO(text.encode()), fmt, chunk_size)
+
+    def test_bad_rows_are_reported_and_skipped(self):
+        feed = "\n".join([
+            json.dumps({"name": "Kettle", "price": "20", "category": self.category.slug,
+                        "variations": [{"color": "black", "size": "1l", "price": "22"}, {"color": "white", "size": "1l"}]}),
+            "{not json",
+            json.dumps({"name": "Toaster", "price": "-1", "category": self.category.pk}),
+            json.dumps({"name": "Blender", "price": "30", "category": "Nowhere"}),
+            json.dumps(["not", "an", "object"]),
+        ])
+        report = self.run_import(feed).as_dict()
+        self.assertEqual((report["rows"], report["created"], report["failed"]), (5, 1, 4))
+        self.assertEqual([error["row"] for error in report["errors"]], [2, 3, 5, 4])
+        self.assertEqual(report["errors"][3]["error"], "Category 'Nowhere' not found.")
+        kettle = Product.objects.get(name="Kettle")
+        self.assertEqual((kettle.min_price, kettle.max_price), (Decimal("20.00"), Decimal("22.00")))
+        self.assertEqual(kettle.variations.count(), 2)
+
+    def test_rows_the_database_would_refuse_are_rejected_alone(self):
+        def row(**fields):
+            return json.dumps({"name": "Lamp", "price": "5", "category": self.category.slug, **fields})
+
+        feed = "\n".join([
+            row(price="NaN"),
+            row(price="Infinity"),
+            row(price="1e20"),
+            row(price="1.005"),
+            row(name="x" * 256),
+            row(variations=[{"color": "c" * 65}]),
+            row(variations=[{"size": "s" * 33, "price": "sNaN"}]),
+            row(name="Desk lamp"),
+        ])
+        report = self.run_import(feed, chunk_size=100).as_dict()
+        self.assertEqual((report["created"], report["failed"]), (1, 7))
+        self.assertEqual([error["row"] for error in report["errors"]], list(range(1, 8)))
+        self.assertEqual(report["errors"][4]["error"], "name is longer than 255 characters.")
+        self.assertEqual(Product.objects.get().name, "Desk lamp")
+
+    def test_csv_rows_resolve_categories_by_name_or_id(self):
+        feed = f"name,price,category,is_available\nCup,3,{self.category.name},yes\nPlate,4,{self.category.pk},no\n"
+        report = self.run_import(feed, "csv")
+        self.assertEqual(report.created, 2)
+        self.assertFalse(Product.objects.get(name="Plate").is_available)
+
+    def test_a_failing_chunk_rolls_back_alone(self):
+        feed = "\n".join(json.dumps({"name": f"Item {i}", "price": "1", "category": self.category.slug}) for i in range(4))
+        calls = []
+
+        def allocate(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                raise DatabaseError("boom")
+            return allocate_slugs(*args, **kwargs)
+
+        with mock.patch("catalogs.importers.allocate_slugs", allocate):
+            report = self.run_import(feed, chunk_size=2)
+        self.assertEqual((report.created, report.failed), (2, 2))
+        self.assertEqual(set(Product.objects.values_list("name", flat=True)), {"Item 2", "Item 3"})
+
+    def test_upload_is_staff_only(self):
+        upload = SimpleUploadedFile("feed.jsonl", b'{"name": "Jar", "price": "2", "category": "imported"}\n')
+        self.assertEqual(self.client.post("/api/products/import/", {"file": upload}).status_code, 403)
+        self.client.force_authenticate(self.staff)
+        upload.seek(0)
+        response = self.client.post("/api/products/import/", {"file": upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["created"], 1)
+
+
+class SlugAllocationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Slugs")
+
+    def make(self, name):
+        return Product.objects.create(name=name, price=Decimal("1.00"), category=self.category)
+
+    def test_colliding_names_get_the_next_suffix(self):
+        self.assertEqual([self.make("T-Shirt").slug for _ in range(3)], ["t-shirt", "t-shirt-1", "t-shirt-2"])
+        self.make("T-Shirt 7")
+        # "t-shirt-7" came from a name, but it still counts as a suffix
+        self.assertEqual(self.make("T-Shirt").slug, "t-shirt-8")
+
+    def test_prefix_only_matches_are_not_collisions(self):
+        self.make("T-Shirt XL")
+        self.assertEqual(self.make("T-Shirt").slug, "t-shirt")
+
+    def test_batch_allocation_is_one_query(self):
+        self.make("Mug")
+        with self.assertNumQueries(1):
+            slugs = allocate_slugs(Product, ["Mug", "Mug", "Mug 2", "Bowl", "bowl"], 240)
+        self.assertEqual(slugs, ["mug-1", "mug-2", "mug-2-1", "bowl", "bowl-1"])
+
+    def test_existing_slug_is_kept_on_save(self):
+        product = self.make("Lamp")
+        product.name = "Desk Lamp"
+        product.save()
+        self.assertEqual(Product.objects.get(pk=product.pk).slug, "lamp")
+
+
+def png_upload(name="photo.png", size=(1000, 500)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, "orange").save(buffer, format="PNG")
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+
+@override_settings(PRODUCT_IMAGE_DERIVATIVES_ASYNC=False)
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        category = Category.objects.create(name="Photos")
+        self.product = Product.objects.create(name="Vase", price=Decimal("15.00"), category=category)
+
+    def upload(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ProductImage.objects.create(product=self.product, image=png_upload())
+
+    def test_renditions_are_stored_on_commit(self):
+        image = self.upload()
+        image.refresh_from_db()
+        self.assertEqual((image.width, image.height), (1000, 500))
+        self.assertEqual(image.derivatives["source"], image.image.name)
+        renditions = image.derivatives["renditions"]
+        self.assertEqual(set(renditions), {"thumb", "400w", "800w", "1000w"})
+        self.assertEqual((renditions["400w"]["width"], renditions["400w"]["height"]), (400, 200))
+        self.assertTrue(default_storage.exists(renditions["thumb"]["name"]))
+        self.assertEqual(list(srcset(image)), ["400w", "800w", "1000w"])
+
+    def test_pool_is_handed_the_storage_name_not_the_bytes(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            image = ProductImage.objects.create(product=self.product, image=png_upload())
+        executor = mock.Mock()
+        with override_settings(PRODUCT_IMAGE_DERIVATIVES_ASYNC=True), mock.patch("catalogs.images.get_executor", return_value=executor):
+            generate_derivatives(image.pk)
+        args = executor.submit.call_args.args
+        self.assertEqual(args[:2], (render_stored_derivatives, image.image.name))
+
+    def test_command_recovers_missing_and_stale_renditions(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            lost = ProductImage.objects.create(product=self.product, image=png_upload())
+        stale = self.upload()
+        done = self.upload()
+        done.refresh_from_db()
+        ProductImage.objects.filter(pk=stale.pk).update(derivatives={"source": "product_images/old.png", "renditions": {}})
+        self.assertEqual(set(pending_images().values_list("pk", flat=True)), {lost.pk, stale.pk})
+
+        with mock.patch("catalogs.images.get_executor") as get_executor:
+            call_command("generate_image_derivatives", stdout=io.StringIO())
+        # Rendered inline: no pool is started just to be shut down
+        get_executor.assert_not_called()
+        self.assertFalse(pending_images().exists())
+        self.assertEqual(ProductImage.objects.get(pk=done.pk).derivatives, done.derivatives)
+
+
+class VariationSyncTests(CatalogAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.staff)
+        category = Category.objects.create(name="Shoes")
+        self.product = Product.objects.create(name="Runner", price=Decimal("60.00"), category=category)
+        create_variations(self.product, [
+            {"color": "black", "size": "41", "price": "60"},
+            {"color": "black", "size": "42", "price": "60"},
+            {"color": "white", "size": "42", "price": "65"},
+        ])
+        self.ids = dict(((v.color, v.size), v.pk) for v in self.product.variations.all())
+
+    def test_update_keeps_ids_of_matching_variations(self):
+        response = self.client.patch(f"/api/products/{self.product.pk}/", {"variations": [
+            {"color": "black", "size": "41", "price": "55"},
+            {"color": "black", "size": "42", "price": "60"},
+            {"color": "red", "size": "42", "price": "70"},
+        ]}, format="json")
+        self.assertEqual(response.status_code, 200, response.data)
+        rows = {(v["color"], v["size"]): v for v in response.data["variations"]}
+        self.assertEqual(set(rows), {("black", "41"), ("black", "42"), ("red", "42")})
+        self.assertEqual(rows["black", "41"]["id"], self.ids["black", "41"])
+        self.assertEqual(rows["black", "41"]["price"], "55.00")
+        self.assertEqual(rows["black", "42"]["id"], self.ids["black", "42"])
+        self.assertFalse(ProductVariation.objects.filter(pk=self.ids["white", "42"]).exists())
+        self.assertEqual((response.data["min_price"], response.data["max_price"]), ("55.00", "70.00"))
+
+    def test_unchanged_payload_writes_nothing(self):
+        payload = [{"color": c, "size": s, "price": p} for c, s, p in [("black", "41", "60"), ("black", "42", "60"), ("white", "42", "65")]]
+        product = Product.objects.get(pk=self.product.pk)
+        with self.assertNumQueries(1):
+            sync_variations(product, payload)
+        self.assertEqual(set(self.product.variations.values_list("pk", flat=True)), set(self.ids.values()))
+
+    def test_query_count_does_not_grow_with_changes(self):
+        def sync(removed):
+            # Starts from 21 variations; removes `removed` of them, updates the rest and adds one
+            ProductVariation.objects.filter(product=self.product).delete()
+            create_variations(self.product, [{"color": "black", "size": str(size), "price": "60"} for size in range(21)])
+            payload = [{"color": "black", "size": str(size), "price": "61"} for size in range(removed, 21)]
+            payload.append({"color": "white", "size": "50", "price": "70"})
+            product = Product.objects.get(pk=self.product.pk)
+            with CaptureQueriesContext(connection) as queries:
+                sync_variations(product, payload)
+            self.assertEqual(self.product.variations.count(), 22 - removed)
+            return len(queries)
+
+        counts = {removed: sync(removed) for removed in (1, 20)}
+        self.assertEqual(counts[1], counts[20])
+
+
+class ConditionalGetTests(CatalogAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.category = Category.objects.create(name="Validated")
+        cls.product = Product.objects.create(name="Teapot", price=Decimal("25.00"), category=cls.category)
+
+    def test_matching_etag_is_not_modified(self):
+        url = f"/api/products/{self.product.pk}/"
+        first = self.client.get(url)
+        self.assertIn("Last-Modified", first)
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], first["ETag"])
+
+    def test_edit_changes_the_etag(self):
+        url = f"/api/products/{self.product.pk}/"
+        etag = self.client.get(url)["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = Decimal("30.00")
+            self.product.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_query_string_is_part_of_the_etag(self):
+        full = self.client.get("/api/products/")["ETag"]
+        trimmed = self.client.get("/api/products/", {"fields": "id"})["ETag"]
+        self.assertNotEqual(full, trimmed)
+
+    def test_category_etag_follows_product_writes(self):
+        url = f"/api/category/{self.category.pk}/"
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name="Cup", price=Decimal("5.00"), category=self.category)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["product_count"], 2)
+
+    def test_missing_or_malformed_ids_are_not_found(self):
+        for url in ["/api/products/999999/", "/api/products/abc/", "/api/category/abc/"]:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class ProductExportTests(CatalogAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        category = Category.objects.create(name="Exported")
+        for i in range(3):
+            product = Product.objects.create(name=f"Export {i}", price=Decimal("3.00"), category=category)
+            ProductVariation.objects.create(product=product, color="grey", size=str(i))
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.staff)
+
+    def test_gzip_is_streamed_when_accepted(self):
+        response = self.client.get("/api/products/export/", {"as": "jsonl"}, HTTP_ACCEPT_ENCODING="br, gzip")
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        rows = [json.loads(line) for line in gzip.decompress(b"".join(response.streaming_content)).splitlines()]
+        self.assertEqual([row["name"] for row in rows], ["Export 0", "Export 1", "Export 2"])
+        self.assertEqual(rows[0]["variations"][0]["color"], "grey")
+
+    def test_gzip_refused_with_zero_quality_is_not_used(self):
+        for header in ("gzip;q=0", "br, gzip; q=0.0, *", "*;q=0", "identity"):
+            response = self.client.get("/api/products/export/", {"as": "jsonl"}, HTTP_ACCEPT_ENCODING=header)
+            self.assertFalse(response.has_header("Content-Encoding"), header)
+            self.assertIn(b"Export 0", b"".join(response.streaming_content))
+        response = self.client.get("/api/products/export/", {"as": "jsonl"}, HTTP_ACCEPT_ENCODING="identity, *;q=0.5")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+
+    def test_plain_csv_round_trips_through_the_importer(self):
+        response = self.client.get("/api/products/export/", {"as": "csv"})
+        self.assertFalse(response.has_header("Content-Encoding"))
+        body = b"".join(response.streaming_content)
+        with self.captureOnCommitCallbacks(execute=True):
+            report = import_products(io.BytesIO(body), "csv")
+        self.assertEqual((report.created, report.failed), (3, 0))
+        self.assertEqual(Product.objects.filter(name="Export 1").count(), 2)
+
+    def test_export_is_staff_only(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get("/api/products/export/").status_code, 403)
+
+
+class CatalogChangeFeedTests(CatalogAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.category = Category.objects.create(name="Synced")
+
+    def changes(self, token):
+        response = self.client.get("/api/catalog/changes/", {"since": token})
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    @contextmanager
+    def snapshot_xmin(self, xmin):
+        # Drives the PostgreSQL visibility filter on the test database with a fixed horizon
+        with mock.patch.object(connection, "vendor", "postgresql"), \
+                mock.patch.object(SnapshotXmin, "as_sql", return_value=(str(xmin), [])):
+            yield
+
+    def test_client_catches_up_from_the_head_token(self):
+        head = self.client.get("/api/catalog/changes/").data
+        self.assertTrue(head["reset"])
+        product = Product.objects.create(name="Synced lamp", price=Decimal("12.00"), category=self.category)
+        page = self.changes(head["next"])
+        self.assertEqual([row["id"] for row in page["changes"]["products"]], [product.pk])
+
+        pk = product.pk
+        product.delete()
+        page = self.changes(page["next"])
+        self.assertEqual(page["deleted"], {"products": [pk]})
+        self.assertEqual(self.changes(page["next"])["changes"], {})
+
+    def test_queryset_deletes_are_logged_with_one_insert(self):
+        products = [Product.objects.create(name=f"Bulk {i}", price=Decimal("1.00"), category=self.category) for i in range(5)]
+        create_variations(products[0], [{"color": "red"}, {"color": "blue"}])
+        variation_ids = set(products[0].variations.values_list("pk", flat=True))
+        pks = {product.pk for product in products}
+        start = CatalogChange.objects.order_by("-id").values_list("id", flat=True).first()
+        with CaptureQueriesContext(connection) as queries:
+            Product.objects.filter(pk__in=pks).delete()
+        inserts = [q["sql"] for q in queries if q["sql"].startswith('INSERT INTO "catalogs_catalogchange"')]
+        # The products in one insert; the variations they cascade to are still logged
+        self.assertEqual(len(inserts), 3)
+        deleted = CatalogChange.objects.filter(id__gt=start, action=CatalogChange.DELETE)
+        self.assertEqual(set(deleted.filter(kind="product").values_list("object_id", flat=True)), pks)
+        self.assertEqual(set(deleted.filter(kind="productvariation").values_list("object_id", flat=True)), variation_ids)
+
+    def test_pages_follow_transaction_order(self):
+        start = encode_token((0, CatalogChange.objects.order_by("-id").values_list("id", flat=True).first() or 0))
+        late = CatalogChange.objects.create(kind="category", object_id=self.category.pk, txid=900)
+        early = CatalogChange.objects.create(kind="category", object_id=self.category.pk, txid=800)
+        latest, checkpoint, has_more = read_changes(decode_token(start), limit=1)
+        self.assertEqual((checkpoint, has_more), ((800, early.pk), True))
+        latest, checkpoint, has_more = read_changes(checkpoint, limit=1)
+        self.assertEqual((checkpoint, has_more), ((900, late.pk), False))
+
+    def test_rows_of_running_transactions_hold_back_the_checkpoint(self):
+        since = (1000, 0)
+        # A long transaction (txid 1001) wrote the lower id; a short one (1002) committed after it
+        long_running = CatalogChange.objects.create(kind="product", object_id=1, txid=1001)
+        short = CatalogChange.objects.create(kind="product", object_id=2, txid=1002)
+        with self.snapshot_xmin(1001):
+            self.assertEqual(read_changes(since), ({}, since, False))
+        with self.snapshot_xmin(1003):
+            latest, checkpoint, _ = read_changes(since)
+        self.assertEqual(list(latest), [("product", 1), ("product", 2)])
+        self.assertEqual(checkpoint, (1002, short.pk))
+        self.assertLess(long_running.pk, short.pk)
+
+    def test_bad_and_legacy_tokens(self):
+        legacy = base64.urlsafe_b64encode(f"5:{int(time.time())}".encode()).decode()
+        response = self.client.get("/api/catalog/changes/", {"since": legacy})
+        self.assertEqual((response.status_code, response.data["reset"]), (410, True))
+        self.assertEqual(self.client.get("/api/catalog/changes/", {"since": "garbage"}).status_code, 400)
+
+
+class PriceRangeTests(CatalogAPITestCase):
+    def setUp(self):
+        super().setUp()
+        category = Category.objects.create(name="Priced")
+        self.product = Product.objects.create(name="Jacket", price=Decimal("100.00"), category=category)
+
+    def price_range(self):
+        product = Product.objects.get(pk=self.product.pk)
+        return product.min_price, product.max_price, product.in_stock_variation_count
+
+    def test_new_product_ranges_over_its_price(self):
+        self.assertEqual(self.price_range(), (Decimal("100.00"), Decimal("100.00"), 0))
+
+    def test_range_follows_available_variations(self):
+        small = ProductVariation.objects.create(product=self.product, size="S", price=Decimal("80.00"))
+        ProductVariation.objects.create(product=self.product, size="M")
+        ProductVariation.objects.create(product=self.product, size="L", price=Decimal("130.00"), is_available=False)
+        # M has no override, so it sells at the product price; L is out of stock
+        self.assertEqual(self.price_range(), (Decimal("80.00"), Decimal("100.00"), 2))
+
+        small.delete()
+        self.product.price = Decimal("90.00")
+        self.product.save()
+        self.assertEqual(self.price_range(), (Decimal("90.00"), Decimal("90.00"), 1))
+
+    def test_price_filters_match_overlapping_ranges(self):
+        ProductVariation.objects.create(product=self.product, size="S", price=Decimal("80.00"))
+        ProductVariation.objects.create(product=self.product, size="XL", price=Decimal("150.00"))
+        for params, found in [({"min_price": "140"}, True), ({"max_price": "85"}, True), ({"min_price": "151"}, False)]:
+            with self.subTest(params=params):
+                ids = [row["id"] for row in self.client.get("/api/products/", params).data["results"]]
+                self.assertEqual(ids == [self.product.pk], found)
+
+
+class CategoryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = Category.objects.create(name="Books")
+        cls.games = Category.objects.create(name="Games")
+
+    def counts(self, category):
+        counts = CategoryProductCount.objects.get(category=category)
+        return counts.product_count, counts.available_count
+
+    def make(self, category, available=True):
+        return Product.objects.create(name="Counted", price=Decimal("8.00"), category=category, is_available=available)
+
+    def test_writes_move_the_counts(self):
+        product = self.make(self.books)
+        self.make(self.books, available=False)
+        self.assertEqual(self.counts(self.books), (2, 1))
+
+        product.category = self.games
+        product.is_available = False
+        product.save()
+        self.assertEqual((self.counts(self.books), self.counts(self.games)), ((1, 0), (1, 0)))
+
+        product.delete()
+        self.assertEqual(self.counts(self.games), (0, 0))
+
+    def test_partially_loaded_products_still_move_the_counts(self):
+        pk = self.make(self.books).pk
+        product = Product.objects.only("id", "name").get(pk=pk)
+        product.category = self.games
+        product.save()
+        self.assertEqual((self.counts(self.books), self.counts(self.games)), ((0, 0), (1, 1)))
+
+        product = Product.objects.only("id", "name").get(pk=pk)
+        product.name = "Renamed"
+        product.save(update_fields=["name"])
+        self.assertEqual(self.counts(self.games), (1, 1))
+
+        Product.objects.only("id").get(pk=pk).delete()
+        self.assertEqual(self.counts(self.games), (0, 0))
+
+    def test_reconcile_fixes_drift(self):
+        self.make(self.books)
+        CategoryProductCount.objects.filter(category=self.books).update(product_count=7)
+        CategoryProductCount.objects.filter(category=self.games).delete()
+        self.assertEqual(reconcile_category_counts(), (1, 1))
+        self.assertEqual((self.counts(self.books), self.counts(self.games)), ((1, 1), (0, 0)))
+
+
+# A second alias mirroring the test database, registered before the runner sets databases up,
+# so replica routing runs against two real connections without a replica server
+REPLICA = "replica_test"
+connections.settings.setdefault(REPLICA, {
+    **connections.settings[DEFAULT_DB_ALIAS],
+    "TEST": {**connections.settings[DEFAULT_DB_ALIAS]["TEST"], "MIRROR": DEFAULT_DB_ALIAS},
+})
+
+
+@override_settings(DATABASE_REPLICAS=[REPLICA])
+class ReplicaRoutingTests(TransactionTestCase):
+    databases = {DEFAULT_DB_ALIAS, REPLICA}
+
+    def setUp(self):
+        cache.clear()
+        get_catalog_cache().clear()
+        self.addCleanup(db_router._unavailable.clear)
+        self.user = get_user_model().objects.create_user(email="reader@example.com", phone_number="5551002", password="pw")
+        self.product = Product.objects.create(name="Replicated", price=Decimal("4.00"), category=Category.objects.create(name="Replicas"))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.token = encode_token((0, 0))
+
+    def get(self, url, params=None):
+        with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as primary, CaptureQueriesContext(connections[REPLICA]) as replica:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response, len(primary), len(replica)
+
+    def test_safe_reads_use_the_replica(self):
+        _, primary, replica = self.get("/api/catalog/changes/", {"since": self.token})
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_writes_use_the_primary(self):
+        with read_from(REPLICA):
+            self.assertEqual(router.db_for_write(Product), DEFAULT_DB_ALIAS)
+            self.assertEqual(router.db_for_read(Product), REPLICA)
+
+    def test_recent_writers_read_from_the_primary(self):
+        mark_sticky(self.user)
+        _, primary, replica = self.get("/api/catalog/changes/", {"since": self.token})
+        self.assertEqual(replica, 0)
+        self.assertGreater(primary, 0)
+
+    def test_unreachable_replica_falls_back_to_the_primary(self):
+        with mock.patch.object(connections[REPLICA], "ensure_connection", side_effect=OperationalError("down")), \
+                CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as primary, self.assertLogs("E_Commerce.db_router", "WARNING"):
+            response = self.client.get("/api/catalog/changes/", {"since": self.token})
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(len(primary), 0)
+        self.assertIn(REPLICA, db_router._unavailable)
+
+    def test_replica_failing_mid_request_is_retried_on_the_primary(self):
+        def fail(execute, sql, params, many, context):
+            raise OperationalError("connection lost")
+
+        with mock.patch("E_Commerce.db_router.choose_replica", wraps=db_router.choose_replica) as choose, \
+                connections[REPLICA].execute_wrapper(fail), self.assertLogs("E_Commerce.db_router", "WARNING"):
+            response, primary, _ = self.get("/api/catalog/changes/", {"since": self.token})
+        self.assertEqual(choose.call_count, 1)
+        self.assertGreater(primary, 0)
+        self.assertEqual(response.data["changes"]["products"][0]["id"], self.product.pk)
+
+    def test_cached_catalog_misses_render_from_a_caught_up_replica(self):
+        for url in ["/api/products/", f"/api/products/{self.product.pk}/", "/api/category/"]:
+            with self.subTest(url=url):
+                response, primary, replica = self.get(url)
+                self.assertEqual(response["X-Cache"], "MISS")
+                self.assertEqual(primary, 0)
+                self.assertGreater(replica, 0)
+
+    def test_lagging_replica_leaves_catalog_reads_to_the_primary(self):
+        with mock.patch("catalogs.cache.has_replayed", return_value=False):
+            for url in ["/api/products/", f"/api/products/{self.product.pk}/", "/api/category/"]:
+                with self.subTest(url=url):
+                    response, primary, replica = self.get(url)
+                    self.assertEqual(response["X-Cache"], "MISS")
+                    self.assertGreater(primary, 0)
+                    self.assertEqual(replica, 0)
+
+    def test_primary_position_is_read_once_per_version(self):
+        with mock.patch("catalogs.cache.wal_position", return_value="0/16B3748") as position, \
+                mock.patch("catalogs.cache.has_replayed", return_value=True) as replayed:
+            self.get("/api/products/")
+            self.get("/api/category/")
+            self.product.save()
+            self.get("/api/products/")
+        self.assertEqual(position.call_count, 2)
+        replayed.assert_called_with(REPLICA, "0/16B3748")
+
+    def test_cache_hits_connect_to_no_replica(self):
+        self.get("/api/products/")
+        with mock.patch("E_Commerce.db_router.choose_replica") as choose:
+            response, primary, replica = self.get("/api/products/")
+        self.assertEqual(response["X-Cache"], "HIT")
+        choose.assert_not_called()
+        self.assertEqual((primary, replica), (0, 0))
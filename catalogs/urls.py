@@ -1,11 +1,12 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CategoryViewSet, ProductViewSet
+from .views import CatalogChangesView, CategoryViewSet, ProductViewSet
 
 router = DefaultRouter()
 router.register(r"category", CategoryViewSet, basename="category")
 router.register(r"products", ProductViewSet, basename="products")
 
 urlpatterns = [
+    path("catalog/changes/", CatalogChangesView.as_view(), name="catalog-changes"),
     path("", include(router.urls)),
 ]
@@ -0,0 +1,70 @@
+from decimal import Decimal
+
+from .cache import bump_catalog_version_on_commit
+from .models import CatalogChange, Product, ProductVariation
+
+UPDATABLE_FIELDS = ["price", "is_available"]
+
+
+def variation_fields(data):
+    price = data.get("price")
+    return {
+        "color": data.get("color"),
+        "size": data.get("size"),
+        "price": Decimal(str(price)) if price not in (None, "") else None,
+        "is_available": data.get("is_available", True),
+    }
+
+def create_variations(product, variations_data):
+    variations = [ProductVariation(product=product, **variation_fields(v)) for v in variations_data]
+    if variations:
+        ProductVariation.objects.bulk_create(variations)
+        CatalogChange.record(ProductVariation, [v.pk for v in variations])
+        Product.refresh_price_range(product.pk)
+        bump_catalog_version_on_commit()
+    return variations
+
+
+def sync_variations(product, variations_data):
+    """
+    Brings product.variations in line with `variations_data`, matching rows on (color, size).
+    Changed rows are bulk updated in place, so their ids (and the cart/order rows pointing
+    at them) survive; new keys are bulk created and missing keys deleted.
+    Costs a fixed number of queries however many variations change.
+    """
+    existing, duplicates = {}, []
+    for variation in product.variations.all():
+        key = (variation.color, variation.size)
+        if key in existing:
+            duplicates.append(variation.pk)
+        else:
+            existing[key] = variation
+
+    to_create, to_update, seen = [], [], set()
+    for data in variations_data:
+        fields = variation_fields(data)
+        key = (fields["color"], fields["size"])
+        seen.add(key)
+        current = existing.get(key)
+        if current is None:
+            to_create.append(ProductVariation(product=product, **fields))
+        elif any(getattr(current, name) != fields[name] for name in UPDATABLE_FIELDS):
+            for name in UPDATABLE_FIELDS:
+                setattr(current, name, fields[name])
+            to_update.append(current)
+
+    removed = duplicates + [v.pk for key, v in existing.items() if key not in seen]
+    if removed:
+        ProductVariation.objects.filter(pk__in=removed).delete()
+    if to_update:
+        ProductVariation.objects.bulk_update(to_update, UPDATABLE_FIELDS)
+    if to_create:
+        ProductVariation.objects.bulk_create(to_create)
+    if to_update or to_create:
+        CatalogChange.record(ProductVariation, [v.pk for v in to_update + to_create])
+    if removed or to_update or to_create:
+        Product.touch(product.pk)
+        Product.refresh_price_range(product.pk)
+        bump_catalog_version_on_commit()
+        # Drop a prefetched variations cache so the product serializes its new rows
+        getattr(product, "_prefetched_objects_cache", {}).pop("variations", None)
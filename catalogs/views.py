@@ -1,14 +1,85 @@
 from rest_framework import viewsets, status
+from rest_framework.views import APIView
 from rest_framework.response import Response
-from .models import Category, Product, ProductImage
-from .serializers import CategorySerializer, ProductSerializer, ProductCreateUpdateSerializer, ProductImageSerializer
-from rest_framework.permissions import IsAuthenticated
+from .models import CatalogChange, Category, Product, ProductImage, ProductVariation
+from .serializers import CategorySerializer, ProductSerializer, ProductCompactSerializer, ProductCreateUpdateSerializer, ProductImageSerializer
+from .serializers import ProductImageChangeSerializer, ProductVariationChangeSerializer
+from .changes import ExpiredToken, InvalidToken, decode_token, encode_token, head_token, read_changes
+from .pagination import ProductCursorPagination, ProductSearchPagination
+from .search import search_products
+from .filters import parse_product_filters, apply_product_filters, facet_counts
+from .fieldsets import plan_queryset
+from .importers import FORMATS, detect_format, import_products
+from .exporters import CONTENT_TYPES, iter_export
+from .cache import cached_catalog_response, catalog_read_alias, get_cache_stats, get_catalog_changed_at, get_catalog_version
+from .conditional import conditional_get
+from rest_framework.permissions import IsAuthenticated, SAFE_METHODS
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.decorators import action
 from django.shortcuts import get_object_or_404
+from django.db import router
+from E_Commerce.db_router import ReplicaReadMixin, read_from
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.db.models import Count, Max
+from django.core.exceptions import ValidationError
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+def accepts_gzip(accept_encoding):
+    """
+    Whether an Accept-Encoding header allows gzip: listed, or covered by "*", with a q-value
+    above zero. An explicit "gzip;q=0" refuses it whatever "*" says.
+    """
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, *params = (part.strip() for part in item.split(";"))
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[coding.lower()] = q
+    for coding in ("gzip", "x-gzip", "*"):
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+
+def detail_validators(view, request, *args, **kwargs):
+    # One indexed pk lookup; a missing row or malformed pk falls through to the view's 404.
+    # Read from where the cached body renders (see cached_catalog_response), so both agree.
+    lookup = kwargs.get(view.lookup_url_kwarg or view.lookup_field)
+    try:
+        with read_from(catalog_read_alias(get_catalog_version())):
+            row = view.queryset.model.objects.filter(pk=lookup).values_list("pk", "updated_at").first()
+    except (TypeError, ValueError, ValidationError):
+        return None
+    if row is None:
+        return None
+    return row, row[1]
+
+def category_detail_validators(view, request, *args, **kwargs):
+    # Product counts move with product writes, which bump the catalog version
+    validators = detail_validators(view, request, *args, **kwargs)
+    if validators is None:
+        return None
+    parts, changed = validators
+    return (*parts, get_catalog_version()), changed
+
+def category_list_validators(view, request, *args, **kwargs):
+    with read_from(catalog_read_alias(get_catalog_version())):
+        stats = Category.objects.aggregate(changed=Max("updated_at"), count=Count("id"))
+    return (stats["changed"], stats["count"], get_catalog_version()), stats["changed"]
+
+def catalog_validators(view, request, *args, **kwargs):
+    # Filtered lists and search results can change with any catalog write, same as the response cache
+    return (get_catalog_version(),), get_catalog_changed_at()
+
+
+class CategoryViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticated]
@@ -16,6 +87,22 @@ class CategoryViewSet(viewsets.ModelViewSet):
     def get_permissions(self):
         return super().get_permissions()
 
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if self.request.method in SAFE_METHODS:
+            qs = plan_queryset(qs, CategorySerializer(context=self.get_serializer_context()))
+        return qs
+
+    @conditional_get(category_list_validators)
+    @cached_catalog_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get(category_detail_validators)
+    @cached_catalog_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     def create(self, request, *args, **kwargs):
         if not request.user.is_staff:
             return Response({"detail": "Admin privileges required."}, status=status.HTTP_403_FORBIDDEN)
@@ -42,32 +129,41 @@ class CategoryViewSet(viewsets.ModelViewSet):
             status=status.HTTP_200_OK
         )
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Product.objects.prefetch_related("images", "variations").all()
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser, JSONParser]
+    pagination_class = ProductCursorPagination
+
+    def get_queryset(self):
+        if self.request.method not in SAFE_METHODS:
+            return super().get_queryset()
+        # Load only what the (possibly ?fields= trimmed) read serializer uses
+        serializer_class = ProductCompactSerializer if self.action == "search" else ProductSerializer
+        serializer = serializer_class(context=self.get_serializer_context())
+        return plan_queryset(Product.objects.all(), serializer, always=("created_at", "min_price"))
 
     def get_serializer_class(self):
         if self.request.method in ["POST", "PUT", "PATCH"]:
             return ProductCreateUpdateSerializer
         return ProductSerializer
     
+    @conditional_get(catalog_validators)
+    @cached_catalog_response
     def list(self, request, *args, **kwargs):
-        qs = self.get_queryset()
-        category_q = request.query_params.get("category")
-        if category_q:
-            # try id first
-            if category_q.isdigit():
-                qs = qs.filter(category__id=int(category_q))
-            else:
-                qs = qs.filter(category__slug=category_q)
+        filters = parse_product_filters(request.query_params)
+        qs = apply_product_filters(self.get_queryset(), filters)
         page = self.paginate_queryset(qs)
         if page is not None:
             serializer = ProductSerializer(page, many=True, context={"request": request})
-            return self.get_paginated_response(serializer.data)
+            response = self.get_paginated_response(serializer.data)
+            response.data["facets"] = facet_counts(filters)
+            return response
         serializer = ProductSerializer(qs, many=True, context={"request": request})
         return Response(serializer.data)
     
+    @conditional_get(detail_validators)
+    @cached_catalog_response
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
         serializer = ProductSerializer(instance, context={"request": request})
@@ -130,3 +226,106 @@ class ProductViewSet(viewsets.ModelViewSet):
         img = get_object_or_404(ProductImage, pk=img_id, product=product)
         img.delete()
         return Response({"detail": "Image deleted."}, status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, methods=["get"], url_path="search", permission_classes=[IsAuthenticated])
+    @conditional_get(catalog_validators)
+    @cached_catalog_response
+    def search(self, request):
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            return Response({"detail": "Provide a search query with ?q=."}, status=status.HTTP_400_BAD_REQUEST)
+        qs = search_products(self.get_queryset(), query)
+        paginator = ProductSearchPagination()
+        page = paginator.paginate_queryset(qs, request, view=self)
+        serializer = ProductCompactSerializer(page, many=True, context={"request": request})
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=["post"], url_path="import", parser_classes=[MultiPartParser], permission_classes=[IsAuthenticated])
+    def import_feed(self, request):
+        if not request.user.is_staff:
+            return Response({"detail": "Admin privileges required."}, status=status.HTTP_403_FORBIDDEN)
+        upload = request.FILES.get("file")
+        if not upload:
+            return Response({"detail": "Upload a CSV or JSONL file as 'file'."}, status=status.HTTP_400_BAD_REQUEST)
+        fmt = request.data.get("format") or detect_format(upload.name)
+        if fmt not in FORMATS:
+            return Response({"detail": f"format must be one of {list(FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
+        chunk_size = request.data.get("chunk_size")
+        if chunk_size and not str(chunk_size).isdigit():
+            return Response({"detail": "chunk_size must be a positive integer."}, status=status.HTTP_400_BAD_REQUEST)
+        report = import_products(upload.file, fmt, int(chunk_size) if chunk_size else None)
+        return Response(report.as_dict(), status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=["get"], url_path="export", permission_classes=[IsAuthenticated])
+    def export(self, request):
+        # ?as= rather than ?format=, which DRF reserves for renderer selection
+        if not request.user.is_staff:
+            return Response({"detail": "Admin privileges required."}, status=status.HTTP_403_FORBIDDEN)
+        fmt = request.query_params.get("as", "jsonl")
+        if fmt not in FORMATS:
+            return Response({"detail": f"as must be one of {list(FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
+        compress = accepts_gzip(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        # The body streams after the view returns, so pin the read alias chosen for this request
+        rows = iter_export(fmt, request=request, compress=compress, using=router.db_for_read(Product))
+        response = StreamingHttpResponse(rows, content_type=CONTENT_TYPES[fmt])
+        response["Content-Disposition"] = f'attachment; filename="products.{fmt}"'
+        if compress:
+            response["Content-Encoding"] = "gzip"
+        patch_vary_headers(response, ("Accept-Encoding",))
+        return response
+
+    @action(detail=False, methods=["get"], url_path="cache-stats", permission_classes=[IsAuthenticated])
+    def cache_stats(self, request):
+        if not request.user.is_staff:
+            return Response({"detail": "Admin privileges required."}, status=status.HTTP_403_FORBIDDEN)
+        return Response(get_cache_stats())
+
+
+class CatalogChangesView(ReplicaReadMixin, APIView):
+    """
+    Delta sync: GET /api/catalog/changes/?since=<token> returns the rows changed after the
+    checkpoint (current state, not history) plus deleted ids, and the token to send next.
+    Without `since` it only returns the current head token, to pair with a full export.
+    """
+    permission_classes = [IsAuthenticated]
+    # change log kind -> response key, model, serializer
+    KINDS = {
+        "category": ("categories", Category, CategorySerializer),
+        "product": ("products", Product, ProductSerializer),
+        "productimage": ("images", ProductImage, ProductImageChangeSerializer),
+        "productvariation": ("variations", ProductVariation, ProductVariationChangeSerializer),
+    }
+
+    def get(self, request):
+        since = request.query_params.get("since")
+        if not since:
+            return Response({"reset": True, "next": head_token(), "has_more": False, "changes": {}, "deleted": {}})
+        try:
+            checkpoint = decode_token(since)
+        except ExpiredToken as e:
+            return Response({"detail": str(e), "reset": True}, status=status.HTTP_410_GONE)
+        except InvalidToken as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        latest, checkpoint, has_more = read_changes(checkpoint)
+        upserts, deleted = {}, {}
+        for (kind, object_id), action in latest.items():
+            if kind not in self.KINDS:
+                continue
+            target = upserts if action == CatalogChange.UPSERT else deleted
+            target.setdefault(kind, []).append(object_id)
+
+        context = {"request": request}
+        changes = {}
+        for kind, ids in upserts.items():
+            key, model, serializer_class = self.KINDS[kind]
+            qs = plan_queryset(model.objects.filter(pk__in=ids), serializer_class(context=context))
+            rows = serializer_class(qs, many=True, context=context).data
+            changes[key] = rows
+            # Rows deleted after this page's last change show up as deletions on a later page
+            found = {row["id"] for row in rows}
+            gone = [pk for pk in ids if pk not in found]
+            if gone:
+                deleted.setdefault(kind, []).extend(gone)
+        deleted = {self.KINDS[kind][0]: sorted(ids) for kind, ids in deleted.items()}
+        return Response({"reset": False, "next": encode_token(checkpoint), "has_more": has_more, "changes": changes, "deleted": deleted})
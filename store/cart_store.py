@@ -0,0 +1,326 @@
+"""
+Cart storage backends, selected with settings.CART_STORE_BACKEND.
+
+"database" writes every cart change straight to Cart/CartItem.
+"cache" keeps each working cart in the Django cache and flushes quantity changes and
+removals to the database in batches: on a timer, before the cart is read for display,
+at checkout and at interpreter shutdown. Lines are still inserted immediately, so cart
+item ids seen by clients are always real database ids. A cache miss rebuilds the cart
+from the database. On cache backends that evict entries by themselves, changes are
+written through instead, since evicted dirty state would be lost.
+"""
+import atexit
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.memcached import BaseMemcachedCache
+from django.db import IntegrityError, connections, transaction
+
+from .models import Cart, CartItem
+
+logger = logging.getLogger(__name__)
+
+# Cull entries on their own when full, so dirty cart state held there could vanish unflushed
+EVICTING_CACHES = (LocMemCache, FileBasedCache, DatabaseCache, BaseMemcachedCache, DummyCache)
+
+
+class CartLockTimeout(Exception):
+    pass
+
+
+class DatabaseCartStore:
+    def get_cart(self, user):
+        cart, _ = Cart.objects.get_or_create(user=user)
+        return cart
+
+    def _add_line(self, user, cart_id, product_id, variation_id, qty, price):
+        """
+        Upserts a line into cart `cart_id` and returns (cart id, line id, new qty).
+        If expire_carts deleted the cart after it was read, the insert fails its cart foreign
+        key (checked as the autocommit statement ends) and the line goes into a fresh cart.
+        """
+        try:
+            return (cart_id, *CartItem.objects.add_qty(cart_id, product_id, variation_id, qty, price))
+        except IntegrityError:
+            if Cart.objects.filter(pk=cart_id).exists():
+                raise
+        cart, _ = Cart.objects.get_or_create(user=user)
+        return (cart.pk, *CartItem.objects.add_qty(cart.pk, product_id, variation_id, qty, price))
+
+    def add(self, user, product, variation, qty, price):
+        cart_id, _, _ = self._add_line(user, self.get_cart(user).pk, product.pk, variation.pk if variation else None, qty, price)
+        Cart.touch(cart_id)
+
+    def remove_item(self, user, item_id):
+        """Removes one line by id; returns False if the cart has no such line."""
+        cart = self.get_cart(user)
+        try:
+            CartItem.objects.get(pk=item_id, cart=cart).delete()
+        except CartItem.DoesNotExist:
+            return False
+        Cart.touch(cart.pk)
+        return True
+
+    def remove_product(self, user, product_id, variation_id=None):
+        """Removes the product's lines (one variation's if given); returns how many."""
+        cart = self.get_cart(user)
+        qs = CartItem.objects.filter(cart=cart, product_id=product_id)
+        if variation_id is not None:
+            qs = qs.filter(variation_id=variation_id)
+        deleted, _ = qs.delete()
+        if deleted:
+            Cart.touch(cart.pk)
+        return deleted
+
+    def clear(self, user):
+        cart = self.get_cart(user)
+        cart.items.all().delete()
+        Cart.touch(cart.pk)
+
+    def flush(self, user):
+        """Persists pending changes for the user's cart. Nothing is ever pending here."""
+
+    def flush_users(self, user_ids):
+        """flush() for many users at once, e.g. before their carts are checked for expiry."""
+
+    @contextmanager
+    def changing(self, user):
+        """Wraps changes made to the user's cart directly in the database, bypassing the store."""
+        yield
+
+    def forget(self, user):
+        """Drops any cached state, writing pending changes first."""
+
+    def forget_users(self, user_ids):
+        """forget() for many users at once, e.g. after their carts were expired."""
+
+
+class CachedCartStore(DatabaseCartStore):
+    """
+    Cached state per user: {"cart_id", "lines": {item_id: {product_id, variation_id, qty}},
+    "changed": [item ids whose qty moved], "removed": [item ids], "dirty": bool}.
+    Changes to one cart are serialized with a short cache lock.
+    """
+    def __init__(self):
+        self.cache = caches[settings.CART_STORE_CACHE_ALIAS]
+        self.write_behind = not isinstance(self.cache, EVICTING_CACHES)
+        if not self.write_behind:
+            logger.warning("Cart cache %r may evict entries; writing cart changes through", settings.CART_STORE_CACHE_ALIAS)
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+        self._timer = None
+        atexit.register(self.flush_all)
+
+    def _key(self, user_id):
+        return f"cart:state:{user_id}"
+
+    @contextmanager
+    def _locked(self, user_id):
+        key = f"cart:lock:{user_id}"
+        for _ in range(settings.CART_STORE_LOCK_ATTEMPTS):
+            if self.cache.add(key, 1, timeout=settings.CART_STORE_LOCK_TIMEOUT):
+                break
+            time.sleep(0.01)
+        else:
+            raise CartLockTimeout(f"Cart of user {user_id} is locked.")
+        try:
+            yield
+        finally:
+            self.cache.delete(key)
+
+    def _load(self, user):
+        state = self.cache.get(self._key(user.pk))
+        if state is None:
+            cart = super().get_cart(user)
+            lines = CartItem.objects.filter(cart=cart).values_list("id", "product_id", "variation_id", "qty")
+            state = {
+                "cart_id": cart.pk,
+                "lines": {pk: {"product_id": p, "variation_id": v, "qty": q} for pk, p, v, q in lines},
+                "changed": [],
+                "removed": [],
+                "dirty": False,
+            }
+        return state
+
+    def _save(self, user_id, state):
+        # Caller holds the cart lock
+        if state["dirty"] and not self.write_behind:
+            self._write_back(state)
+        self.cache.set(self._key(user_id), state, settings.CART_STORE_TIMEOUT)
+        if state["dirty"]:
+            with self._dirty_lock:
+                self._dirty.add(user_id)
+            self._schedule()
+
+    def _remove_lines(self, state, item_ids):
+        for pk in item_ids:
+            del state["lines"][pk]
+            state["removed"].append(pk)
+            if pk in state["changed"]:
+                state["changed"].remove(pk)
+        state["dirty"] = state["dirty"] or bool(item_ids)
+
+    def add(self, user, product, variation, qty, price):
+        variation_id = variation.pk if variation else None
+        with self._locked(user.pk):
+            state = self._load(user)
+            item_id = next((pk for pk, line in state["lines"].items()
+                            if line["product_id"] == product.pk and line["variation_id"] == variation_id), None)
+            if item_id is None:
+                if state["removed"]:
+                    # A removed line may still be in the table, and the upsert must not add to it
+                    self._write_back(state)
+                # New lines are written through so their ids are real
+                cart_id, item_id, total = self._add_line(user, state["cart_id"], product.pk, variation_id, qty, price)
+                if cart_id != state["cart_id"]:
+                    # The cached cart was expired and deleted, its lines with it
+                    state.update(cart_id=cart_id, lines={}, changed=[], removed=[], dirty=False)
+                Cart.touch(cart_id)
+                state["lines"][item_id] = {"product_id": product.pk, "variation_id": variation_id, "qty": total}
+            else:
+                state["lines"][item_id]["qty"] += qty
+                if item_id not in state["changed"]:
+                    state["changed"].append(item_id)
+                state["dirty"] = True
+            self._save(user.pk, state)
+
+    def remove_item(self, user, item_id):
+        with self._locked(user.pk):
+            state = self._load(user)
+            if item_id not in state["lines"]:
+                return False
+            self._remove_lines(state, [item_id])
+            self._save(user.pk, state)
+        return True
+
+    def remove_product(self, user, product_id, variation_id=None):
+        with self._locked(user.pk):
+            state = self._load(user)
+            matches = [pk for pk, line in state["lines"].items()
+                       if line["product_id"] == product_id and (variation_id is None or line["variation_id"] == variation_id)]
+            self._remove_lines(state, matches)
+            self._save(user.pk, state)
+        return len(matches)
+
+    def clear(self, user):
+        with self._locked(user.pk):
+            state = self._load(user)
+            self._remove_lines(state, list(state["lines"]))
+            self._save(user.pk, state)
+
+    def get_cart(self, user):
+        self.flush(user)
+        return super().get_cart(user)
+
+    def flush(self, user):
+        self._flush(user.pk)
+
+    def _write_back(self, state):
+        # Caller holds the cart lock
+        with transaction.atomic():
+            if state["removed"]:
+                CartItem.objects.filter(cart_id=state["cart_id"], pk__in=state["removed"]).delete()
+            changed = [CartItem(pk=pk, qty=state["lines"][pk]["qty"]) for pk in state["changed"]]
+            if changed:
+                CartItem.objects.bulk_update(changed, ["qty"])
+            Cart.touch(state["cart_id"])
+        state.update(changed=[], removed=[], dirty=False)
+
+    def _flush(self, user_id):
+        with self._locked(user_id):
+            state = self.cache.get(self._key(user_id))
+            if state is not None and state["dirty"]:
+                self._write_back(state)
+                self.cache.set(self._key(user_id), state, settings.CART_STORE_TIMEOUT)
+        with self._dirty_lock:
+            self._dirty.discard(user_id)
+
+    def _drop(self, user_id):
+        # Caller holds the cart lock. Dirty state is written, never thrown away.
+        state = self.cache.get(self._key(user_id))
+        if state is not None and state["dirty"]:
+            self._write_back(state)
+        self.cache.delete(self._key(user_id))
+        with self._dirty_lock:
+            self._dirty.discard(user_id)
+
+    @contextmanager
+    def changing(self, user):
+        """
+        Holds the cart lock around direct database changes. Pending changes are written and the
+        cached state dropped first; no request can cache new state until the block exits, so
+        the next access rebuilds from the database whether or not the block succeeded.
+        """
+        with self._locked(user.pk):
+            self._drop(user.pk)
+            yield
+
+    def forget(self, user):
+        with self._locked(user.pk):
+            self._drop(user.pk)
+
+    def flush_users(self, user_ids):
+        user_ids = list(user_ids)
+        states = self.cache.get_many([self._key(user_id) for user_id in user_ids])
+        for user_id in user_ids:
+            state = states.get(self._key(user_id))
+            if state is not None and state["dirty"]:
+                self._flush(user_id)
+
+    def forget_users(self, user_ids):
+        # Each cart is locked so a change cached meanwhile is written, not deleted with the state
+        for user_id in user_ids:
+            with self._locked(user_id):
+                self._drop(user_id)
+
+    def flush_all(self):
+        """Flushes every cart this process has dirtied. Returns how many were attempted."""
+        with self._dirty_lock:
+            pending = list(self._dirty)
+        for user_id in pending:
+            try:
+                self._flush(user_id)
+            except Exception:
+                # Left dirty, so the next run retries it
+                logger.exception("Flushing cached cart of user %s failed", user_id)
+        return len(pending)
+
+    def _schedule(self):
+        with self._dirty_lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(settings.CART_STORE_FLUSH_SECONDS, self._run_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _run_timer(self):
+        try:
+            self.flush_all()
+        finally:
+            connections.close_all()
+            with self._dirty_lock:
+                self._timer = None
+                again = bool(self._dirty)
+            if again:
+                self._schedule()
+
+
+BACKENDS = {"database": DatabaseCartStore, "cache": CachedCartStore}
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_cart_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = BACKENDS[settings.CART_STORE_BACKEND]()
+        return _store
@@ -0,0 +1,37 @@
+from django.db import transaction
+
+from .cart_store import get_cart_store
+from .models import Cart
+
+
+def expire_carts(older_than, batch_size=1000):
+    """
+    Deletes carts, with their items, that have not changed since `older_than`.
+    Walks candidate carts by id in keyset batches; each batch is its own short transaction
+    that re-checks updated_at under a row lock, so a cart touched meanwhile survives.
+    Cart changes still pending in the cart store are written (touching the cart) first.
+    Returns (carts deleted, items deleted).
+    """
+    store = get_cart_store()
+    carts = items = 0
+    last_id = 0
+    while True:
+        candidates = dict(
+            Cart.objects.filter(updated_at__lt=older_than, id__gt=last_id)
+            .order_by("id").values_list("id", "user_id")[:batch_size]
+        )
+        if not candidates:
+            return carts, items
+        ids = list(candidates)
+        last_id = ids[-1]
+        store.flush_users(candidates.values())
+        with transaction.atomic():
+            expired = dict(
+                Cart.objects.select_for_update().filter(id__in=ids, updated_at__lt=older_than)
+                .values_list("id", "user_id")
+            )
+            if expired:
+                _, counts = Cart.objects.filter(id__in=expired).delete()
+                carts += counts.get(Cart._meta.label, 0)
+                items += counts.get("store.CartItem", 0)
+        store.forget_users(expired.values())
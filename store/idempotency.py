@@ -0,0 +1,95 @@
+import hashlib
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+
+class LockWaitTimeout(Exception):
+    pass
+
+
+def lock_key(user_id, scope, key):
+    # Hashed: client keys may be long or contain characters some cache backends reject
+    return f"lock:{scope}:{user_id}:{hashlib.sha256(key.encode('utf-8')).hexdigest()}"
+
+
+@contextmanager
+def key_lock(user_id, scope, idempotency_key):
+    """Serializes one user's requests with the same key across processes, through the shared cache."""
+    key = lock_key(user_id, scope, idempotency_key)
+    deadline = time.monotonic() + settings.IDEMPOTENCY_LOCK_WAIT_SECONDS
+    while not cache.add(key, 1, timeout=settings.IDEMPOTENCY_LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            raise LockWaitTimeout(key)
+        time.sleep(0.05)
+    try:
+        yield
+    finally:
+        cache.delete(key)
+
+
+def idempotent(scope):
+    """
+    Makes a write view safe to retry with an Idempotency-Key header.
+    The first request with a key runs the view; its response is stored for
+    IDEMPOTENCY_KEY_TTL_SECONDS and replayed for later requests with the same key.
+    Requests with the same key are serialized, so concurrent duplicates wait and
+    replay instead of doing the work twice; other keys are not held up. 5xx responses are
+    not stored, so the client can retry those. Requests without the header run as usual.
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key:
+                return view_method(self, request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return Response({"detail": f"{HEADER} is longer than {MAX_KEY_LENGTH} characters."}, status=status.HTTP_400_BAD_REQUEST)
+
+            try:
+                with key_lock(request.user.pk, scope, key):
+                    cutoff = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL_SECONDS)
+                    stored = IdempotencyKey.objects.filter(user=request.user, scope=scope, key=key).first()
+                    if stored is not None and stored.created_at >= cutoff:
+                        response = Response(stored.response_body, status=stored.response_status)
+                        response["Idempotent-Replayed"] = "true"
+                        return response
+
+                    response = view_method(self, request, *args, **kwargs)
+                    if response.status_code < 500:
+                        try:
+                            # Replacing an expired row: both or neither, so it is never just lost
+                            with transaction.atomic():
+                                if stored is not None:
+                                    stored.delete()
+                                IdempotencyKey.objects.create(
+                                    user=request.user, scope=scope, key=key,
+                                    response_status=response.status_code, response_body=response.data,
+                                )
+                        except IntegrityError:
+                            # Only without a shared cache can another process have stored it first
+                            pass
+                    return response
+            except LockWaitTimeout:
+                return Response({"detail": "A request with this Idempotency-Key is still in progress."}, status=status.HTTP_409_CONFLICT)
+        return wrapper
+    return decorator
+
+
+def prune_idempotency_keys():
+    """Deletes stored responses older than the TTL. Returns the number deleted."""
+    cutoff = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL_SECONDS)
+    return IdempotencyKey.objects.filter(created_at__lt=cutoff).delete()[0]
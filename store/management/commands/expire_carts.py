@@ -0,0 +1,26 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store.expiry import expire_carts
+
+
+class Command(BaseCommand):
+    help = "Delete carts, and their items, that have been idle longer than the configured age."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, help="Defaults to CART_EXPIRE_DAYS.")
+        parser.add_argument("--batch-size", type=int, help="Carts per delete. Defaults to CART_EXPIRE_BATCH_SIZE.")
+
+    def handle(self, *args, **options):
+        days = options["days"] if options["days"] is not None else settings.CART_EXPIRE_DAYS
+        batch_size = options["batch_size"] or settings.CART_EXPIRE_BATCH_SIZE
+        started = time.monotonic()
+        carts, items = expire_carts(timezone.now() - timedelta(days=days), batch_size=batch_size)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{carts} carts and {items} cart items idle for over {days} days deleted in {elapsed:.1f}s"
+        ))
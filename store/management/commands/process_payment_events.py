@@ -0,0 +1,27 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store.payment_events import process_payment_events
+
+
+class Command(BaseCommand):
+    help = "Apply pending payment webhook events to orders in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, help="Events per transaction. Defaults to PAYMENT_EVENTS_BATCH_SIZE.")
+        parser.add_argument("--follow", action="store_true", help="Keep polling for new events instead of exiting.")
+        parser.add_argument("--interval", type=float, default=1.0, help="Seconds between polls with --follow.")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"] or settings.PAYMENT_EVENTS_BATCH_SIZE
+        while True:
+            started = time.monotonic()
+            events, orders = process_payment_events(batch_size=batch_size)
+            if events or not options["follow"]:
+                elapsed = time.monotonic() - started
+                self.stdout.write(self.style.SUCCESS(f"{events} payment events applied, {orders} orders updated in {elapsed:.1f}s"))
+            if not options["follow"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,41 @@
+from datetime import timedelta
+from statistics import quantiles
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store.reconciliation import reconcile_pending_orders
+
+
+class Command(BaseCommand):
+    help = "Settle stale PENDING orders as PAID, FAILED or CANCELLED from their gateway status."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--minutes", type=int, help="Minimum order age. Defaults to PENDING_ORDER_RECONCILE_MINUTES.")
+        parser.add_argument("--batch-size", type=int, help="Defaults to PENDING_ORDER_RECONCILE_BATCH_SIZE.")
+        parser.add_argument("--workers", type=int, help="Concurrent gateway lookups. Defaults to PENDING_ORDER_RECONCILE_WORKERS.")
+
+    def handle(self, *args, **options):
+        minutes = options["minutes"] if options["minutes"] is not None else settings.PENDING_ORDER_RECONCILE_MINUTES
+        stats = reconcile_pending_orders(
+            timezone.now() - timedelta(minutes=minutes),
+            batch_size=options["batch_size"] or settings.PENDING_ORDER_RECONCILE_BATCH_SIZE,
+            workers=options["workers"] or settings.PENDING_ORDER_RECONCILE_WORKERS,
+        )
+        applied = stats["applied"]
+        elapsed = stats["elapsed"]
+        rate = stats["scanned"] / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['scanned']} pending orders older than {minutes} minutes checked in {elapsed:.1f}s ({rate:.0f}/s): "
+            f"{applied['PAID']} paid, {applied['FAILED']} failed, {applied['CANCELLED']} cancelled, "
+            f"{stats['unchanged']} unchanged, {stats['errors']} errors"
+        ))
+        if stats["unavailable"]:
+            self.stdout.write(self.style.WARNING("Stopped early: the payment gateway is unavailable."))
+        latencies = stats["latencies"]
+        if latencies:
+            ms = sorted(seconds * 1000 for seconds in latencies)
+            cuts = quantiles(ms, n=20) if len(ms) > 1 else [ms[0]] * 19
+            p50, p95 = cuts[9], cuts[18]
+            self.stdout.write(f"gateway latency over {len(ms)} calls: p50 {p50:.0f}ms, p95 {p95:.0f}ms, max {ms[-1]:.0f}ms")
@@ -0,0 +1,45 @@
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from store.payment_events import sign_event
+
+
+class Command(BaseCommand):
+    help = (
+        "POST gateway events, one JSON object per line, to the payment webhook signed with "
+        "RAZORPAY_WEBHOOK_SECRET. An \"event_id\" key is sent as the event id header."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", nargs="?", help="JSON lines file; reads stdin when omitted.")
+        parser.add_argument("--url", default="http://localhost:8000/api/payments/webhook/")
+        parser.add_argument("--workers", type=int, default=1, help="Concurrent deliveries, to simulate bursts.")
+
+    def handle(self, *args, **options):
+        stream = open(options["path"], encoding="utf-8") if options["path"] else sys.stdin
+        with stream:
+            events = [json.loads(line) for line in stream if line.strip()]
+        session = requests.Session()
+
+        def deliver(event):
+            event = dict(event)
+            body, headers = sign_event(event, event_id=event.pop("event_id", None))
+            headers["Content-Type"] = "application/json"
+            return session.post(options["url"], data=body, headers=headers, timeout=10).status_code
+
+        started = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+                statuses = list(pool.map(deliver, events))
+        except requests.RequestException as e:
+            raise CommandError(f"Delivery to {options['url']} failed: {e}")
+        elapsed = time.monotonic() - started
+        failed = sum(1 for code in statuses if code != 200)
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(events)} events replayed in {elapsed:.1f}s ({failed} rejected)"
+        ))
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.7 on 2026-10-17 04:43
+
+import store.models
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    # Variation-less duplicates were possible before the constraint; keep the oldest line with the summed qty
+    CartItem = apps.get_model("store", "CartItem")
+    duplicates = (
+        CartItem.objects.filter(variation__isnull=True).order_by().values("cart_id", "product_id")
+        .annotate(lines=Count("id"), keep=Min("id"), qty_total=Sum("qty")).filter(lines__gt=1)
+    )
+    for row in duplicates:
+        lines = CartItem.objects.filter(cart_id=row["cart_id"], product_id=row["product_id"], variation__isnull=True)
+        lines.exclude(pk=row["keep"]).delete()
+        CartItem.objects.filter(pk=row["keep"]).update(qty=row["qty_total"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogs', '0010_categoryproductcount'),
+        ('store', '0002_order_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='cartitem',
+            name='variation',
+            field=models.ForeignKey(blank=True, null=True, on_delete=store.models.merge_or_set_null, to='catalogs.productvariation'),
+        ),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(condition=models.Q(('variation__isnull', True)), fields=('cart', 'product'), name='cartitem_unique_without_variation'),
+        ),
+    ]
@@ -1,35 +1,172 @@
-from django.db import models
+import time
+from django.db import OperationalError, connections, models, router
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Q, Subquery, Sum, Window
+from django.db.models.functions import Coalesce, NullIf
 from django.conf import settings
+from django.utils import timezone
 from decimal import Decimal
-from catalogs.models import Product, ProductVariation
+from catalogs.models import Product, ProductImage, ProductVariation
 
 class Cart(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="cart")
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Finds idle carts for expire_carts
+            models.Index(fields=["updated_at"], name="cart_updated_at_idx"),
+        ]
+
     def __str__(self):
         return f"Cart({self.user.email})"
 
+    def load_for_display(self):
+        """Prefetches the items with SQL-side totals and sets total_amount: one query for any cart size."""
+        models.prefetch_related_objects([self], models.Prefetch("items", queryset=CartItem.objects.for_display()))
+        items = self.items.all()
+        self.total_amount = items[0].cart_total if items else Decimal("0.00")
+        return self
+
+    @classmethod
+    def touch(cls, *pks):
+        # Item writes do not save the cart itself; this keeps the cart's ETag honest
+        cls.objects.filter(pk__in=pks).update(updated_at=timezone.now())
+
     def total_price(self):
+        if hasattr(self, "total_amount"):
+            return self.total_amount
         total = Decimal("0.00")
         for item in self.items.all():
             total += item.line_total()
         return total
 
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+UPSERT_ATTEMPTS = 10
+# SQL versions of CartItem.line_total: a line without its own price falls back to the product's
+UNIT_PRICE = Coalesce(NullIf("price_at_add", 0), "product__price", output_field=MONEY)
+LINE_AMOUNT = ExpressionWrapper(UNIT_PRICE * F("qty"), output_field=MONEY)
+
+def merge_or_set_null(collector, field, sub_objs, using):
+    """
+    on_delete for CartItem.variation. A line whose variation is deleted would become a second
+    variation-less line for the product, which the unique constraint forbids; its qty is folded
+    into the existing variation-less line instead, or it becomes that line when there is none.
+    """
+    sub_objs = list(sub_objs)
+    if not sub_objs:
+        return
+    plain = {
+        (item.cart_id, item.product_id): item
+        for item in CartItem.objects.using(using).filter(
+            variation__isnull=True,
+            cart_id__in={item.cart_id for item in sub_objs},
+            product_id__in={item.product_id for item in sub_objs},
+        )
+    }
+    orphaned, merged, targets = [], [], {}
+    for item in sub_objs:
+        key = (item.cart_id, item.product_id)
+        target = plain.get(key)
+        if target is None:
+            plain[key] = item
+            orphaned.append(item)
+        else:
+            target.qty += item.qty
+            targets[target.pk] = target
+            merged.append(item)
+    if orphaned:
+        collector.add_field_update(field, None, orphaned)
+    qty_field = CartItem._meta.get_field("qty")
+    for target in targets.values():
+        collector.add_field_update(qty_field, target.qty, [target])
+    if merged:
+        collector.collect(merged, source=field.remote_field.model, source_attr=field.name, nullable=True, fail_on_restricted=False)
+
+class CartItemQuerySet(models.QuerySet):
+    def with_totals(self):
+        """
+        Annotates unit_price and line_amount (SQL versions of line_total), the grand
+        cart_total over each cart's items (a window, so no second query) and first_image,
+        the file name of the product's first image.
+        """
+        first_image = ProductImage.objects.filter(product=OuterRef("product_id")).order_by("id").values("image")[:1]
+        return self.annotate(
+            unit_price=UNIT_PRICE,
+            line_amount=LINE_AMOUNT,
+            cart_total=Window(Sum(LINE_AMOUNT), partition_by=[F("cart_id")], output_field=MONEY),
+            first_image=Subquery(first_image),
+        )
+
+    def total(self):
+        """Sum of line_total over the selected lines, as one aggregate query."""
+        total = self.aggregate(total=Coalesce(Sum(LINE_AMOUNT), Decimal("0.00"), output_field=MONEY))["total"]
+        # SQLite drops trailing zeros from computed decimals
+        return total.quantize(Decimal("0.01"))
+
+    def add_qty(self, cart_id, product_id, variation_id, qty, price):
+        """
+        Adds `qty` to the cart line in one atomic INSERT ... ON CONFLICT DO UPDATE, creating
+        it at `price` if missing. Concurrent adds to the same line all count.
+        Returns (line id, new qty). Works on PostgreSQL and SQLite >= 3.35.
+        """
+        using = router.db_for_write(CartItem)
+        connection = connections[using]
+        table = connection.ops.quote_name(CartItem._meta.db_table)
+        # Must match the unique index the row would collide with, see CartItem.Meta
+        target = "(cart_id, product_id, variation_id)" if variation_id is not None else "(cart_id, product_id) WHERE variation_id IS NULL"
+        sql = (
+            f"INSERT INTO {table} (cart_id, product_id, variation_id, qty, price_at_add) VALUES (%s, %s, %s, %s, %s) "
+            f"ON CONFLICT {target} DO UPDATE SET qty = {table}.qty + EXCLUDED.qty RETURNING id, qty"
+        )
+        params = [cart_id, product_id, variation_id, qty, connection.ops.adapt_decimalfield_value(price, 12, 2)]
+        for attempt in range(UPSERT_ATTEMPTS):
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(sql, params)
+                    return cursor.fetchone()
+            except OperationalError as e:
+                # SQLite reports lock contention between writers instead of waiting; retry
+                # unless inside a transaction, which the error has already broken
+                retry = connection.vendor == "sqlite" and "locked" in str(e) and not connection.in_atomic_block
+                if not retry or attempt == UPSERT_ATTEMPTS - 1:
+                    raise
+                time.sleep(0.01 * (attempt + 1))
+
+    def for_display(self):
+        """Everything CartSerializer reads, in one query."""
+        return (
+            self.select_related("product", "variation")
+            .only(
+                "id", "cart_id", "qty", "price_at_add", "product_id", "variation_id",
+                "product__id", "product__name", "product__price",
+                "variation__id", "variation__color", "variation__size", "variation__price", "variation__is_available",
+            )
+            .with_totals()
+            .order_by("id")
+        )
+
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name="items")
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
-    variation = models.ForeignKey(ProductVariation, on_delete=models.SET_NULL, null=True, blank=True)
+    variation = models.ForeignKey(ProductVariation, on_delete=merge_or_set_null, null=True, blank=True)
     qty = models.PositiveIntegerField(default=1)
     price_at_add = models.DecimalField(max_digits=12, decimal_places=2)
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         unique_together = ("cart", "product", "variation")
+        constraints = [
+            # NULLs never collide in unique_together, so variation-less lines need their own index
+            models.UniqueConstraint(fields=["cart", "product"], condition=Q(variation__isnull=True), name="cartitem_unique_without_variation"),
+        ]
 
     def __str__(self):
         return f"{self.cart.user.email} - {self.product.name} ({self.qty})"
 
     def line_total(self):
+        if hasattr(self, "line_amount"):
+            return self.line_amount
         return (self.price_at_add or self.product.price) * self.qty
 
 class WishlistItem(models.Model):
@@ -55,10 +192,18 @@ class Order(models.Model):
     total_amount = models.DecimalField(max_digits=12, decimal_places=2)
     status = models.CharField(max_length=20, choices=ORDER_STATUS_CHOICES, default="PENDING")
     created_at = models.DateTimeField(auto_now_add=True)
-    razorpay_order_id = models.CharField(max_length=255, blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Indexed for matching gateway webhook events to orders
+    razorpay_order_id = models.CharField(max_length=255, blank=True, null=True, db_index=True)
     razorpay_payment_id = models.CharField(max_length=255, blank=True, null=True)
     razorpay_signature = models.CharField(max_length=512, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Stale PENDING order scan in reconcile_pending_orders
+            models.Index(fields=["status", "created_at"], name="order_status_created_idx"),
+        ]
+
     def __str__(self):
         return f"Order({self.id}) - {self.user.email} - {self.status}"
 
@@ -71,3 +216,40 @@ class OrderItem(models.Model):
 
     def __str__(self):
         return f"OrderItem({self.order.id}) - {self.product.name} x {self.qty}"
+
+class IdempotencyKey(models.Model):
+    """A response stored under a client supplied Idempotency-Key, replayed on retries. See store.idempotency."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="idempotency_keys")
+    scope = models.CharField(max_length=50)
+    key = models.CharField(max_length=255)
+    response_status = models.PositiveSmallIntegerField()
+    response_body = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "scope", "key"], name="idempotencykey_unique_per_user"),
+        ]
+
+    def __str__(self):
+        return f"IdempotencyKey({self.scope}:{self.key}) - {self.response_status}"
+
+class PaymentEvent(models.Model):
+    """
+    Append-only inbox of verified gateway webhook events. The webhook only inserts;
+    store.payment_events.process_payment_events applies them to orders and sets processed_at.
+    """
+    event_id = models.CharField(max_length=255, unique=True)
+    event = models.CharField(max_length=100)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Keeps the worker's scan for pending events small however long the inbox grows
+            models.Index(fields=["id"], condition=Q(processed_at__isnull=True), name="paymentevent_pending_idx"),
+        ]
+
+    def __str__(self):
+        return f"PaymentEvent({self.event_id}) - {self.event}"
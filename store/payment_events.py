@@ -0,0 +1,122 @@
+import hashlib
+import json
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order, PaymentEvent
+from .payments import compute_signature, signature_matches
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = "X-Razorpay-Signature"
+EVENT_ID_HEADER = "X-Razorpay-Event-Id"
+# Gateway events that move an order, and where to
+EVENT_STATUSES = {
+    "payment.captured": "PAID",
+    "order.paid": "PAID",
+    "payment.failed": "FAILED",
+}
+
+
+def verify_webhook(body, signature):
+    """HMAC-SHA256 of the raw body with RAZORPAY_WEBHOOK_SECRET, as in Razor_pay_Verify.py."""
+    secret = settings.RAZORPAY_WEBHOOK_SECRET
+    return bool(secret and signature) and signature_matches(secret, body, signature)
+
+
+def event_id_for(body, header_value):
+    # Razorpay sends a stable id per event; hashing the body covers senders that do not
+    return header_value or hashlib.sha256(body).hexdigest()
+
+
+def sign_event(event, event_id=None):
+    """
+    Serializes and signs an event the way the gateway would: returns (body, headers).
+    Used by the replay_payment_events command and tests to drive the webhook locally.
+    """
+    body = json.dumps(event, separators=(",", ":")).encode("utf-8")
+    headers = {SIGNATURE_HEADER: compute_signature(settings.RAZORPAY_WEBHOOK_SECRET, body)}
+    if event_id:
+        headers[EVENT_ID_HEADER] = event_id
+    return body, headers
+
+
+class MalformedEvent(ValueError):
+    pass
+
+
+def _entity(payload, name):
+    section = payload.get(name, {})
+    entity = section.get("entity", {}) if isinstance(section, dict) else None
+    if not isinstance(entity, dict):
+        raise MalformedEvent(f"payload.{name} is not an object with an entity object.")
+    return entity
+
+def event_target(payload):
+    """The (gateway order id, payment id) an event refers to. Raises MalformedEvent for other shapes."""
+    if not isinstance(payload, dict):
+        raise MalformedEvent("payload is not an object.")
+    payment, order = _entity(payload, "payment"), _entity(payload, "order")
+    target = (payment.get("order_id") or order.get("id"), payment.get("id"))
+    if not all(value is None or isinstance(value, str) for value in target):
+        raise MalformedEvent("Order and payment ids must be strings.")
+    return target
+
+
+def apply_event(order, status, payment_id):
+    """Moves `order` to `status` if allowed; PAID is final. Returns whether it changed."""
+    if order.status == "PAID" or order.status == status:
+        return False
+    order.status = status
+    if payment_id:
+        order.razorpay_payment_id = payment_id
+    return True
+
+
+def process_payment_events(batch_size=500):
+    """
+    Applies pending inbox events to orders, oldest first, in batches: per batch one query
+    for the events, one for their orders, one bulk_update and one update marking them done.
+    Concurrent workers skip each other's locked rows. Returns (events processed, orders changed).
+    """
+    processed = changed_total = 0
+    while True:
+        with transaction.atomic():
+            events = list(
+                PaymentEvent.objects.select_for_update(skip_locked=True)
+                .filter(processed_at__isnull=True).order_by("id")[:batch_size]
+            )
+            if not events:
+                return processed, changed_total
+            targets = {}
+            for event in events:
+                try:
+                    targets[event.id] = event_target(event.payload.get("payload", {}) if isinstance(event.payload, dict) else None)
+                except MalformedEvent as e:
+                    # Signed but unusable: marked processed with the rest so it cannot block the queue
+                    logger.error("Payment event %s is malformed: %s", event.event_id, e)
+            order_ids = {order_id for order_id, _ in targets.values() if order_id}
+            orders = {order.razorpay_order_id: order for order in Order.objects.filter(razorpay_order_id__in=order_ids)}
+
+            now = timezone.now()
+            changed = {}
+            for event in events:
+                status = EVENT_STATUSES.get(event.event)
+                if status is None or event.id not in targets:
+                    continue
+                order_id, payment_id = targets[event.id]
+                order = orders.get(order_id)
+                if order is None:
+                    logger.warning("Payment event %s refers to unknown order %s", event.event_id, order_id)
+                    continue
+                if apply_event(order, status, payment_id):
+                    order.updated_at = now
+                    changed[order.pk] = order
+            if changed:
+                Order.objects.bulk_update(changed.values(), ["status", "razorpay_payment_id", "updated_at"])
+            PaymentEvent.objects.filter(id__in=[event.id for event in events]).update(processed_at=now)
+        processed += len(events)
+        changed_total += len(changed)
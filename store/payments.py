@@ -0,0 +1,253 @@
+"""
+Payment gateway service, selected with settings.PAYMENT_GATEWAY_BACKEND.
+
+"razorpay" talks to the Razorpay API through one client per process. The client keeps a
+pooled keep-alive HTTP session, applies connect/read timeouts to every call, retries
+idempotent calls with jittered backoff and stops calling the gateway for a while after
+repeated failures (circuit breaker), so an unhealthy gateway fails fast instead of tying
+up workers. "fake" keeps orders in memory for tests and offline development.
+"""
+import hashlib
+import hmac
+import itertools
+import logging
+import random
+import threading
+import time
+
+import razorpay
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class GatewayUnavailable(Exception):
+    """Raised without calling the gateway while the circuit breaker is open."""
+
+
+class GatewayRequestError(razorpay.errors.BadRequestError):
+    """
+    A request the gateway refused (4xx), with the HTTP status and the API's error object
+    ({"code", "description", "field", ...}) that the SDK's BadRequestError leaves out.
+    """
+    def __init__(self, message=None, status=None, error=None):
+        super().__init__(message)
+        self.status = status
+        self.error = error or {}
+
+
+class OrderNotFound(GatewayRequestError):
+    """The gateway has no order with the requested id."""
+
+    @classmethod
+    def matches(cls, status, error):
+        # Unknown ids are a 400 input error on the id field; bad credentials are a 401 with the same code
+        return status == 400 and error.get("code") == "BAD_REQUEST_ERROR" and error.get("field") == "id"
+
+
+def compute_signature(secret, message):
+    # Bytes are signed as they are: webhook bodies must not be decoded first
+    if isinstance(message, str):
+        message = message.encode("utf-8")
+    return hmac.new(secret.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+def signature_matches(secret, message, signature):
+    return hmac.compare_digest(compute_signature(secret, message), str(signature))
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive failed calls and rejects calls for `reset_seconds`.
+    Then one trial call is let through: success closes the circuit, failure reopens it.
+    """
+    def __init__(self, failures, reset_seconds):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self._count = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self._opened_at < self.reset_seconds:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._count = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._count += 1
+            if self._trial or self._count >= self.failures:
+                if self._opened_at is None:
+                    logger.warning("Payment gateway circuit opened after %s failures", self._count)
+                self._opened_at = time.monotonic()
+                self._trial = False
+
+
+class TimeoutSession(requests.Session):
+    """
+    A session that applies a default timeout; the Razorpay SDK sets none.
+    It also keeps each thread's last response, so a refused request can be told apart by status.
+    """
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        self._local.response = None
+        self._local.response = super().request(*args, **kwargs)
+        return self._local.response
+
+    @property
+    def last_response(self):
+        return getattr(self._local, "response", None)
+
+
+class RazorpayGateway:
+    # Failures that say nothing about the request itself; worth a retry and counted by the breaker
+    TRANSIENT = (requests.ConnectionError, requests.Timeout, razorpay.errors.ServerError, razorpay.errors.GatewayError)
+
+    def __init__(self):
+        session = TimeoutSession((settings.PAYMENT_GATEWAY_CONNECT_TIMEOUT, settings.PAYMENT_GATEWAY_READ_TIMEOUT))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.PAYMENT_GATEWAY_POOL_SIZE)
+        session.mount("https://", adapter)
+        self.session = session
+        self.secret = settings.RAZORPAY_KEY_SECRET
+        self.client = razorpay.Client(session=session, auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
+        self.breaker = CircuitBreaker(settings.PAYMENT_GATEWAY_BREAKER_FAILURES, settings.PAYMENT_GATEWAY_BREAKER_RESET_SECONDS)
+        self.retries = settings.PAYMENT_GATEWAY_RETRIES
+        self.backoff = settings.PAYMENT_GATEWAY_BACKOFF_SECONDS
+
+    def _call(self, fn, *args, idempotent=False):
+        attempts = self.retries + 1 if idempotent else 1
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                raise GatewayUnavailable("Payment gateway is temporarily unavailable.")
+            try:
+                result = fn(*args)
+            except self.TRANSIENT:
+                self.breaker.record_failure()
+                if attempt == attempts - 1:
+                    raise
+                # Full jitter keeps retrying workers from hitting the gateway in lockstep
+                time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+            except razorpay.errors.BadRequestError as e:
+                # The gateway answered, so it is up, whatever it said
+                self.breaker.record_success()
+                raise self._request_error(e) from e
+            except Exception:
+                self.breaker.record_success()
+                raise
+            except BaseException:
+                # Interrupted mid-call; resolve a trial rather than leave the breaker stuck half-open
+                self.breaker.record_failure()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+
+    def _request_error(self, error):
+        response = self.session.last_response
+        status, details = None, {}
+        if response is not None:
+            status = response.status_code
+            try:
+                details = response.json().get("error") or {}
+            except (ValueError, AttributeError):
+                pass
+        cls = OrderNotFound if OrderNotFound.matches(status, details) else GatewayRequestError
+        return cls(str(error), status, details)
+
+    def create_order(self, amount, currency, notes):
+        # Not idempotent: a retry after a lost response would create a second gateway order
+        return self._call(self.client.order.create, {
+            "amount": amount,
+            "currency": currency,
+            "payment_capture": 1,
+            "notes": notes,
+        })
+
+    def fetch_order(self, order_id):
+        return self._call(self.client.order.fetch, order_id, idempotent=True)
+
+    def fetch_order_payments(self, order_id):
+        return self._call(self.client.order.payments, order_id, idempotent=True)["items"]
+
+    def verify_payment_signature(self, order_id, payment_id, signature):
+        return signature_matches(self.secret, f"{order_id}|{payment_id}", signature)
+
+
+class FakeGateway:
+    """
+    In-memory gateway. Signatures use RAZORPAY_KEY_SECRET like the real one.
+    Set `latency` (seconds per call) to approximate network round trips offline.
+    """
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.secret = settings.RAZORPAY_KEY_SECRET
+        self.orders = {}
+        self.payments = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def create_order(self, amount, currency, notes):
+        time.sleep(self.latency)
+        with self._lock:
+            order_id = f"order_fake{next(self._ids)}"
+            self.orders[order_id] = {"id": order_id, "amount": amount, "currency": currency, "notes": notes, "status": "created"}
+        return dict(self.orders[order_id])
+
+    def fetch_order(self, order_id):
+        time.sleep(self.latency)
+        try:
+            return dict(self.orders[order_id])
+        except KeyError:
+            raise OrderNotFound("The id provided does not exist", 400, {"code": "BAD_REQUEST_ERROR", "field": "id"})
+
+    def fetch_order_payments(self, order_id):
+        time.sleep(self.latency)
+        if order_id not in self.orders:
+            raise OrderNotFound("The id provided does not exist", 400, {"code": "BAD_REQUEST_ERROR", "field": "id"})
+        return [dict(payment) for payment in self.payments.get(order_id, [])]
+
+    def verify_payment_signature(self, order_id, payment_id, signature):
+        return signature_matches(self.secret, f"{order_id}|{payment_id}", signature)
+
+    def pay(self, order_id):
+        """Marks the order paid and returns (payment id, signature) as checkout would hand them to the client."""
+        with self._lock:
+            payment_id = f"pay_fake{next(self._ids)}"
+            self.orders[order_id]["status"] = "paid"
+            self.payments.setdefault(order_id, []).append({"id": payment_id, "order_id": order_id, "status": "captured"})
+        return payment_id, compute_signature(self.secret, f"{order_id}|{payment_id}")
+
+
+BACKENDS = {"razorpay": RazorpayGateway, "fake": FakeGateway}
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = BACKENDS[settings.PAYMENT_GATEWAY_BACKEND]()
+        return _gateway
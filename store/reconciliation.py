@@ -0,0 +1,125 @@
+import logging
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from .models import Order
+from .payments import GatewayUnavailable, OrderNotFound, get_gateway
+
+logger = logging.getLogger(__name__)
+
+# Gateway order status -> local status, for orders past the reconcile age
+GATEWAY_STATUSES = {
+    "paid": "PAID",
+    # Payment was tried and has not succeeded since
+    "attempted": "FAILED",
+    # Never paid for
+    "created": "CANCELLED",
+}
+# _fetch's status while the circuit breaker is open: no order in the run can be checked
+UNAVAILABLE = object()
+
+
+def _captured_payment(gateway, order_id):
+    """Id of the payment that settled a paid gateway order, or None if it lists none captured."""
+    for payment in gateway.fetch_order_payments(order_id):
+        if payment.get("status") == "captured":
+            return payment["id"]
+    return None
+
+
+def _fetch(gateway, order):
+    """
+    Gateway calls for one order in a worker thread:
+    (order, gateway status, payment id or None, seconds). The status is None on errors.
+    """
+    started = time.monotonic()
+    payment_id = None
+    try:
+        status = gateway.fetch_order(order.razorpay_order_id).get("status")
+        if status == "paid":
+            payment_id = _captured_payment(gateway, order.razorpay_order_id)
+    except OrderNotFound:
+        # The gateway has no such order, so nobody can pay for it
+        status = "created"
+    except GatewayUnavailable:
+        status = UNAVAILABLE
+    except Exception:
+        # Includes other 4xx such as bad credentials, which say nothing about the order
+        logger.exception("Fetching gateway order %s failed", order.razorpay_order_id)
+        status = None
+    return order, status, payment_id, time.monotonic() - started
+
+
+def _apply(transitions, payment_ids):
+    """
+    Writes {status: [order ids]} with one UPDATE per status. Each is conditional on the
+    order still being PENDING, so a concurrent webhook or payment verification wins.
+    Orders settled as PAID also get their {order id: payment id}.
+    """
+    now = timezone.now()
+    applied = Counter()
+    for status, ids in transitions.items():
+        if not ids:
+            continue
+        fields = {"status": status, "updated_at": now}
+        if status == "PAID" and payment_ids:
+            fields["razorpay_payment_id"] = Case(
+                *(When(pk=pk, then=Value(payment_id)) for pk, payment_id in payment_ids.items()),
+                default=F("razorpay_payment_id"),
+            )
+        applied[status] = Order.objects.filter(pk__in=ids, status="PENDING").update(**fields)
+    return applied
+
+
+def reconcile_pending_orders(older_than, batch_size=200, workers=8, gateway=None):
+    """
+    Settles PENDING orders created before `older_than` against the gateway.
+    Orders are walked by (created_at, id) keyset; each batch's gateway lookups run on a
+    bounded thread pool and the results are applied with at most three UPDATEs.
+    Orders that never reached the gateway are cancelled. The run stops early, with
+    "unavailable" set, once the gateway's circuit breaker opens. Returns a stats dict.
+    """
+    gateway = gateway or get_gateway()
+    stats = {"scanned": 0, "unchanged": 0, "errors": 0, "unavailable": False, "applied": Counter(), "latencies": []}
+    started = time.monotonic()
+    pending = Order.objects.filter(status="PENDING", created_at__lt=older_than).order_by("created_at", "id")
+    last = None
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            qs = pending
+            if last is not None:
+                qs = qs.filter(Q(created_at__gt=last[0]) | Q(created_at=last[0], id__gt=last[1]))
+            batch = list(qs.only("id", "created_at", "razorpay_order_id")[:batch_size])
+            if not batch:
+                break
+            last = (batch[-1].created_at, batch[-1].id)
+            stats["scanned"] += len(batch)
+
+            transitions = {status: [] for status in GATEWAY_STATUSES.values()}
+            transitions["CANCELLED"].extend(order.pk for order in batch if not order.razorpay_order_id)
+            payment_ids = {}
+            remote = [order for order in batch if order.razorpay_order_id]
+            for order, status, payment_id, seconds in pool.map(lambda order: _fetch(gateway, order), remote):
+                if status is UNAVAILABLE:
+                    stats["unavailable"] = True
+                    continue
+                stats["latencies"].append(seconds)
+                if status is None:
+                    stats["errors"] += 1
+                elif status in GATEWAY_STATUSES:
+                    transitions[GATEWAY_STATUSES[status]].append(order.pk)
+                    if payment_id is not None:
+                        payment_ids[order.pk] = payment_id
+                else:
+                    stats["unchanged"] += 1
+            stats["applied"].update(_apply(transitions, payment_ids))
+            if stats["unavailable"]:
+                # Every later lookup would be refused too until the breaker resets
+                logger.warning("Payment gateway unavailable; stopping reconciliation after %d orders", stats["scanned"])
+                break
+    stats["elapsed"] = time.monotonic() - started
+    return stats
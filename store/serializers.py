@@ -1,7 +1,9 @@
 from rest_framework import serializers
+from django.conf import settings
 from .models import *
-from catalogs.models import Product, ProductVariation
+from catalogs.models import Product, ProductImage, ProductVariation
 from catalogs.serializers import ProductSerializer, ProductVariationSerializer
+from catalogs.fieldsets import SparseFieldsetMixin
 
 class CartItemSerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source="product.name", read_only=True)
@@ -10,26 +12,36 @@ class CartItemSerializer(serializers.ModelSerializer):
     image = serializers.SerializerMethodField()
     line_total = serializers.SerializerMethodField()
 
+    query_hints = {
+        "image": ["product.images.image"],
+        "line_total": ["price_at_add", "qty", "product.price"],
+    }
+
     class Meta:
         model = CartItem
         fields = ["id", "product_id", "product_name", "variation", "qty", "price_at_add", "image", "line_total"]
 
     def get_image(self, obj):
-        first = obj.product.images.first()
         request = self.context.get("request")
-        if first:
-            if request:
-                return request.build_absolute_uri(first.image.url)
-            return first.image.url
-        return None
+        if hasattr(obj, "first_image"):
+            # Annotated by CartItemQuerySet.with_totals
+            url = ProductImage._meta.get_field("image").storage.url(obj.first_image) if obj.first_image else None
+        else:
+            first = next(iter(obj.product.images.all()), None)
+            url = first.image.url if first and first.image else None
+        if url and request:
+            return request.build_absolute_uri(url)
+        return url
 
     def get_line_total(self, obj):
         return str(obj.line_total())
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     total_price = serializers.SerializerMethodField()
 
+    query_hints = {"total_price": ["items.price_at_add", "items.qty", "items.product.price"]}
+
     class Meta:
         model = Cart
         fields = ["id", "user_id", "items", "total_price"]
@@ -44,26 +56,70 @@ class AddToCartSerializer(serializers.Serializer):
     qty = serializers.IntegerField(min_value=1, default=1)
 
     def validate(self, data):
+        # One query either way: a variation lookup brings its product along
+        variation_id = data.get("variation_id")
+        if variation_id:
+            variation = ProductVariation.objects.select_related("product").filter(pk=variation_id).first()
+            if variation is None or variation.product_id != data["product_id"]:
+                if not Product.objects.filter(pk=data["product_id"]).exists():
+                    raise serializers.ValidationError({"product_id": "Product not found."})
+                raise serializers.ValidationError({"variation_id": "Variation not found for this product."})
+            data["product"], data["variation"] = variation.product, variation
+            return data
         try:
             data["product"] = Product.objects.get(pk=data["product_id"])
         except Product.DoesNotExist:
             raise serializers.ValidationError({"product_id": "Product not found."})
-        variation_id = data.get("variation_id")
-        if variation_id:
-            try:
-                data["variation"] = ProductVariation.objects.get(pk=variation_id, product=data["product"])
-            except ProductVariation.DoesNotExist:
-                raise serializers.ValidationError({"variation_id": "Variation not found for this product."})
-        else:
-            data["variation"] = None
+        data["variation"] = None
         return data
 
+CART_OPERATIONS = ("add", "set_qty", "remove")
+
+class CartOperationSerializer(serializers.Serializer):
+    """
+    add: increases qty (default 1); set_qty: sets it, 0 removes the line;
+    remove: drops the line, or every line of the product when variation_id is omitted.
+    """
+    op = serializers.ChoiceField(choices=CART_OPERATIONS)
+    product_id = serializers.IntegerField()
+    variation_id = serializers.IntegerField(required=False, allow_null=True)
+    qty = serializers.IntegerField(min_value=0, required=False)
+
+    def validate(self, data):
+        if data["op"] == "add":
+            data["qty"] = data.get("qty", 1)
+            if data["qty"] < 1:
+                raise serializers.ValidationError({"qty": "Must be at least 1 to add."})
+        elif data["op"] == "set_qty" and "qty" not in data:
+            raise serializers.ValidationError({"qty": "Required for set_qty."})
+        return data
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = serializers.ListField(child=CartOperationSerializer(), allow_empty=False, max_length=settings.CART_BATCH_MAX_OPERATIONS)
+
+    def validate_operations(self, operations):
+        """Resolves every referenced product and variation with one in_bulk lookup per model."""
+        products = Product.objects.order_by().only("id", "price").in_bulk({op["product_id"] for op in operations})
+        variation_ids = {op["variation_id"] for op in operations if op.get("variation_id")}
+        variations = ProductVariation.objects.order_by().only("id", "product_id", "price").in_bulk(variation_ids) if variation_ids else {}
+        errors = {}
+        for index, op in enumerate(operations):
+            op["product"] = products.get(op["product_id"])
+            op["variation"] = variations.get(op.get("variation_id"))
+            if op["product"] is None:
+                errors[index] = {"product_id": "Product not found."}
+            elif op.get("variation_id") and (op["variation"] is None or op["variation"].product_id != op["product_id"]):
+                errors[index] = {"variation_id": "Variation not found for this product."}
+        if errors:
+            raise serializers.ValidationError(errors)
+        return operations
+
 class RemoveFromCartSerializer(serializers.Serializer):
     product_id = serializers.IntegerField(required=False)
     variation_id = serializers.IntegerField(required=False)
     cart_item_id = serializers.IntegerField(required=False)
 
-class WishlistSerializer(serializers.ModelSerializer):
+class WishlistSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
 
     class Meta:
@@ -88,7 +144,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
         model = OrderItem
         fields = ["id", "product", "variation", "qty", "price_at_order"]
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
 
     class Meta:
@@ -1,3 +1,728 @@
-from django.test import TestCase
+import json
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import razorpay
+import requests
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from catalogs.models import Category, Product, ProductImage, ProductVariation
+from . import cart_store, payments
+from .expiry import expire_carts
+from .payment_events import process_payment_events, sign_event
+from .reconciliation import reconcile_pending_orders
+from .idempotency import key_lock
+from .models import Cart, CartItem, IdempotencyKey, Order, OrderItem, PaymentEvent
+from .views import PlaceOrderView
+
+
+class CartReadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email="cart@example.com", phone_number="5550001", password="pw")
+        cls.cart = Cart.objects.create(user=cls.user)
+        category = Category.objects.create(name="Cart Tests")
+        for i in range(30):
+            product = Product.objects.create(name=f"Item {i}", price=Decimal("10.00") + i, category=category)
+            ProductImage.objects.create(product=product, image=f"product_images/item{i}.jpg")
+            ProductImage.objects.create(product=product, image=f"product_images/item{i}-b.jpg")
+            variation = ProductVariation.objects.create(product=product, color="red", size="M", price=Decimal("5.00") + i)
+            # Even lines fall back to the product price (price_at_add 0), odd ones keep their own
+            price = Decimal("0.00") if i % 2 == 0 else variation.price
+            CartItem.objects.create(cart=cls.cart, product=product, variation=variation, qty=i % 3 + 1, price_at_add=price)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def expected_total(self):
+        return sum((item.price_at_add or item.product.price) * item.qty for item in CartItem.objects.select_related("product"))
+
+    def test_cart_read_query_count_is_constant(self):
+        # Cart lookup and the items with totals and first images; independent of cart size
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/cart/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["items"]), 30)
+
+    def test_cart_totals_match_python(self):
+        response = self.client.get("/api/cart/")
+        self.assertEqual(Decimal(response.data["total_price"]), self.expected_total())
+        for line in response.data["items"]:
+            item = CartItem.objects.select_related("product").get(pk=line["id"])
+            self.assertEqual(Decimal(line["line_total"]), (item.price_at_add or item.product.price) * item.qty)
+
+    def test_cart_item_image_is_first_product_image(self):
+        response = self.client.get("/api/cart/")
+        first = response.data["items"][0]
+        self.assertTrue(first["image"].endswith("/product_images/item0.jpg"))
+
+    def test_unchanged_cart_answers_not_modified(self):
+        etag = self.client.get("/api/cart/")["ETag"]
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/cart/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_empty_cart(self):
+        CartItem.objects.all().delete()
+        response = self.client.get("/api/cart/")
+        self.assertEqual(response.data["items"], [])
+        self.assertEqual(response.data["total_price"], "0.00")
+
+
+class CartBatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email="batch@example.com", phone_number="5550002", password="pw")
+        Cart.objects.create(user=cls.user)
+        category = Category.objects.create(name="Batch Tests")
+        cls.products = [Product.objects.create(name=f"Batch {i}", price=Decimal("3.00"), category=category) for i in range(20)]
+        cls.variation = ProductVariation.objects.create(product=cls.products[0], color="blue", size="L", price=Decimal("4.50"))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def batch(self, operations):
+        return self.client.post("/api/cart/batch/", {"operations": operations}, format="json")
+
+    def test_restore_query_count_does_not_grow_with_items(self):
+        operations = [{"op": "add", "product_id": p.pk, "qty": 2} for p in self.products]
+        # products, cart, transaction, lock existing lines, insert, touch, read back
+        with self.assertNumQueries(8):
+            response = self.batch(operations)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["items"]), 20)
+        self.assertEqual(Decimal(response.data["total_price"]), Decimal("120.00"))
+
+    def test_operations_apply_in_order(self):
+        first, second = self.products[0], self.products[1]
+        self.batch([{"op": "add", "product_id": first.pk}, {"op": "add", "product_id": second.pk, "qty": 5}])
+        response = self.batch([
+            {"op": "add", "product_id": first.pk, "variation_id": self.variation.pk},
+            {"op": "add", "product_id": first.pk, "qty": 2},
+            {"op": "set_qty", "product_id": second.pk, "qty": 0},
+        ])
+        lines = {(line["product_id"], (line["variation"] or {}).get("id")): line for line in response.data["items"]}
+        self.assertEqual(lines[(first.pk, None)]["qty"], 3)
+        self.assertEqual(lines[(first.pk, self.variation.pk)]["price_at_add"], "4.50")
+        self.assertNotIn((second.pk, None), lines)
+
+        response = self.batch([{"op": "remove", "product_id": first.pk}])
+        self.assertEqual(response.data["items"], [])
+
+    def test_invalid_operation_rejects_whole_batch(self):
+        response = self.batch([
+            {"op": "add", "product_id": self.products[0].pk},
+            {"op": "add", "product_id": self.products[1].pk, "variation_id": self.variation.pk},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("variation_id", response.data["operations"][1])
+        self.assertFalse(CartItem.objects.exists())
+
+
+class CartAddConcurrencyTests(TransactionTestCase):
+    THREADS = 8
+    ADDS_PER_THREAD = 10
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email="race@example.com", phone_number="5550003", password="pw")
+        self.cart = Cart.objects.create(user=self.user)
+        category = Category.objects.create(name="Race Tests")
+        self.product = Product.objects.create(name="Race", price=Decimal("2.00"), category=category)
+        self.variation = ProductVariation.objects.create(product=self.product, color="red", size="S")
+
+    def hammer(self, variation_id):
+        errors = []
+        start = threading.Barrier(self.THREADS)
+
+        def worker():
+            # The upsert itself; the rest of the view (cart lookup, touch) does not race on qty
+            try:
+                start.wait()
+                for _ in range(self.ADDS_PER_THREAD):
+                    CartItem.objects.add_qty(self.cart.pk, self.product.pk, variation_id, 1, self.product.price)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_concurrent_adds_are_not_lost(self):
+        self.hammer(None)
+        self.hammer(self.variation.pk)
+        lines = CartItem.objects.filter(cart=self.cart)
+        self.assertEqual(lines.count(), 2)
+        for line in lines:
+            self.assertEqual(line.qty, self.THREADS * self.ADDS_PER_THREAD)
+
+    def test_add_view_increments_existing_line(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        for qty in (1, 4):
+            response = client.post("/api/cart/add/", {"product_id": self.product.pk, "variation_id": self.variation.pk, "qty": qty}, format="json")
+            self.assertEqual(response.status_code, 200)
+        line = CartItem.objects.get(cart=self.cart)
+        self.assertEqual(line.qty, 5)
+        self.assertEqual(line.price_at_add, Decimal("2.00"))
+
+    def test_deleting_a_variation_folds_its_line_into_the_plain_line(self):
+        CartItem.objects.add_qty(self.cart.pk, self.product.pk, None, 2, self.product.price)
+        CartItem.objects.add_qty(self.cart.pk, self.product.pk, self.variation.pk, 3, self.product.price)
+        self.variation.delete()
+        line = CartItem.objects.get(cart=self.cart)
+        self.assertIsNone(line.variation_id)
+        self.assertEqual(line.qty, 5)
+
+
+@override_settings(CART_STORE_BACKEND="cache", CART_STORE_FLUSH_SECONDS=3600)
+class CachedCartStoreTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email="cached@example.com", phone_number="5550004", password="pw")
+        category = Category.objects.create(name="Cached Cart Tests")
+        cls.product = Product.objects.create(name="Cached", price=Decimal("4.00"), category=category)
+        cls.other = Product.objects.create(name="Other", price=Decimal("6.00"), category=category)
+
+    def setUp(self):
+        cache.clear()
+        with self.assertLogs("store.cart_store", "WARNING"):
+            self.store = cart_store._store = cart_store.CachedCartStore()
+        # The test cache is never full; the default would write local memory carts through
+        self.store.write_behind = True
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        if self.store._timer is not None:
+            self.store._timer.cancel()
+        cart_store._store = None
+
+    def add(self, product, qty):
+        response = self.client.post("/api/cart/add/", {"product_id": product.pk, "qty": qty}, format="json")
+        self.assertEqual(response.status_code, 200)
+
+    def test_quantity_changes_are_written_behind(self):
+        self.add(self.product, 1)
+        line = CartItem.objects.get()
+        self.assertEqual(line.qty, 1)
+        self.add(self.product, 2)
+        self.assertEqual(CartItem.objects.get().qty, 1)
+        self.assertEqual(self.store.flush_all(), 1)
+        self.assertEqual(CartItem.objects.get().qty, 3)
+
+    def test_cart_read_flushes_pending_changes(self):
+        self.add(self.product, 1)
+        self.add(self.product, 4)
+        self.add(self.other, 1)
+        response = self.client.post("/api/cart/remove/", {"product_id": self.other.pk}, format="json")
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get("/api/cart/")
+        self.assertEqual([(item["product_id"], item["qty"]) for item in response.data["items"]], [(self.product.pk, 5)])
+
+    def test_remove_and_clear_answer_like_the_database_store(self):
+        self.add(self.product, 1)
+        response = self.client.post("/api/cart/remove/", {"cart_item_id": CartItem.objects.get().pk + 100}, format="json")
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post("/api/cart/remove/", {"product_id": self.other.pk}, format="json")
+        self.assertEqual(response.status_code, 404)
+        self.client.post("/api/cart/clear/")
+        self.assertTrue(CartItem.objects.exists())
+        self.store.flush(self.user)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_cache_miss_reads_through_to_the_database(self):
+        self.add(self.product, 2)
+        cache.clear()
+        self.add(self.product, 1)
+        self.store.flush(self.user)
+        self.assertEqual(CartItem.objects.get().qty, 3)
+
+    def test_forget_writes_pending_changes_first(self):
+        self.add(self.product, 1)
+        self.add(self.product, 2)
+        self.store.forget(self.user)
+        self.assertEqual(CartItem.objects.get().qty, 3)
+
+    def test_expiry_keeps_carts_with_pending_changes(self):
+        self.add(self.product, 1)
+        Cart.objects.update(updated_at=timezone.now() - timedelta(days=40))
+        self.add(self.product, 2)
+        self.assertEqual(expire_carts(timezone.now() - timedelta(days=30)), (0, 0))
+        self.assertEqual(CartItem.objects.get().qty, 3)
+
+    def test_forgetting_users_writes_pending_changes_first(self):
+        self.add(self.product, 1)
+        self.add(self.product, 2)
+        self.store.forget_users([self.user.pk])
+        self.assertEqual(CartItem.objects.get().qty, 3)
+        self.assertIsNone(cache.get(self.store._key(self.user.pk)))
+
+    def test_direct_changes_hold_off_cached_writes(self):
+        self.add(self.product, 1)
+        self.add(self.product, 1)
+        with override_settings(CART_STORE_LOCK_ATTEMPTS=1), self.assertRaises(RuntimeError):
+            with self.store.changing(self.user):
+                self.assertEqual(CartItem.objects.get().qty, 2)
+                with self.assertRaises(cart_store.CartLockTimeout):
+                    self.store.add(self.user, self.other, None, 1, self.other.price)
+                raise RuntimeError("batch failed")
+        # Nothing pending was lost, and the store rebuilds from the database
+        self.add(self.product, 1)
+        self.store.flush(self.user)
+        self.assertEqual(CartItem.objects.get().qty, 3)
+
+    def test_readding_a_removed_line_starts_it_over(self):
+        self.add(self.product, 2)
+        response = self.client.post("/api/cart/remove/", {"product_id": self.product.pk}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.add(self.product, 1)
+        self.store.flush(self.user)
+        self.assertEqual(CartItem.objects.get().qty, 1)
+        self.assertEqual(self.client.get("/api/cart/").data["items"][0]["qty"], 1)
+
+    def test_evicting_caches_are_written_through(self):
+        self.store.write_behind = False
+        self.add(self.product, 1)
+        self.add(self.product, 2)
+        self.assertEqual(CartItem.objects.get().qty, 3)
+        self.assertEqual(self.store.flush_all(), 0)
+
+    def test_batch_keeps_changes_cached_before_it(self):
+        self.add(self.product, 1)
+        self.add(self.product, 2)
+        response = self.client.post("/api/cart/batch/", {"operations": [{"op": "add", "product_id": self.other.pk, "qty": 1}]}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted((item["product_id"], item["qty"]) for item in response.data["items"]), [(self.product.pk, 3), (self.other.pk, 1)])
+        self.add(self.product, 1)
+        self.store.flush(self.user)
+        self.assertEqual(CartItem.objects.get(product=self.product).qty, 4)
+
+
+class ExpireCartsTests(TestCase):
+    def test_only_idle_carts_are_deleted(self):
+        category = Category.objects.create(name="Expiry Tests")
+        product = Product.objects.create(name="Idle", price=Decimal("1.00"), category=category)
+        carts = []
+        for i in range(5):
+            user = get_user_model().objects.create_user(email=f"idle{i}@example.com", phone_number=f"555010{i}", password="pw")
+            cart = Cart.objects.create(user=user)
+            CartItem.objects.create(cart=cart, product=product, qty=1, price_at_add=product.price)
+            carts.append(cart)
+        idle = [cart.pk for cart in carts[:3]]
+        Cart.objects.filter(pk__in=idle).update(updated_at=timezone.now() - timedelta(days=40))
+
+        call_command("expire_carts", days=30, batch_size=2, stdout=StringIO())
+        self.assertQuerySetEqual(Cart.objects.order_by("pk").values_list("pk", flat=True), [cart.pk for cart in carts[3:]])
+        self.assertEqual(CartItem.objects.count(), 2)
+
+
+
+class AddToExpiredCartTests(TransactionTestCase):
+    """An add racing with expire_carts: the cart it read is deleted before its line is inserted."""
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email="late@example.com", phone_number="5550006", password="pw")
+        category = Category.objects.create(name="Late Adds")
+        self.product = Product.objects.create(name="Late", price=Decimal("2.00"), category=category)
+        self.other = Product.objects.create(name="Later", price=Decimal("3.00"), category=category)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        cart_store._store = None
+
+    def add(self, product):
+        response = self.client.post("/api/cart/add/", {"product_id": product.pk, "qty": 1}, format="json")
+        self.assertEqual(response.status_code, 200)
+
+    def test_database_store_adds_to_a_fresh_cart(self):
+        cart_store._store = cart_store.DatabaseCartStore()
+        stale = Cart.objects.create(user=self.user)
+        Cart.objects.filter(pk=stale.pk).delete()
+        with mock.patch.object(cart_store._store, "get_cart", return_value=stale):
+            self.add(self.product)
+        line = CartItem.objects.get()
+        self.assertNotEqual(line.cart_id, stale.pk)
+        self.assertEqual(line.cart.user, self.user)
+
+    def test_cached_store_drops_the_lines_of_the_deleted_cart(self):
+        cache.clear()
+        store = cart_store._store = cart_store.CachedCartStore()
+        self.addCleanup(lambda: store._timer and store._timer.cancel())
+        self.add(self.product)
+        # Expired before expire_carts got to forget the cached state
+        Cart.objects.all().delete()
+        self.add(self.other)
+        store.flush(self.user)
+        self.assertEqual(list(CartItem.objects.values_list("product_id", flat=True)), [self.other.pk])
+        self.assertEqual(self.client.get("/api/cart/").data["items"][0]["product_id"], self.other.pk)
+
+
+class ListOrdersTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email="history@example.com", phone_number="5550008", password="pw")
+        category = Category.objects.create(name="History")
+        product = Product.objects.create(name="Mug", price=Decimal("8.00"), category=category,
+                                         representative_image="product_images/representative/mug.png")
+        order = Order.objects.create(user=cls.user, total_amount=Decimal("8.00"))
+        OrderItem.objects.create(order=order, product=product, qty=1, price_at_order=Decimal("8.00"))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_item_image_urls_are_absolute(self):
+        product = self.client.get("/api/orders/").data[0]["items"][0]["product"]
+        self.assertEqual(product["representative_image"], "http://testserver/media/product_images/representative/mug.png")
+
+    def test_fields_trim_the_orders(self):
+        rows = self.client.get("/api/orders/", {"fields": "id,status"}).data
+        self.assertEqual([set(row) for row in rows], [{"id", "status"}])
+
+
+@override_settings(PAYMENT_GATEWAY_BACKEND="fake")
+class PlaceOrderTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email="checkout@example.com", phone_number="5550005", password="pw")
+        cart = Cart.objects.create(user=cls.user)
+        category = Category.objects.create(name="Checkout Tests")
+        for i in range(10):
+            product = Product.objects.create(name=f"Checkout {i}", price=Decimal("3.00") + i, category=category)
+            # Even lines fall back to the product price
+            price = Decimal("0.00") if i % 2 == 0 else Decimal("1.50")
+            CartItem.objects.create(cart=cart, product=product, qty=i % 3 + 1, price_at_add=price)
+
+    def setUp(self):
+        self.gateway = payments._gateway = payments.FakeGateway()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        payments._gateway = None
+
+    def place(self, key=None):
+        headers = {"Idempotency-Key": key} if key else {}
+        return self.client.post("/api/orders/place/", headers=headers)
+
+    def test_order_copies_cart_lines_and_totals_them(self):
+        expected = sum(line.line_total() for line in CartItem.objects.select_related("product"))
+        response = self.place()
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get()
+        self.assertEqual(order.total_amount, expected)
+        self.assertEqual(response.data["total_amount"], str(expected))
+        self.assertEqual(self.gateway.orders[order.razorpay_order_id]["amount"], int(expected * 100))
+        self.assertEqual(order.items.count(), 10)
+
+    def test_lines_and_total_come_from_one_read(self):
+        with CaptureQueriesContext(connection) as queries:
+            order = PlaceOrderView().create_order(self.user)
+        statements = [q["sql"] for q in queries if "SAVEPOINT" not in q["sql"]]
+        # Cart lock, lines with amounts, order, items: no separate read for the total
+        self.assertEqual(len(statements), 4)
+        copied = sum(item.qty * (item.price_at_order or item.product.price) for item in order.items.select_related("product"))
+        self.assertEqual(order.total_amount, copied)
+
+    def test_gateway_failure_removes_the_order(self):
+        with mock.patch.object(self.gateway, "create_order", side_effect=ConnectionError("gateway down")):
+            response = self.place()
+        self.assertEqual(response.status_code, 502)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_empty_cart(self):
+        CartItem.objects.all().delete()
+        response = self.place()
+        self.assertEqual(response.status_code, 400)
+
+    def test_retry_with_idempotency_key_replays_the_first_response(self):
+        first = self.place(key="checkout-1")
+        self.assertEqual(first.status_code, 201)
+        with self.assertNumQueries(1):
+            replay = self.place(key="checkout-1")
+        self.assertEqual(replay.status_code, 201)
+        self.assertEqual(replay.data, first.data)
+        self.assertEqual(replay["Idempotent-Replayed"], "true")
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(len(self.gateway.orders), 1)
+
+        self.assertEqual(self.place(key="checkout-2").status_code, 201)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_server_errors_are_not_replayed(self):
+        with mock.patch.object(self.gateway, "create_order", side_effect=ConnectionError("gateway down")):
+            self.assertEqual(self.place(key="checkout-3").status_code, 502)
+        self.assertEqual(self.place(key="checkout-3").status_code, 201)
+
+    @override_settings(IDEMPOTENCY_LOCK_WAIT_SECONDS=0)
+    def test_duplicate_in_progress_conflicts(self):
+        with key_lock(self.user.pk, "orders.place", "checkout-4"):
+            self.assertEqual(self.place(key="checkout-4").status_code, 409)
+            self.assertFalse(Order.objects.exists())
+            # Only the same key waits
+            self.assertEqual(self.place(key="checkout-5").status_code, 201)
+
+    def test_expired_key_is_replaced(self):
+        self.assertEqual(self.place(key="checkout-6").status_code, 201)
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL_SECONDS + 1))
+        response = self.place(key="checkout-6")
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn("Idempotent-Replayed", response)
+        self.assertEqual(Order.objects.count(), 2)
+        stored = IdempotencyKey.objects.get()
+        self.assertEqual(stored.response_body["order_id"], response.data["order_id"])
+
+    def test_paid_order_verifies_and_leaves_cart(self):
+        order_id = self.place().data["razorpay_order_id"]
+        payment_id, signature = self.gateway.pay(order_id)
+        payload = {"razorpay_order_id": order_id, "razorpay_payment_id": payment_id, "order_id": Order.objects.get().pk}
+        response = self.client.post("/api/orders/verify-payment/", {**payload, "razorpay_signature": "0" * 64}, format="json")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post("/api/orders/verify-payment/", {**payload, "razorpay_signature": signature}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Order.objects.get().status, "PAID")
+        self.assertFalse(CartItem.objects.exists())
+
+
+@override_settings(PAYMENT_GATEWAY_RETRIES=2, PAYMENT_GATEWAY_BACKOFF_SECONDS=0, PAYMENT_GATEWAY_BREAKER_FAILURES=3)
+class RazorpayGatewayTests(TestCase):
+    def setUp(self):
+        self.gateway = payments.RazorpayGateway()
+
+    def test_idempotent_calls_are_retried(self):
+        with mock.patch.object(self.gateway.client.order, "fetch", side_effect=[requests.Timeout(), {"id": "order_1"}]) as fetch:
+            self.assertEqual(self.gateway.fetch_order("order_1"), {"id": "order_1"})
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_order_creation_is_not_retried(self):
+        with mock.patch.object(self.gateway.client.order, "create", side_effect=requests.ConnectionError()) as create:
+            with self.assertRaises(requests.ConnectionError):
+                self.gateway.create_order(100, "INR", {})
+        self.assertEqual(create.call_count, 1)
+
+    def test_breaker_fails_fast_once_open(self):
+        with mock.patch.object(self.gateway.client.order, "fetch", side_effect=requests.Timeout()) as fetch:
+            with self.assertRaises(requests.Timeout):
+                self.gateway.fetch_order("order_1")
+            with self.assertRaises(payments.GatewayUnavailable):
+                self.gateway.fetch_order("order_1")
+        self.assertEqual(fetch.call_count, 3)
+        self.gateway.breaker._opened_at -= settings.PAYMENT_GATEWAY_BREAKER_RESET_SECONDS
+        with mock.patch.object(self.gateway.client.order, "fetch", return_value={"id": "order_1"}):
+            self.gateway.fetch_order("order_1")
+        self.assertFalse(self.gateway.breaker.is_open)
+
+    def test_trial_answered_with_an_error_closes_the_breaker(self):
+        with mock.patch.object(self.gateway.client.order, "fetch", side_effect=requests.Timeout()):
+            with self.assertRaises(requests.Timeout):
+                self.gateway.fetch_order("order_1")
+        self.assertTrue(self.gateway.breaker.is_open)
+        self.gateway.breaker._opened_at -= settings.PAYMENT_GATEWAY_BREAKER_RESET_SECONDS
+        error = razorpay.errors.BadRequestError("The id provided does not exist")
+        with mock.patch.object(self.gateway.client.order, "fetch", side_effect=error):
+            with self.assertRaises(razorpay.errors.BadRequestError):
+                self.gateway.fetch_order("order_missing")
+        with mock.patch.object(self.gateway.client.order, "fetch", return_value={"id": "order_1"}):
+            self.assertEqual(self.gateway.fetch_order("order_1"), {"id": "order_1"})
+
+    def response(self, status, error):
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps({"error": error}).encode()
+        return response
+
+    def test_refused_requests_carry_status_and_error_code(self):
+        missing = self.response(400, {"code": "BAD_REQUEST_ERROR", "description": "The id provided does not exist", "field": "id"})
+        with mock.patch("requests.Session.request", return_value=missing):
+            with self.assertRaises(payments.OrderNotFound) as raised:
+                self.gateway.fetch_order("order_missing")
+        self.assertEqual(raised.exception.status, 400)
+        # Bad credentials share the code (and the wording) but are not about the order
+        unauthorized = self.response(401, {"code": "BAD_REQUEST_ERROR", "description": "The api key provided does not exist"})
+        with mock.patch("requests.Session.request", return_value=unauthorized):
+            with self.assertRaises(payments.GatewayRequestError) as raised:
+                self.gateway.fetch_order("order_1")
+        self.assertNotIsInstance(raised.exception, payments.OrderNotFound)
+        self.assertEqual(raised.exception.status, 401)
+        self.assertFalse(self.gateway.breaker.is_open)
+
+
+@override_settings(RAZORPAY_WEBHOOK_SECRET="whsec_test")
+class PaymentWebhookTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = get_user_model().objects.create_user(email="webhook@example.com", phone_number="5550006", password="pw")
+        cls.orders = [
+            Order.objects.create(user=user, total_amount=Decimal("10.00"), razorpay_order_id=f"order_wh{i}")
+            for i in range(20)
+        ]
+
+    def deliver(self, event_id, event, order_id, payment_id="pay_1", signature=None):
+        body, headers = sign_event({
+            "event": event,
+            "payload": {"payment": {"entity": {"id": payment_id, "order_id": order_id}}},
+        }, event_id=event_id)
+        if signature is not None:
+            headers["X-Razorpay-Signature"] = signature
+        return self.client.post("/api/payments/webhook/", body, content_type="application/json", headers=headers)
+
+    def test_unsigned_events_are_rejected(self):
+        response = self.deliver("evt_1", "payment.captured", "order_wh0", signature="0" * 64)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(PaymentEvent.objects.exists())
+
+    def post_signed(self, body):
+        headers = {"X-Razorpay-Signature": payments.compute_signature(settings.RAZORPAY_WEBHOOK_SECRET, body)}
+        return self.client.post("/api/payments/webhook/", body, content_type="application/json", headers=headers)
+
+    def test_signature_covers_the_raw_bytes(self):
+        body = b'{"event":"payment.captured","note":"\xff"}'
+        secret = settings.RAZORPAY_WEBHOOK_SECRET
+        # A signature over the body with bad bytes replaced must not pass for the raw body
+        replaced = {"X-Razorpay-Signature": payments.compute_signature(secret, body.decode("utf-8", "replace"))}
+        response = self.client.post("/api/payments/webhook/", body, content_type="application/json", headers=replaced)
+        self.assertEqual(response.data["detail"], "Invalid webhook signature.")
+        # Signed over the raw bytes it gets past the check, then fails as JSON
+        self.assertEqual(self.post_signed(body).data["detail"], "Invalid JSON body.")
+
+    def test_non_object_bodies_are_rejected(self):
+        for body in (b"[]", b'"payment.captured"', b"null"):
+            self.assertEqual(self.post_signed(body).status_code, 400)
+        self.assertFalse(PaymentEvent.objects.exists())
+
+    def test_malformed_events_do_not_block_the_queue(self):
+        for i, payload in enumerate([{"payment": ["not", "an", "object"]}, {"payment": {"entity": "pay_1"}},
+                                     {"order": {"entity": {"id": ["order_wh0"]}}}, "payload"]):
+            body, headers = sign_event({"event": "payment.captured", "payload": payload}, event_id=f"evt_bad{i}")
+            self.client.post("/api/payments/webhook/", body, content_type="application/json", headers=headers)
+        self.deliver("evt_good", "payment.captured", "order_wh3")
+        with self.assertLogs("store.payment_events", "ERROR") as logs:
+            self.assertEqual(process_payment_events(), (5, 1))
+        self.assertEqual(len(logs.records), 4)
+        self.assertEqual(Order.objects.get(razorpay_order_id="order_wh3").status, "PAID")
+        self.assertFalse(PaymentEvent.objects.filter(processed_at__isnull=True).exists())
+
+    def test_redelivered_events_are_stored_once(self):
+        for _ in range(3):
+            self.assertEqual(self.deliver("evt_1", "payment.captured", "order_wh0").status_code, 200)
+        self.assertEqual(PaymentEvent.objects.count(), 1)
+
+    def test_worker_applies_events_in_batches(self):
+        for i, order in enumerate(self.orders):
+            self.deliver(f"evt_c{i}", "payment.captured" if i % 2 else "payment.failed", order.razorpay_order_id, f"pay_{i}")
+        # A late failure never undoes a capture
+        self.deliver("evt_late", "payment.failed", "order_wh1", "pay_x")
+        self.deliver("evt_unknown", "payment.captured", "order_missing")
+
+        self.assertEqual(process_payment_events(batch_size=100), (22, 20))
+        statuses = dict(Order.objects.values_list("razorpay_order_id", "status"))
+        self.assertEqual(statuses["order_wh1"], "PAID")
+        self.assertEqual(statuses["order_wh2"], "FAILED")
+        self.assertEqual(Order.objects.get(razorpay_order_id="order_wh1").razorpay_payment_id, "pay_1")
+        self.assertFalse(PaymentEvent.objects.filter(processed_at__isnull=True).exists())
+        self.assertEqual(process_payment_events(), (0, 0))
+
+
+class ReconcilePendingOrdersTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email="reconcile@example.com", phone_number="5550007", password="pw")
+
+    def setUp(self):
+        self.gateway = payments.FakeGateway()
+
+    def order(self, gateway_status=None, age=timedelta(hours=2), status="PENDING"):
+        razorpay_order_id = None
+        if gateway_status is not None:
+            razorpay_order_id = self.gateway.create_order(100, "INR", {})["id"]
+            if gateway_status == "paid":
+                self.gateway.pay(razorpay_order_id)
+            self.gateway.orders[razorpay_order_id]["status"] = gateway_status
+        order = Order.objects.create(user=self.user, total_amount=Decimal("1.00"), status=status, razorpay_order_id=razorpay_order_id)
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - age)
+        return order.pk
+
+    def test_stale_orders_settle_from_gateway_status(self):
+        paid = [self.order("paid") for _ in range(5)]
+        failed = [self.order("attempted") for _ in range(3)]
+        cancelled = [self.order("created") for _ in range(4)] + [self.order()]
+        fresh = self.order("paid", age=timedelta(minutes=1))
+        settled = self.order("created", status="PAID")
+
+        stats = reconcile_pending_orders(timezone.now() - timedelta(hours=1), batch_size=4, workers=3, gateway=self.gateway)
+        self.assertEqual(stats["scanned"], 13)
+        self.assertEqual(stats["applied"], {"PAID": 5, "FAILED": 3, "CANCELLED": 5})
+        self.assertEqual(len(stats["latencies"]), 12)
+        statuses = dict(Order.objects.values_list("pk", "status"))
+        self.assertEqual({statuses[pk] for pk in paid}, {"PAID"})
+        payment_ids = dict(Order.objects.filter(pk__in=paid).values_list("razorpay_order_id", "razorpay_payment_id"))
+        self.assertEqual(payment_ids, {order_id: self.gateway.payments[order_id][0]["id"] for order_id in payment_ids})
+        self.assertEqual({statuses[pk] for pk in failed}, {"FAILED"})
+        self.assertEqual({statuses[pk] for pk in cancelled}, {"CANCELLED"})
+        self.assertEqual(statuses[fresh], "PENDING")
+        self.assertEqual(statuses[settled], "PAID")
+
+    def test_gateway_errors_leave_orders_pending(self):
+        pk = self.order("paid")
+        with mock.patch.object(self.gateway, "fetch_order", side_effect=requests.Timeout()), self.assertLogs("store.reconciliation", "ERROR"):
+            stats = reconcile_pending_orders(timezone.now() - timedelta(hours=1), gateway=self.gateway)
+        self.assertEqual(stats["errors"], 1)
+        self.assertEqual(Order.objects.get(pk=pk).status, "PENDING")
+
+    def test_orders_unknown_to_the_gateway_are_cancelled(self):
+        pk = self.order("paid")
+        self.gateway.orders.clear()
+        stats = reconcile_pending_orders(timezone.now() - timedelta(hours=1), gateway=self.gateway)
+        self.assertEqual(stats["applied"], {"CANCELLED": 1})
+        self.assertEqual(Order.objects.get(pk=pk).status, "CANCELLED")
+
+    def test_rejected_requests_leave_orders_pending(self):
+        pk = self.order("paid")
+        # Same code as an unknown id, and a message that says "does not exist"
+        error = payments.GatewayRequestError("The api key provided does not exist", 401, {"code": "BAD_REQUEST_ERROR"})
+        with mock.patch.object(self.gateway, "fetch_order", side_effect=error), self.assertLogs("store.reconciliation", "ERROR"):
+            stats = reconcile_pending_orders(timezone.now() - timedelta(hours=1), gateway=self.gateway)
+        self.assertEqual(stats["errors"], 1)
+        self.assertFalse(stats["applied"])
+        self.assertEqual(Order.objects.get(pk=pk).status, "PENDING")
+
+    def test_open_breaker_stops_the_run(self):
+        paid = self.order("paid")
+        later = [self.order("paid", age=timedelta(hours=1, minutes=30)) for _ in range(3)]
+        calls = []
+
+        def fetch_order(order_id):
+            calls.append(order_id)
+            if len(calls) > 1:
+                raise payments.GatewayUnavailable("breaker open")
+            return {"status": "paid"}
+
+        with mock.patch.object(self.gateway, "fetch_order", side_effect=fetch_order), \
+                self.assertLogs("store.reconciliation", "WARNING") as logs:
+            stats = reconcile_pending_orders(timezone.now() - timedelta(hours=1), batch_size=2, workers=1, gateway=self.gateway)
+        self.assertTrue(stats["unavailable"])
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(logs.records[0].levelname, "WARNING")
+        self.assertEqual(stats["applied"], {"PAID": 1})
+        self.assertEqual(Order.objects.get(pk=paid).status, "PAID")
+        self.assertEqual(set(Order.objects.filter(pk__in=later).values_list("status", flat=True)), {"PENDING"})
@@ -4,6 +4,7 @@ from .views import *
 urlpatterns = [
     path("cart/", CartView.as_view(), name="cart-detail"),
     path("cart/add/", CartAddView.as_view(), name="cart-add"),
+    path("cart/batch/", CartBatchView.as_view(), name="cart-batch"),
     path("cart/remove/", CartRemoveView.as_view(), name="cart-remove"),
     path("cart/clear/", CartClearView.as_view(), name="cart-clear"),
     path("wishlist/", WishlistListView.as_view(), name="wishlist-list"),
@@ -12,4 +13,5 @@ urlpatterns = [
     path("orders/place/", PlaceOrderView.as_view(), name="orders-place"),
     path("orders/", ListOrdersView.as_view(), name="orders-list"),
     path("orders/verify-payment/", VerifyRazorpayPaymentView.as_view(), name="orders-verify"),
+    path("payments/webhook/", PaymentWebhookView.as_view(), name="payments-webhook"),
 ]
@@ -3,20 +3,38 @@ from rest_framework import status, permissions
 from rest_framework.response import Response
 from .models import *
 from .serializers import *
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max
+from catalogs.fieldsets import plan_queryset
+from E_Commerce.db_router import ReplicaReadMixin
+from catalogs.cache import get_catalog_version
+from catalogs.conditional import conditional_get
+from .cart_store import get_cart_store
+from .payments import GatewayUnavailable, get_gateway
+from .idempotency import idempotent
+from .payment_events import EVENT_ID_HEADER, SIGNATURE_HEADER, event_id_for, verify_webhook
+import json
 from decimal import Decimal
-from django.db import transaction
-from django.conf import settings
-import razorpay
 
 def get_or_create_cart(user):
-    cart, _ = Cart.objects.get_or_create(user=user)
-    return cart
+    # Flushes pending cached changes first, so the database copy is current
+    return get_cart_store().get_cart(user)
+
+def cart_validators(view, request):
+    # Item lines embed product names, prices and images, so catalog writes count as changes too
+    cart = view.cart = get_or_create_cart(request.user)
+    return (cart.pk, cart.updated_at, get_catalog_version()), cart.updated_at
+
+def order_list_validators(view, request):
+    stats = Order.objects.filter(user=request.user).aggregate(changed=Max("updated_at"), count=Count("id"))
+    return (request.user.pk, stats["changed"], stats["count"], get_catalog_version()), stats["changed"]
 
 class CartView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @conditional_get(cart_validators)
     def get(self, request):
-        cart = get_or_create_cart(request.user)
+        cart = self.cart.load_for_display()
         serializer = CartSerializer(cart, context={"request": request})
         return Response(serializer.data)
 
@@ -27,20 +45,70 @@ class CartAddView(APIView):
         serializer = AddToCartSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         data = serializer.validated_data
-        cart = get_or_create_cart(request.user)
         product = data["product"]
         variation = data.get("variation")
         qty = data.get("qty", 1)
 
         price = variation.price if (variation and variation.price is not None) else product.price
 
-        cart_item, created = CartItem.objects.get_or_create(cart=cart, product=product, variation=variation,
-                                                            defaults={"qty": qty, "price_at_add": price})
-        if not created:
-            cart_item.qty += qty
-            cart_item.save()
+        get_cart_store().add(request.user, product, variation, qty, price)
         return Response({"detail": "Added to cart."}, status=status.HTTP_200_OK)
 
+class CartBatchView(APIView):
+    """
+    Applies a list of add / set_qty / remove operations in order, in one transaction,
+    and returns the resulting cart. Query count does not grow with the number of operations.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        operations = serializer.validated_data["operations"]
+        cart = get_or_create_cart(request.user)
+        try:
+            with get_cart_store().changing(request.user), transaction.atomic():
+                self.apply(cart, operations)
+        except IntegrityError:
+            # A concurrent request added one of the same lines first
+            return Response({"detail": "Cart changed concurrently, please retry."}, status=status.HTTP_409_CONFLICT)
+        return Response(CartSerializer(cart.load_for_display(), context={"request": request}).data)
+
+    def apply(self, cart, operations):
+        existing = list(CartItem.objects.select_for_update().filter(cart=cart, product_id__in={op["product_id"] for op in operations}))
+        lines = {(item.product_id, item.variation_id): item for item in existing}
+        changed = set()
+
+        for op in operations:
+            product, variation = op["product"], op["variation"]
+            key = (product.pk, variation.pk if variation else None)
+            if op["op"] == "remove":
+                matches = [k for k in lines if k == key or (variation is None and k[0] == product.pk)]
+                for k in matches:
+                    lines.pop(k)
+                continue
+            if op["op"] == "set_qty" and op["qty"] == 0:
+                lines.pop(key, None)
+                continue
+            item = lines.get(key)
+            if item is None:
+                price = variation.price if (variation and variation.price is not None) else product.price
+                item = lines[key] = CartItem(cart=cart, product=product, variation=variation, qty=0, price_at_add=price)
+            item.qty = item.qty + op["qty"] if op["op"] == "add" else op["qty"]
+            changed.add(key)
+
+        removed = [item.pk for item in existing if lines.get((item.product_id, item.variation_id)) is not item]
+        to_update = [item for key, item in lines.items() if key in changed and item.pk]
+        to_create = [item for key, item in lines.items() if key in changed and not item.pk]
+        if removed:
+            CartItem.objects.filter(pk__in=removed).delete()
+        if to_update:
+            CartItem.objects.bulk_update(to_update, ["qty"])
+        if to_create:
+            CartItem.objects.bulk_create(to_create)
+        if removed or to_update or to_create:
+            Cart.touch(cart.pk)
+
 class CartRemoveView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
@@ -48,23 +116,16 @@ class CartRemoveView(APIView):
         serializer = RemoveFromCartSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         data = serializer.validated_data
-        cart = get_or_create_cart(request.user)
+        store = get_cart_store()
         if data.get("cart_item_id"):
-            try:
-                item = CartItem.objects.get(pk=data["cart_item_id"], cart=cart)
-                item.delete()
-            except CartItem.DoesNotExist:
+            if not store.remove_item(request.user, data["cart_item_id"]):
                 return Response({"detail": "Cart item not found."}, status=status.HTTP_404_NOT_FOUND)
             return Response({"detail": "Removed from cart."})
         product_id = data.get("product_id")
         variation_id = data.get("variation_id")
         if not product_id:
             return Response({"detail": "Provide cart_item_id or product_id."}, status=status.HTTP_400_BAD_REQUEST)
-        qs = CartItem.objects.filter(cart=cart, product_id=product_id)
-        if variation_id is not None:
-            qs = qs.filter(variation_id=variation_id)
-        deleted, _ = qs.delete()
-        if deleted:
+        if store.remove_product(request.user, product_id, variation_id):
             return Response({"detail": "Removed from cart."})
         return Response({"detail": "No matching cart items found."}, status=status.HTTP_404_NOT_FOUND)
 
@@ -72,16 +133,16 @@ class CartClearView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request):
-        cart = get_or_create_cart(request.user)
-        cart.items.all().delete()
+        get_cart_store().clear(request.user)
         return Response({"detail": "Cart cleared."})
 
 class WishlistListView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        qs = WishlistItem.objects.filter(user=request.user).select_related("product")
-        serializer = WishlistSerializer(qs, many=True, context={"request": request})
+        context = {"request": request}
+        qs = plan_queryset(WishlistItem.objects.filter(user=request.user), WishlistSerializer(context=context))
+        serializer = WishlistSerializer(qs, many=True, context=context)
         return Response(serializer.data)
 
 class WishlistAddView(APIView):
@@ -109,33 +170,33 @@ class WishlistRemoveView(APIView):
         return Response({"detail": "Not found in wishlist."}, status=status.HTTP_404_NOT_FOUND)
 
 class PlaceOrderView(APIView):
+    """
+    Checkout in three steps so no database transaction or lock spans the gateway call:
+    a short transaction that turns the cart into a PENDING order, the Razorpay call,
+    then a single-row update recording the gateway's order id.
+    Clients may send an Idempotency-Key header to retry safely.
+    """
     permission_classes = [permissions.IsAuthenticated]
 
-    @transaction.atomic
+    @idempotent("orders.place")
     def post(self, request):
-        cart = get_or_create_cart(request.user)
-        items = cart.items.select_related("product", "variation").all()
-        if not items.exists():
+        get_cart_store().flush(request.user)
+        order = self.create_order(request.user)
+        if order is None:
             return Response({"detail": "Cart is empty."}, status=status.HTTP_400_BAD_REQUEST)
+        total = order.total_amount
 
-        total = Decimal("0.00")
-        for it in items:
-            total += it.line_total()
-
-        order = Order.objects.create(user=request.user, total_amount=total, status="PENDING")
-        for it in items:
-            OrderItem.objects.create(order=order, product=it.product, variation=it.variation, qty=it.qty, price_at_order=it.price_at_add)
-        
         try:
-            client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
-            razorpay_order = client.order.create({
-                "amount": int(total * 100),
-                "currency": "INR",
-                "payment_capture": 1,
-                "notes": {"local_order_id": str(order.id), "user": request.user.email},
-            })
+            razorpay_order = get_gateway().create_order(
+                amount=int(total * 100),
+                currency="INR",
+                notes={"local_order_id": str(order.id), "user": request.user.email},
+            )
             order.razorpay_order_id = razorpay_order.get("id")
-            order.save()
+            order.save(update_fields=["razorpay_order_id", "updated_at"])
+        except GatewayUnavailable as e:
+            order.delete()
+            return Response({"detail": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except Exception as e:
             # if Razorpay API fails, delete order
             order.delete()
@@ -146,12 +207,34 @@ class PlaceOrderView(APIView):
 
         return Response({"detail": "Order created.", "order_id": order.id, "total_amount": str(total), "razorpay_order_id": order.razorpay_order_id, "currency": "INR"}, status=status.HTTP_201_CREATED)
 
-class ListOrdersView(APIView):
+    @transaction.atomic
+    def create_order(self, user):
+        """Returns the new PENDING order with its items, or None for an empty cart. Four queries for any cart size."""
+        # The cart row lock serializes checkouts of one cart. Line upserts (add_qty) do not take it,
+        # so the lines and their amounts are read in one query and the total is summed from them.
+        cart = Cart.objects.select_for_update().filter(user=user).first()
+        lines = list(
+            cart.items.annotate(amount=LINE_AMOUNT).values_list("product_id", "variation_id", "qty", "price_at_add", "amount")
+        ) if cart else []
+        if not lines:
+            return None
+        total = sum((amount for *_, amount in lines), Decimal("0.00")).quantize(Decimal("0.01"))
+        order = Order.objects.create(user=user, total_amount=total, status="PENDING")
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_id=product_id, variation_id=variation_id, qty=qty, price_at_order=price)
+            for product_id, variation_id, qty, price, _ in lines
+        ])
+        return order
+
+class ListOrdersView(ReplicaReadMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @conditional_get(order_list_validators)
     def get(self, request):
-        qs = Order.objects.filter(user=request.user).prefetch_related("items__product")
-        serializer = OrderSerializer(qs, many=True)
+        # The request drives ?fields= and, as on the cart and catalog, absolute image URLs
+        context = {"request": request}
+        qs = plan_queryset(Order.objects.filter(user=request.user), OrderSerializer(context=context))
+        serializer = OrderSerializer(qs, many=True, context=context)
         return Response(serializer.data)
 
 class VerifyRazorpayPaymentView(APIView):
@@ -172,15 +255,8 @@ class VerifyRazorpayPaymentView(APIView):
         signature = data["razorpay_signature"]
         local_order_id = data["order_id"]
 
-        # Verify via Razorpay SDK (production-safe)
-        client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
-        try:
-            client.utility.verify_payment_signature({
-                "razorpay_order_id": razorpay_order_id,
-                "razorpay_payment_id": razorpay_payment_id,
-                "razorpay_signature": signature
-            })
-        except razorpay.errors.SignatureVerificationError:
+        # Local HMAC check, the same one the Razorpay SDK performs; no network call
+        if not get_gateway().verify_payment_signature(razorpay_order_id, razorpay_payment_id, signature):
             # mark as failed
             try:
                 order = Order.objects.get(id=local_order_id, user=request.user)
@@ -207,11 +283,41 @@ class VerifyRazorpayPaymentView(APIView):
 
         # Clear cart
         cart = get_or_create_cart(request.user)
-        for item in order.items.all():
-            CartItem.objects.filter(cart=cart, product=item.product, variation=item.variation).delete()
+        with get_cart_store().changing(request.user):
+            for item in order.items.all():
+                CartItem.objects.filter(cart=cart, product=item.product, variation=item.variation).delete()
+            Cart.touch(cart.pk)
 
         return Response({
             "detail": "Payment verified successfully.",
             "order_id": order.id,
             "status": order.status
         }, status=status.HTTP_200_OK)
+
+class PaymentWebhookView(APIView):
+    """
+    Razorpay webhook. Verifies the signature over the raw body, appends the event to the
+    PaymentEvent inbox (duplicates are ignored by event id) and answers at once;
+    the process_payment_events worker applies events to orders.
+    """
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+
+    def post(self, request):
+        body = request.body
+        if not verify_webhook(body, request.headers.get(SIGNATURE_HEADER)):
+            return Response({"detail": "Invalid webhook signature."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            event = json.loads(body)
+        except ValueError:
+            return Response({"detail": "Invalid JSON body."}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(event, dict):
+            return Response({"detail": "Webhook body must be a JSON object."}, status=status.HTTP_400_BAD_REQUEST)
+
+        event_id = event_id_for(body, request.headers.get(EVENT_ID_HEADER))
+        # A single INSERT ... ON CONFLICT DO NOTHING; redeliveries cost no extra lookup
+        PaymentEvent.objects.bulk_create(
+            [PaymentEvent(event_id=event_id, event=str(event.get("event", ""))[:100], payload=event)],
+            ignore_conflicts=True,
+        )
+        return Response({"detail": "Received."})